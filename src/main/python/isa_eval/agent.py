@@ -9,10 +9,21 @@ class EvalAgentOutput:
 
 
 class EvalAgent:
+    @property
+    def query_time_saved(self) -> float:
+        # seconds of querying avoided by the calling thread, see CachedEvalAgent
+        return 0.0
+
+    def identity(self) -> str:
+        # agents whose outputs depend on a configuration (checkpoint, sampling
+        # parameters, ...) should include it here, it is used as cache key
+        return f"{self.__class__.__module__}.{self.__class__.__qualname__}"
+
     def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
         pass
 
     def query_batch(
         self, states: List[str], gen_length: int
     ) -> List[List[EvalAgentOutput]]:
-        pass
+        # agents backed by a batched model should override this
+        return [self.query(state, gen_length) for state in states]
@@ -0,0 +1,420 @@
+import heapq
+import logging
+import random
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence
+
+from agent import EvalAgent, EvalAgentOutput
+from client import IsaEvalClient, IsaSetup, IsaState
+from evaluate import evaluate_isabelle_agent
+from frontier import FRONTIER_POLICIES, make_frontier
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+from search import IsaBestFirstSearch, SNode
+
+
+class _BenchNode:
+    __slots__ = ("score", "depth")
+
+    def __init__(self, score: float, depth: int) -> None:
+        self.score = score
+        self.depth = depth
+
+    def __lt__(self, other: "_BenchNode") -> bool:
+        return self.score < other.score
+
+
+class _ListFrontier:
+    # the frontier used by BestFirstSearch before frontier.py, kept as baseline
+    def __init__(self, capacity: int, on_evict: Callable) -> None:
+        self.capacity = capacity
+        self.on_evict = on_evict
+        self.pqueue: List[_BenchNode] = []
+
+    def push(self, node: _BenchNode) -> None:
+        pqueue = self.pqueue
+        heapq.heappush(pqueue, node)
+        if len(pqueue) > self.capacity:
+            max_score_idx = max(range(len(pqueue)), key=lambda i: pqueue[i].score)
+            self.on_evict(pqueue[max_score_idx])
+            del pqueue[max_score_idx]
+            heapq.heapify(pqueue)
+
+    def pop(self) -> _BenchNode:
+        return heapq.heappop(self.pqueue)
+
+    def __len__(self) -> int:
+        return len(self.pqueue)
+
+
+def benchmark_frontiers(
+    queue_lengths: Sequence[int] = (32, 128, 1024, 10000),
+    expansions: int = 500,
+    gen_length: int = 16,
+    seed: int = 0,
+) -> Dict[int, Dict[str, float]]:
+    # simulates the access pattern of the search: pop the best node, push
+    # `gen_length` children, evicting whenever the frontier is full
+    results = {}
+    for queue_length in queue_lengths:
+        results[queue_length] = {}
+        for policy in ["list"] + FRONTIER_POLICIES:
+            rng = random.Random(seed)
+            evicted = []
+            if policy == "list":
+                frontier = _ListFrontier(queue_length, evicted.append)
+            else:
+                frontier = make_frontier(
+                    policy, queue_length, max(queue_length // 8, 1), evicted.append
+                )
+            for _ in range(queue_length):
+                frontier.push(_BenchNode(rng.random() * 10, rng.randint(1, 8)))
+
+            time_before = time.perf_counter()
+            for _ in range(expansions):
+                if len(frontier) == 0:
+                    break
+                parent = frontier.pop()
+                for _ in range(gen_length):
+                    frontier.push(
+                        _BenchNode(parent.score + rng.random(), parent.depth + 1)
+                    )
+            elapsed = time.perf_counter() - time_before
+            results[queue_length][policy] = elapsed / (expansions * (gen_length + 1))
+    return results
+
+
+def print_frontier_benchmark(results: Dict[int, Dict[str, float]]) -> None:
+    policies = ["list"] + FRONTIER_POLICIES
+    print(f"{'queue length':>12} " + " ".join(f"{p:>14}" for p in policies))
+    for queue_length, timings in results.items():
+        print(
+            f"{queue_length:>12} "
+            + " ".join(f"{timings[p] * 1e6:>11.2f} us" for p in policies)
+        )
+
+
+class _ListPathNode:
+    # the search node used before SNode, kept as baseline: every node holds
+    # its own copy of the proof path
+    def __init__(self, score: float, proof_steps: List[str], state: IsaState):
+        self.score = score
+        self.proof_steps = proof_steps
+        self.state = state
+
+    @property
+    def depth(self) -> int:
+        return len(self.proof_steps)
+
+    def __lt__(self, other: "_ListPathNode") -> bool:
+        return self.score < other.score
+
+
+def benchmark_node_memory(
+    queue_lengths: Sequence[int] = (1000, 5000),
+    expansions: int = 3000,
+    gen_length: int = 16,
+    goal_size: int = 1000,
+    unchanged_prob: float = 0.3,
+    seed: int = 0,
+) -> Dict[int, Dict[str, float]]:
+    # peak memory of the nodes of a deep search: the best child is always the
+    # deepest, and with `unchanged_prob` a tactic leaves the goal as it was,
+    # which the client still decodes into a new string
+    results = {}
+    for queue_length in queue_lengths:
+        results[queue_length] = {}
+        for layout in ["list", "snode"]:
+            rng = random.Random(seed)
+            tracemalloc.start()
+            frontier = make_frontier("best_first", queue_length)
+            goal = "x" * goal_size
+            if layout == "list":
+                frontier.push(_ListPathNode(0.0, [], IsaState("0", "", "", 1, goal)))
+            else:
+                frontier.push(SNode(0.0, IsaState("0", "", "", 1, goal)))
+            max_depth = 0
+            for expansion in range(expansions):
+                if len(frontier) == 0:
+                    break
+                node = frontier.pop()
+                max_depth = max(max_depth, node.depth)
+                for child in range(gen_length):
+                    command = f"apply (tactic_{rng.randrange(1000)})"
+                    if rng.random() < unchanged_prob:
+                        text = "".join(list(node.state.state))
+                    else:
+                        text = f"{expansion}-{child}".ljust(goal_size, "x")
+                    state = IsaState(f"{expansion}-{child}", "SUCCESS", "", 1, text)
+                    score = node.score - rng.random()
+                    if layout == "list":
+                        frontier.push(
+                            _ListPathNode(score, node.proof_steps + [command], state)
+                        )
+                    else:
+                        state.state = sys.intern(state.state)
+                        frontier.push(SNode(score, state, node, command))
+                if layout == "snode":
+                    node.state = None
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[queue_length][layout] = peak_memory / 2**20
+            results[queue_length]["max_depth"] = max_depth
+    return results
+
+
+def print_node_memory_benchmark(results: Dict[int, Dict[str, float]]) -> None:
+    print(f"{'queue length':>12} {'max depth':>10} {'list MB':>10} {'SNode MB':>10}")
+    for queue_length, result in results.items():
+        print(
+            f"{queue_length:>12} {result['max_depth']:>10} "
+            f"{result['list']:>10.1f} {result['snode']:>10.1f}"
+        )
+
+
+class _BenchAgent(EvalAgent):
+    # proposes tactics from a small vocabulary, deterministically per state so
+    # that runs with the same seed explore the same search tree
+    def __init__(self, vocabulary_size: int = 40) -> None:
+        self.vocabulary_size = vocabulary_size
+
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        rng = random.Random(state)
+        return [
+            EvalAgentOutput(
+                f"tactic_{rng.randrange(self.vocabulary_size)}", rng.random()
+            )
+            for _ in range(gen_length)
+        ]
+
+
+def _quiet_solver(**kwargs) -> IsaBestFirstSearch:
+    logger = logging.getLogger("Benchmark")
+    logger.setLevel(logging.WARNING)
+    return IsaBestFirstSearch(logger=logger, **kwargs)
+
+
+def benchmark_search(
+    config: Optional[MockConfig] = None,
+    lemma_num: int = 10,
+    gen_length: int = 16,
+    batch_size: int = 1,
+    pipelined: bool = False,
+) -> Dict[str, float]:
+    # nodes per second of BestFirstSearch.solve against the mock server, with
+    # the default config of time_scale 0 this is the Python and gRPC overhead
+    config = config if config is not None else MockConfig(time_scale=0.0)
+    solver = _quiet_solver(
+        gen_length=gen_length, batch_size=batch_size, pipelined=pipelined
+    )
+    with tempfile.TemporaryDirectory() as directory, MockIsaEvalServer(
+        config=config
+    ) as server:
+        (thy_path,) = write_mock_theories(directory, 1, lemma_num)
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", Path(directory), None))
+        lemmas = [
+            line
+            for line in thy_path.read_text().splitlines()
+            if line.startswith("lemma")
+        ]
+        generated_num = 0
+        solved_num = 0
+        time_before = time.perf_counter()
+        for lemma in lemmas:
+            state = client.proceed_until(thy_path, lemma, 60)
+            solved, _, summary = solver.solve(state, _BenchAgent(), client)
+            generated_num += summary.generated_num
+            solved_num += solved
+        elapsed = time.perf_counter() - time_before
+        client.close_itp()
+    return {
+        "nodes_per_second": generated_num / elapsed,
+        "generated": generated_num,
+        "solved": solved_num,
+        "seconds": elapsed,
+    }
+
+
+def benchmark_search_memory(
+    queue_lengths: Sequence[int] = (1000, 5000),
+    query_limit: int = 2000,
+    gen_length: int = 16,
+) -> Dict[int, Dict[str, float]]:
+    # peak traced memory of one deep search against the mock server, the
+    # lemma needs more steps than the query limit allows, so the frontier fills
+    # up to `queue_length`
+    config = MockConfig(
+        time_scale=0.0, success_prob=0.9, timeout_prob=0.0, proof_depth=10**6
+    )
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, MockIsaEvalServer(
+        config=config
+    ) as server:
+        (thy_path,) = write_mock_theories(directory, 1, 1)
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", Path(directory), None))
+        lemma = next(
+            line
+            for line in thy_path.read_text().splitlines()
+            if line.startswith("lemma")
+        )
+        for queue_length in queue_lengths:
+            solver = _quiet_solver(
+                gen_length=gen_length,
+                query_limit=query_limit,
+                queue_length=queue_length,
+            )
+            state = client.proceed_until(thy_path, lemma, 60)
+            tracemalloc.start()
+            time_before = time.perf_counter()
+            _, _, summary = solver.solve(state, _BenchAgent(), client)
+            elapsed = time.perf_counter() - time_before
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results[queue_length] = {
+                "seconds": elapsed,
+                "generated": summary.generated_num,
+                "peak_traced_mb": peak_memory / 2**20,
+            }
+        client.close_itp()
+    return results
+
+
+def benchmark_execute_many(
+    command_nums: Sequence[int] = (1, 16, 64), repeats: int = 50
+) -> Dict[int, Dict[str, float]]:
+    # client overhead per command of the execution RPCs, without latency
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, MockIsaEvalServer(
+        config=MockConfig(time_scale=0.0)
+    ) as server:
+        (thy_path,) = write_mock_theories(directory, 1, 1)
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", Path(directory), None))
+        state = client.proceed_until(thy_path, 'lemma mock_0_0: "P 0 0"', 60)
+        for command_num in command_nums:
+            commands = [f"tactic_{i}" for i in range(command_num)]
+            methods = {
+                "execute_many": lambda: client.execute_many(
+                    state.state_id, commands, 10
+                ),
+                "iter_execute_many": lambda: [
+                    outcome
+                    for _, outcome in client.iter_execute_many(
+                        state.state_id, commands, 10
+                    )
+                ],
+                "execute_batch": lambda: client.execute_batch(
+                    [(state.state_id, command) for command in commands], 10
+                ),
+            }
+            results[command_num] = {}
+            for name, method in methods.items():
+                time_before = time.perf_counter()
+                for _ in range(repeats):
+                    outcomes = method()
+                    client.remove_states([o.state_id for o in outcomes])
+                elapsed = time.perf_counter() - time_before
+                results[command_num][name] = elapsed / (repeats * command_num)
+        client.close_itp()
+    return results
+
+
+def benchmark_evaluation(
+    config: Optional[MockConfig] = None,
+    theory_num: int = 2,
+    lemma_num: int = 8,
+    parallel_searches_lst: Sequence[int] = (1, 2, 4),
+) -> Dict[int, Dict[str, float]]:
+    # wall time and memory of evaluate_isabelle_agent over mock theories
+    config = config if config is not None else MockConfig(time_scale=0.02)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory, MockIsaEvalServer(
+        config=config
+    ) as server:
+        write_mock_theories(directory, theory_num, lemma_num)
+        logging.disable(logging.INFO)
+        try:
+            for parallel_searches in parallel_searches_lst:
+                tracemalloc.start()
+                time_before = time.perf_counter()
+                records, _ = evaluate_isabelle_agent(
+                    "/mock",
+                    directory,
+                    _BenchAgent(),
+                    _quiet_solver(gen_length=16),
+                    port=server.port,
+                    parallel_searches=parallel_searches,
+                )
+                elapsed = time.perf_counter() - time_before
+                _, peak_memory = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results[parallel_searches] = {
+                    "seconds": elapsed,
+                    "lemmas_per_second": len(records) / elapsed,
+                    "solved": sum(r.solved for r in records.values()),
+                    "peak_traced_mb": peak_memory / 2**20,
+                    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                    / 1024,
+                }
+        finally:
+            logging.disable(logging.NOTSET)
+    return results
+
+
+def print_execute_many_benchmark(results: Dict[int, Dict[str, float]]) -> None:
+    methods = list(next(iter(results.values())))
+    print(f"{'commands':>8} " + " ".join(f"{m:>18}" for m in methods))
+    for command_num, timings in results.items():
+        print(
+            f"{command_num:>8} "
+            + " ".join(f"{timings[m] * 1e6:>15.1f} us" for m in methods)
+        )
+
+
+def print_evaluation_benchmark(results: Dict[int, Dict[str, float]]) -> None:
+    print(
+        f"{'parallel':>8} {'seconds':>10} {'lemmas/s':>10} {'solved':>7}"
+        f" {'peak traced':>12} {'max rss':>10}"
+    )
+    for parallel_searches, result in results.items():
+        print(
+            f"{parallel_searches:>8} {result['seconds']:>10.2f}"
+            f" {result['lemmas_per_second']:>10.2f} {result['solved']:>7}"
+            f" {result['peak_traced_mb']:>9.1f} MB {result['max_rss_mb']:>7.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    print("Frontier operations (average time per push / pop)")
+    print_frontier_benchmark(benchmark_frontiers())
+    print()
+    print("Peak memory of search nodes in deep searches")
+    print_node_memory_benchmark(benchmark_node_memory())
+    print()
+    print("Search throughput against the mock server without latency")
+    for batch_size, pipelined in [(1, False), (4, False), (4, True)]:
+        result = benchmark_search(batch_size=batch_size, pipelined=pipelined)
+        print(
+            f"batch size {batch_size}, pipelined {pipelined}: "
+            f"{result['nodes_per_second']:.0f} nodes/s "
+            f"({result['generated']} nodes, {result['solved']} solved)"
+        )
+    print()
+    print("Peak memory of deep searches against the mock server")
+    for queue_length, result in benchmark_search_memory().items():
+        print(
+            f"queue length {queue_length}: {result['peak_traced_mb']:.1f} MB "
+            f"({result['generated']} nodes in {result['seconds']:.1f}s)"
+        )
+    print()
+    print("Client overhead per command")
+    print_execute_many_benchmark(benchmark_execute_many())
+    print()
+    print("Evaluation of mock theories (simulated latency scaled by 0.02)")
+    print_evaluation_benchmark(benchmark_evaluation())
@@ -0,0 +1,856 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import astuple, dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+from agent import EvalAgent, EvalAgentOutput
+from client import (
+    CancellationToken,
+    EvalClient,
+    ITPCommand,
+    ITPSetup,
+    ITPState,
+    IsaCommand,
+    IsaState,
+)
+
+
+class StaleStateError(LookupError):
+    pass
+
+
+def fingerprint(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+@dataclass
+class CachedOutcome:
+    result: str
+    message: str
+    proof_level: int
+    state: str
+    timeout: int
+
+    def usable_for(self, timeout: int) -> bool:
+        # a timeout only says that the command needs more than `self.timeout`
+        return self.result != "TIMEOUT" or timeout <= self.timeout
+
+
+class TacticCache:
+    def __init__(
+        self,
+        path: Union[os.PathLike, str],
+        max_entries: int = 1_000_000,
+        eviction_interval: int = 1000,
+        track_access: bool = True,
+    ):
+        # without `track_access`, hits are read-only and entries are evicted
+        # in insertion order
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.eviction_interval = eviction_interval
+        self.track_access = track_access
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._puts_since_eviction = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # several evaluation processes may share one cache file
+        self.connection = sqlite3.connect(
+            self.path, timeout=60, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS outcomes (key TEXT PRIMARY KEY, "
+            "result TEXT, message TEXT, proof_level INTEGER, state TEXT, "
+            "timeout INTEGER, last_access REAL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS outcomes_last_access ON outcomes(last_access)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(context: str, state: str, command: str) -> str:
+        return fingerprint(context, state, command.strip())
+
+    def get(self, key: str, timeout: int) -> Optional[CachedOutcome]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT result, message, proof_level, state, timeout FROM outcomes "
+                "WHERE key = ?",
+                (key,),
+            ).fetchone()
+            outcome = CachedOutcome(*row) if row is not None else None
+            if outcome is None or not outcome.usable_for(timeout):
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.track_access:
+                self.connection.execute(
+                    "UPDATE outcomes SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                self.connection.commit()
+            return outcome
+
+    def put(self, key: str, outcome: CachedOutcome) -> None:
+        if outcome.result not in ["SUCCESS", "ERROR", "TIMEOUT"]:
+            return
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, *astuple(outcome), time.time()),
+            )
+            self.connection.commit()
+            self._puts_since_eviction += 1
+            if self._puts_since_eviction >= self.eviction_interval:
+                self._puts_since_eviction = 0
+                self._evict()
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self.connection.execute("DELETE FROM outcomes WHERE key = ?", (key,))
+            self.connection.commit()
+
+    def _evict(self) -> None:
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM outcomes").fetchone()
+        if count <= self.max_entries:
+            return
+        # least recently used entries go first
+        self.connection.execute(
+            "DELETE FROM outcomes WHERE key IN (SELECT key FROM outcomes "
+            "ORDER BY last_access LIMIT ?)",
+            (count - self.max_entries,),
+        )
+        self.connection.commit()
+        self.evictions += count - self.max_entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self.connection.execute(
+                "SELECT COUNT(*) FROM outcomes"
+            ).fetchone()
+        return count
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+class CachingEvalClient(EvalClient):
+    # Outcomes are keyed by (context fingerprint, goal state, command), where
+    # the context is the setup plus the theory text before the current lemma
+    # and the commands executed on the default state since then. Cached
+    # failures never reach the ITP. Cached successes get a lazy state id and
+    # are only executed when the search continues from them; a lazy state
+    # whose command fails then is stale, and commands on it fail as well.
+    # Successes that finish the proof are always executed again.
+    CACHED_PREFIX = "cached-"
+    LAZY_PREFIX = "lazy-"
+    STALE_MESSAGE = "stale cached outcome"
+
+    def __init__(self, client: EvalClient, cache: TacticCache):
+        super().__init__(client.port)
+        self.client = client
+        self.cache = cache
+        self.setup_fingerprint = ""
+        self._lock = threading.RLock()
+        self._contexts: Dict[str, str] = {}
+        self._texts: Dict[str, str] = {}
+        self._lazy: Dict[str, Tuple[str, str, int, str]] = {}
+        self._lazy_children: Dict[str, Set[str]] = {}
+        self._materialized: Dict[str, str] = {}
+        self._resolving: Dict[str, Future] = {}
+        self._stale: Set[str] = set()
+        self._deferred_removals: Set[str] = set()
+
+    def _reset(self) -> None:
+        self._contexts.clear()
+        self._texts.clear()
+        self._lazy.clear()
+        self._lazy_children.clear()
+        self._materialized.clear()
+        self._resolving.clear()
+        self._stale.clear()
+        self._deferred_removals.clear()
+
+    def _track(self, state: ITPState, context: str) -> None:
+        self._contexts[state.state_id] = context
+        self._texts[state.state_id] = state.state
+
+    def _new_id(self, prefix: str) -> str:
+        return prefix + uuid.uuid4().hex
+
+    def _resolve(self, state_id: str) -> Optional[str]:
+        # returns the id of the state on the server, executing lazy states,
+        # or None if the state is stale
+        with self._lock:
+            if state_id in self._materialized:
+                return self._materialized[state_id]
+            if state_id in self._stale:
+                return None
+            resolving = self._resolving.get(state_id)
+            if resolving is not None:
+                owner = False
+            elif state_id in self._lazy:
+                resolving = self._resolving[state_id] = Future()
+                parent_id, command, timeout, key = self._lazy[state_id]
+                owner = True
+            else:
+                return state_id
+        # another thread is executing the command already
+        if not owner:
+            return resolving.result()
+
+        # the lock is not held during the RPC, concurrent searches share it
+        try:
+            real_parent_id = self._resolve(parent_id)
+            outcome = None
+            if real_parent_id is not None:
+                (outcome,) = self.client.execute_many(
+                    real_parent_id, [command], timeout
+                )
+        except BaseException as error:
+            with self._lock:
+                self._resolving.pop(state_id, None)
+            resolving.set_exception(error)
+            raise
+        removals = []
+        with self._lock:
+            self._resolving.pop(state_id, None)
+            self._lazy.pop(state_id, None)
+            if outcome is not None and outcome.result == "SUCCESS":
+                real_id = outcome.state_id
+                self._materialized[state_id] = real_id
+                self._contexts[real_id] = self._contexts.get(state_id)
+                self._texts[real_id] = outcome.state
+            else:
+                real_id = None
+                self._stale.add(state_id)
+                self.cache.invalidate(key)
+                if outcome is not None:
+                    removals.append(outcome.state_id)
+            removals += self._release_lazy_child(parent_id, state_id)
+            # the state was removed while its command was running
+            if (
+                state_id in self._deferred_removals
+                and state_id not in self._lazy_children
+            ):
+                self._deferred_removals.discard(state_id)
+                removals += self._forget(state_id)
+        if len(removals) > 0:
+            self.client.remove_states(removals)
+        resolving.set_result(real_id)
+        return real_id
+
+    def _stale_outcome(self, state_id: str) -> ITPState:
+        with self._lock:
+            text = self._texts.get(state_id, "")
+        return IsaState(
+            self._new_id(self.CACHED_PREFIX), "ERROR", self.STALE_MESSAGE, -1, text
+        )
+
+    def _resolve_existing(self, state_id: str) -> str:
+        real_id = self._resolve(state_id)
+        if real_id is None:
+            raise StaleStateError(f"{state_id} is a stale cached state")
+        return real_id
+
+    def _release_lazy_child(self, parent_id: str, child_id: str) -> List[str]:
+        children = self._lazy_children.get(parent_id)
+        if children is None:
+            return []
+        children.discard(child_id)
+        if len(children) == 0:
+            del self._lazy_children[parent_id]
+            if parent_id in self._deferred_removals:
+                self._deferred_removals.discard(parent_id)
+                return self._forget(parent_id)
+        return []
+
+    def open_stub(self) -> None:
+        self.client.open_stub()
+
+    def close(self) -> None:
+        self.client.close()
+
+    def setup_itp(self, setup: ITPSetup, force_new: bool = False) -> ITPSetup:
+        self.setup = None
+        self.setup_fingerprint = fingerprint(*map(str, astuple(setup)))
+        with self._lock:
+            self._reset()
+        response = self.client.setup_itp(setup, force_new)
+        self.setup = setup
+        return response
+
+    def close_itp(self, keep_warm: bool = False) -> None:
+        self.setup = None
+        with self._lock:
+            self._reset()
+        self.client.close_itp(keep_warm)
+
+    def _proceed_context(self, thy_path: Path, content: str) -> str:
+        thy_text = Path(thy_path).read_text(encoding="utf-8")
+        prefix_end = thy_text.find(content)
+        prefix = thy_text[: prefix_end + len(content)] if prefix_end >= 0 else content
+        return fingerprint(self.setup_fingerprint, prefix)
+
+    def _cacheable(self, command: str) -> bool:
+        # sledgehammer results depend on the provers, and its lazy successes
+        # could not be replayed with the same command
+        return command.strip().lower() != "sledgehammer"
+
+    def _cached(self, key: str, timeout: int) -> Optional[CachedOutcome]:
+        return self.cache.get(key, timeout)
+
+    def _servable(self, cached: CachedOutcome) -> bool:
+        # a proof is only reported once the ITP has checked it
+        return cached.result != "SUCCESS" or cached.proof_level != 0
+
+    def proceed_until(self, thy_path: Path, content: str, timeout: int) -> ITPState:
+        state = self.client.proceed_until(thy_path, content, timeout)
+        context = self._proceed_context(thy_path, content)
+        with self._lock:
+            self._reset()
+            self._track(state, context)
+        return state
+
+    def execute(self, state_id: str, commands: str, timeout: int) -> ITPState:
+        with self._lock:
+            context = self._contexts.get(state_id)
+            text = self._texts.get(state_id)
+        cacheable = context is not None and self._cacheable(commands)
+        key = TacticCache.make_key(context, text, commands) if cacheable else None
+        # executing on a state changes it in place, so only failures (which
+        # leave the state unchanged) can be answered from the cache
+        cached = self._cached(key, timeout) if cacheable else None
+        if cached is not None and cached.result != "SUCCESS":
+            state = IsaState(
+                state_id, cached.result, cached.message, cached.proof_level, text
+            )
+        else:
+            real_id = self._resolve(state_id)
+            if real_id is None:
+                return self._stale_outcome(state_id)
+            state = self.client.execute(real_id, commands, timeout)
+            if cacheable:
+                self.cache.put(
+                    key,
+                    CachedOutcome(
+                        state.result,
+                        state.message,
+                        state.proof_level,
+                        state.state,
+                        timeout,
+                    ),
+                )
+        if context is not None:
+            with self._lock:
+                self._track(state, fingerprint(context, commands.strip()))
+        return state
+
+    def _lookup_many(
+        self,
+        state_id: str,
+        commands_lst: List[str],
+        timeout: int,
+        timeouts: Optional[List[int]] = None,
+    ) -> Tuple[Dict[int, ITPState], List[int], Optional[str], List[Optional[str]]]:
+        with self._lock:
+            context = self._contexts.get(state_id)
+            text = self._texts.get(state_id)
+        hits: Dict[int, ITPState] = {}
+        keys: List[Optional[str]] = []
+        misses: List[int] = []
+        for idx, command in enumerate(commands_lst):
+            if context is None or not self._cacheable(command):
+                keys.append(None)
+                misses.append(idx)
+                continue
+            key = TacticCache.make_key(context, text, command)
+            keys.append(key)
+            command_timeout = timeouts[idx] if timeouts is not None else timeout
+            cached = self._cached(key, command_timeout)
+            if cached is None or not self._servable(cached):
+                misses.append(idx)
+                continue
+            with self._lock:
+                if cached.result == "SUCCESS":
+                    new_id = self._new_id(self.LAZY_PREFIX)
+                    self._lazy[new_id] = (state_id, command, command_timeout, key)
+                    self._lazy_children.setdefault(state_id, set()).add(new_id)
+                    hits[idx] = IsaState(
+                        new_id,
+                        "SUCCESS",
+                        cached.message,
+                        cached.proof_level,
+                        cached.state,
+                    )
+                else:
+                    new_id = self._new_id(self.CACHED_PREFIX)
+                    hits[idx] = IsaState(
+                        new_id, cached.result, cached.message, cached.proof_level, text
+                    )
+                self._track(hits[idx], context)
+        return hits, misses, context, keys
+
+    def _store(
+        self,
+        key: Optional[str],
+        context: Optional[str],
+        state: ITPState,
+        timeout: int,
+    ) -> None:
+        if key is not None:
+            self.cache.put(
+                key,
+                CachedOutcome(
+                    state.result, state.message, state.proof_level, state.state, timeout
+                ),
+            )
+        if context is not None:
+            with self._lock:
+                self._track(state, context)
+
+    def execute_many(
+        self, state_id: str, commands_lst: List[str], timeout: int
+    ) -> List[ITPState]:
+        hits, misses, context, keys = self._lookup_many(state_id, commands_lst, timeout)
+        outputs: List[Optional[ITPState]] = [
+            hits.get(i) for i in range(len(commands_lst))
+        ]
+        if len(misses) > 0:
+            real_id = self._resolve(state_id)
+            if real_id is None:
+                for idx in misses:
+                    outputs[idx] = self._stale_outcome(state_id)
+                return outputs
+            missed_states = self.client.execute_many(
+                real_id, [commands_lst[i] for i in misses], timeout
+            )
+            for idx, state in zip(misses, missed_states):
+                self._store(keys[idx], context, state, timeout)
+                outputs[idx] = state
+        return outputs
+
+    def iter_execute_many(
+        self,
+        state_id: str,
+        commands_lst: List[str],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+    ) -> Iterator[Tuple[int, ITPState]]:
+        hits, misses, context, keys = self._lookup_many(state_id, commands_lst, timeout)
+        yield from hits.items()
+        if len(misses) == 0 or (token is not None and token.cancelled):
+            return
+        real_id = self._resolve(state_id)
+        if real_id is None:
+            for idx in misses:
+                yield idx, self._stale_outcome(state_id)
+            return
+        for miss_idx, state in self.client.iter_execute_many(
+            real_id, [commands_lst[i] for i in misses], timeout, token
+        ):
+            idx = misses[miss_idx]
+            self._store(keys[idx], context, state, timeout)
+            yield idx, state
+
+    def iter_execute_batch(
+        self,
+        requests: List[Tuple[str, str]],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+        timeouts: Optional[List[int]] = None,
+    ) -> Iterator[Tuple[int, ITPState]]:
+        if timeouts is None:
+            timeouts = [timeout] * len(requests)
+        parent_indices: Dict[str, List[int]] = {}
+        for idx, (state_id, _) in enumerate(requests):
+            parent_indices.setdefault(state_id, []).append(idx)
+        # (request index, cache key, context) of the commands sent to the ITP
+        missed: List[Tuple[int, Optional[str], Optional[str]]] = []
+        for state_id, indices in parent_indices.items():
+            hits, misses, context, keys = self._lookup_many(
+                state_id,
+                [requests[idx][1] for idx in indices],
+                timeout,
+                [timeouts[idx] for idx in indices],
+            )
+            for local_idx, state in hits.items():
+                yield indices[local_idx], state
+            missed += [(indices[i], keys[i], context) for i in misses]
+        if len(missed) == 0 or (token is not None and token.cancelled):
+            return
+        real_ids = {
+            state_id: self._resolve(state_id)
+            for state_id in dict.fromkeys(requests[idx][0] for idx, _, _ in missed)
+        }
+        for idx, _, _ in missed:
+            if real_ids[requests[idx][0]] is None:
+                yield idx, self._stale_outcome(requests[idx][0])
+        missed = [m for m in missed if real_ids[requests[m[0]][0]] is not None]
+        if len(missed) == 0:
+            return
+        for miss_idx, state in self.client.iter_execute_batch(
+            [(real_ids[requests[idx][0]], requests[idx][1]) for idx, _, _ in missed],
+            timeout,
+            token,
+            [timeouts[idx] for idx, _, _ in missed],
+        ):
+            idx, key, context = missed[miss_idx]
+            self._store(key, context, state, timeouts[idx])
+            yield idx, state
+
+    def clone_state(self, state_id: str) -> ITPState:
+        state = self.client.clone_state(self._resolve_existing(state_id))
+        with self._lock:
+            if state_id in self._contexts:
+                self._track(state, self._contexts[state_id])
+        return state
+
+    def _forget(self, state_id: str) -> List[str]:
+        # returns the ids of the states to remove from the ITP
+        self._contexts.pop(state_id, None)
+        self._texts.pop(state_id, None)
+        if state_id.startswith(self.CACHED_PREFIX):
+            return []
+        # lazy children still need their parent to be materialized, and a
+        # state whose command is running is removed once it finished
+        if state_id in self._lazy_children or state_id in self._resolving:
+            self._deferred_removals.add(state_id)
+            return []
+        if state_id in self._lazy:
+            parent_id = self._lazy.pop(state_id)[0]
+            return self._release_lazy_child(parent_id, state_id)
+        if state_id in self._stale:
+            self._stale.discard(state_id)
+            return []
+        return [self._materialized.pop(state_id, state_id)]
+
+    def remove_state(self, state_id: str) -> None:
+        with self._lock:
+            real_ids = self._forget(state_id)
+        for real_id in real_ids:
+            self.client.remove_state(real_id)
+
+    def remove_states(self, state_ids: List[str]) -> None:
+        with self._lock:
+            real_ids = [
+                real_id for state_id in state_ids for real_id in self._forget(state_id)
+            ]
+        if len(real_ids) > 0:
+            self.client.remove_states(real_ids)
+
+    def clear_and_rename_state(self, state_id: str, new_state_id: str) -> ITPState:
+        real_id = self._resolve_existing(state_id)
+        state = self.client.clear_and_rename_state(real_id, new_state_id)
+        with self._lock:
+            context = self._contexts.get(state_id)
+            self._reset()
+            if context is not None:
+                self._track(state, context)
+        return state
+
+    def get_theory_commands(
+        self, thy_path: Path, only_statements: bool, remove_ignored: bool
+    ) -> List[ITPCommand]:
+        return self.client.get_theory_commands(
+            thy_path, only_statements, remove_ignored
+        )
+
+    def call_sledgehammer(
+        self, state_id: str, timeout: int, sledgehammer_timeout: int
+    ) -> ITPState:
+        real_id = self._resolve(state_id)
+        if real_id is None:
+            return self._stale_outcome(state_id)
+        state = self.client.call_sledgehammer(real_id, timeout, sledgehammer_timeout)
+        with self._lock:
+            if state_id in self._contexts:
+                self._track(state, self._contexts[state_id])
+        return state
+
+
+class TheoryCommandsCache:
+    # parsed GetTheoryCommands results, keyed by the file content and the
+    # setup; entries are stored as compressed pickles of plain tuples, and
+    # the entry of an older version of the same file is replaced on put
+    def __init__(self, path: Union[os.PathLike, str]):
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(
+            self.path, timeout=60, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS theory_commands "
+            "(key TEXT PRIMARY KEY, source TEXT, commands BLOB)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS theory_commands_source "
+            "ON theory_commands(source)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_source(
+        setup: Optional[ITPSetup],
+        thy_path: Path,
+        only_statements: bool,
+        remove_ignored: bool,
+    ) -> str:
+        setup_parts = map(str, astuple(setup)) if setup is not None else []
+        return fingerprint(
+            *setup_parts,
+            str(Path(thy_path).resolve()),
+            str(only_statements),
+            str(remove_ignored),
+        )
+
+    @classmethod
+    def make_key(
+        cls,
+        setup: Optional[ITPSetup],
+        thy_path: Path,
+        only_statements: bool,
+        remove_ignored: bool,
+    ) -> Tuple[str, str]:
+        # returns the source and the key of the current content of the file
+        source = cls.make_source(setup, thy_path, only_statements, remove_ignored)
+        key = fingerprint(
+            source, hashlib.sha256(Path(thy_path).read_bytes()).hexdigest()
+        )
+        return source, key
+
+    def get(self, key: str) -> Optional[List[IsaCommand]]:
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT commands FROM theory_commands WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return [
+            IsaCommand(*command) for command in pickle.loads(zlib.decompress(row[0]))
+        ]
+
+    def put(self, key: str, source: str, commands: List[ITPCommand]) -> None:
+        data = zlib.compress(
+            pickle.dumps(
+                [(c.command, c.name, c.line) for c in commands],
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        )
+        with self._lock:
+            self.connection.execute(
+                "DELETE FROM theory_commands WHERE source = ?", (source,)
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO theory_commands VALUES (?, ?, ?)",
+                (key, source, data),
+            )
+            self.connection.commit()
+
+    def get_theory_commands(
+        self,
+        client: EvalClient,
+        thy_path: Path,
+        only_statements: bool,
+        remove_ignored: bool,
+    ) -> List[ITPCommand]:
+        # the client must be set up, its setup is part of the key
+        source, key = self.make_key(
+            client.setup, thy_path, only_statements, remove_ignored
+        )
+        commands = self.get(key)
+        if commands is None:
+            commands = client.get_theory_commands(
+                thy_path, only_statements, remove_ignored
+            )
+            self.put(key, source, commands)
+        return commands
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+class AgentQueryCache:
+    # an in-memory LRU tier, optionally backed by an SQLite file that
+    # persists across runs
+    def __init__(
+        self, max_entries: int = 100_000, path: Optional[Union[os.PathLike, str]] = None
+    ):
+        self.max_entries = max_entries
+        self.memory: OrderedDict[str, Tuple[List[EvalAgentOutput], float]] = (
+            OrderedDict()
+        )
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.connection: Optional[sqlite3.Connection] = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS queries "
+                "(key TEXT PRIMARY KEY, outputs TEXT, query_time REAL)"
+            )
+            self.connection.commit()
+
+    @staticmethod
+    def make_key(identity: str, state: str, gen_length: int) -> str:
+        return fingerprint(identity, str(gen_length), state)
+
+    def _remember(
+        self, key: str, outputs: List[EvalAgentOutput], query_time: float
+    ) -> None:
+        self.memory[key] = (outputs, query_time)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Tuple[List[EvalAgentOutput], float]]:
+        with self._lock:
+            if key in self.memory:
+                self.hits += 1
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            if self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT outputs, query_time FROM queries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    outputs = [
+                        EvalAgentOutput(*output) for output in json.loads(row[0])
+                    ]
+                    self._remember(key, outputs, row[1])
+                    return outputs, row[1]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, outputs: List[EvalAgentOutput], query_time: float) -> None:
+        with self._lock:
+            self._remember(key, outputs, query_time)
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO queries VALUES (?, ?, ?)",
+                    (
+                        key,
+                        json.dumps([[o.command, o.logit] for o in outputs]),
+                        query_time,
+                    ),
+                )
+                self.connection.commit()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total > 0 else 0.0,
+        }
+
+    def close(self) -> None:
+        if self.connection is not None:
+            with self._lock:
+                self.connection.close()
+                self.connection = None
+
+
+class CachedEvalAgent(EvalAgent):
+    # answers repeated (state, gen_length) queries of the wrapped agent from
+    # an AgentQueryCache; the time the original query took is reported as
+    # saved on every hit
+    def __init__(self, agent: EvalAgent, cache: Optional[AgentQueryCache] = None):
+        self.agent = agent
+        self.cache = cache if cache is not None else AgentQueryCache()
+        self._saved = threading.local()
+
+    @property
+    def query_time_saved(self) -> float:
+        return getattr(self._saved, "value", 0.0)
+
+    def _add_saved(self, seconds: float) -> None:
+        self._saved.value = self.query_time_saved + seconds
+
+    def identity(self) -> str:
+        return self.agent.identity()
+
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        return self.query_batch([state], gen_length)[0]
+
+    def query_batch(
+        self, states: List[str], gen_length: int
+    ) -> List[List[EvalAgentOutput]]:
+        identity = self.agent.identity()
+        keys = [AgentQueryCache.make_key(identity, s, gen_length) for s in states]
+        results: List[Optional[List[EvalAgentOutput]]] = []
+        misses = []
+        for idx, key in enumerate(keys):
+            cached = self.cache.get(key)
+            if cached is None:
+                results.append(None)
+                misses.append(idx)
+            else:
+                results.append(list(cached[0]))
+                self._add_saved(cached[1])
+
+        if len(misses) > 0:
+            time_before_query = time.time()
+            if len(misses) == 1:
+                outputs_lst = [self.agent.query(states[misses[0]], gen_length)]
+            else:
+                outputs_lst = self.agent.query_batch(
+                    [states[idx] for idx in misses], gen_length
+                )
+            query_time = (time.time() - time_before_query) / len(misses)
+            for idx, outputs in zip(misses, outputs_lst):
+                self.cache.put(keys[idx], list(outputs), query_time)
+                results[idx] = outputs
+        return results
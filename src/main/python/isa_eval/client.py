@@ -1,13 +1,23 @@
+import asyncio
+import hashlib
+import itertools
+import queue
 import re
+import threading
+import time
+from collections import OrderedDict
 from collections.abc import Iterable
-from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import grpc
+import grpc.aio
 
 import isa_eval_pb2
 import isa_eval_pb2_grpc
+from metrics import METRICS, timed_rpc
 
 
 ISA_PROOF_COMMANDS = [
@@ -34,15 +44,36 @@ ISA_PROOF_COMMANDS = [
     "subclass",
 ]
 
+# goal states of large developments can easily exceed the 4MB default, and the
+# server does not accept keepalive pings more often than every 5 minutes
+DEFAULT_CHANNEL_OPTIONS = [
+    ("grpc.max_send_message_length", 256 * 1024 * 1024),
+    ("grpc.max_receive_message_length", 256 * 1024 * 1024),
+    ("grpc.keepalive_time_ms", 300_000),
+    ("grpc.keepalive_timeout_ms", 20_000),
+    ("grpc.keepalive_permit_without_calls", 0),
+]
+
+OUTCOME_PATTERN = re.compile(
+    r"<STATE>(.*?)<RESULT>(.*?)<MSG>(.*?)<LEVEL>(\d+)<DESCR>(.*)", re.S
+)
+
+ISA_COMMAND_PATTERN = re.compile(r"<CMD>(.*?)<NAME>(.*?)<LINE>(\d+)", re.S)
+
 
 def make_setup(
-    isa_path: Path, session: str, working_directory: Path, session_roots: Optional[Path]
+    isa_path: Path,
+    session: str,
+    working_directory: Path,
+    session_roots: Optional[Path],
+    force_new: bool = False,
 ):
     return isa_eval_pb2.Setup(
         isa_path=str(isa_path),
         session=session,
         working_directory=str(working_directory),
         session_roots=str(session_roots) if session_roots is not None else "",
+        force_new=force_new,
     )
 
 
@@ -58,6 +89,17 @@ def make_sledgehammer_request(state_id: str, timeout: int, sledgehammer_timeout:
     )
 
 
+def is_sledgehammer(command: str) -> bool:
+    return command.strip().lower() == "sledgehammer"
+
+
+def sledgehammer_budget(timeout: int, sledgehammer_timeout: Optional[int]) -> int:
+    # sledgehammer may search for three step timeouts unless configured
+    if sledgehammer_timeout is not None:
+        return sledgehammer_timeout
+    return timeout * 3
+
+
 def make_proof_commands(state_id: str, commands: str, timeout: int):
     return isa_eval_pb2.ProofCommands(id=state_id, commands=commands, timeout=timeout)
 
@@ -66,6 +108,10 @@ def make_state_request(state_id: str):
     return isa_eval_pb2.StateRequest(id=state_id)
 
 
+def make_state_list(state_ids: List[str]):
+    return isa_eval_pb2.StateList(ids=state_ids)
+
+
 def make_clear_and_rename_request(state_id: str, new_state_id: str):
     return isa_eval_pb2.ClearAndRenameRequest(id=state_id, new_id=new_state_id)
 
@@ -87,18 +133,13 @@ def make_outcome_state(outcome_state: isa_eval_pb2.OutcomeState):
         message=outcome_state.message,
         proof_level=outcome_state.level,
         state=outcome_state.state,
+        elapsed=outcome_state.elapsed if outcome_state.elapsed > 0 else None,
     )
 
 
 def make_isa_state_recursive(x: Any):
     if isinstance(x, isa_eval_pb2.OutcomeState):
-        return IsaState(
-            state_id=x.id,
-            result=x.result,
-            message=x.message,
-            proof_level=x.level,
-            state=x.state,
-        )
+        return make_outcome_state(x)
     elif isinstance(x, list):
         return [make_isa_state_recursive(y) for y in x]
     elif isinstance(x, tuple):
@@ -115,6 +156,56 @@ def make_isa_state_recursive(x: Any):
     return x
 
 
+def parse_outcome_states(outcomes_string: str) -> List["IsaState"]:
+    outputs = []
+    for outcome_string in outcomes_string.split("<OUTCOME_SEP>"):
+        match = OUTCOME_PATTERN.match(outcome_string)
+        assert match is not None
+        outputs.append(
+            IsaState(
+                state_id=match.group(1),
+                result=match.group(2),
+                message=match.group(3),
+                proof_level=int(match.group(4)),
+                state=match.group(5),
+            )
+        )
+    return outputs
+
+
+def parse_theory_commands(commands_string: str) -> List["IsaCommand"]:
+    isa_cmd_list = []
+    for isa_cmd_string in commands_string.split("<CMD_SEP>"):
+        match = ISA_COMMAND_PATTERN.match(isa_cmd_string)
+        assert match is not None, f"cannot parse {isa_cmd_string}"
+        isa_cmd_list.append(
+            IsaCommand(
+                command=match.group(1), name=match.group(2), line=int(match.group(3))
+            )
+        )
+    return isa_cmd_list
+
+
+def timed_outcomes(method: str, responses):
+    # latency of every streamed outcome, measured from the start of the call
+    if not METRICS.enabled:
+        yield from responses
+        return
+    time_before = time.perf_counter()
+    try:
+        for response in responses:
+            METRICS.observe(
+                "isa_eval_command_seconds",
+                time.perf_counter() - time_before,
+                result=response.result,
+            )
+            yield response
+    finally:
+        METRICS.observe(
+            "isa_eval_rpc_seconds", time.perf_counter() - time_before, method=method
+        )
+
+
 def return_isa_state(call):
     def inner(*args, **kwargs):
         return make_isa_state_recursive(call(*args, **kwargs))
@@ -126,6 +217,33 @@ class ITPSetup:
     pass
 
 
+class CancellationToken:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def register(self, callback) -> None:
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
 @dataclass
 class ITPState:
     state_id: str
@@ -133,6 +251,8 @@ class ITPState:
     message: str
     proof_level: int
     state: str
+    # the seconds the server ran the command for, without queueing, if known
+    elapsed: Optional[float] = field(default=None, compare=False)
 
     def proof_is_finished(self) -> bool:
         return self.proof_level == 0
@@ -154,14 +274,22 @@ class EvalClient:
     def __init__(self, port: int) -> None:
         self.port = port
         self.stub: Optional[Any] = None
+        self.setup: Optional[ITPSetup] = None
 
     def open_stub(self) -> None:
         pass
 
-    def setup_itp(self, setup: ITPSetup) -> ITPSetup:
+    def close(self) -> None:
+        pass
+
+    # `force_new` replaces a running instance of the same setup, e.g. one that
+    # was left in a bad state, instead of reusing it
+    def setup_itp(self, setup: ITPSetup, force_new: bool = False) -> ITPSetup:
         pass
 
-    def close_itp(self) -> None:
+    # `keep_warm` leaves the instance running, so that setting it up again
+    # later is fast, instead of shutting it down
+    def close_itp(self, keep_warm: bool = False) -> None:
         pass
 
     def proceed_until(self, thy_path: Path, content: str, timeout: int) -> ITPState:
@@ -175,12 +303,66 @@ class EvalClient:
     ) -> List[ITPState]:
         pass
 
+    def iter_execute_many(
+        self,
+        state_id: str,
+        commands_lst: List[str],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+    ) -> Iterator[Tuple[int, ITPState]]:
+        # yields (index in commands_lst, outcome) pairs in completion order,
+        # cancelling the token stops the remaining commands where supported
+        outcomes = self.execute_many(state_id, commands_lst, timeout)
+        consumed = 0
+        try:
+            for idx, outcome in enumerate(outcomes):
+                consumed = idx + 1
+                yield idx, outcome
+        finally:
+            # the caller stopped early, nobody else knows about these states
+            for outcome in outcomes[consumed:]:
+                self.remove_state(outcome.state_id)
+
+    def iter_execute_batch(
+        self,
+        requests: List[Tuple[str, str]],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+        timeouts: Optional[List[int]] = None,
+    ) -> Iterator[Tuple[int, ITPState]]:
+        # requests are (parent state id, command) pairs that may start from
+        # different states, outcomes are yielded with the index of their request;
+        # `timeouts` overrides the timeout of each request
+        groups: Dict[Tuple[str, int], List[int]] = {}
+        for idx, (state_id, _) in enumerate(requests):
+            request_timeout = timeouts[idx] if timeouts is not None else timeout
+            groups.setdefault((state_id, request_timeout), []).append(idx)
+        for (state_id, group_timeout), indices in groups.items():
+            if token is not None and token.cancelled:
+                return
+            for local_idx, outcome in self.iter_execute_many(
+                state_id, [requests[idx][1] for idx in indices], group_timeout, token
+            ):
+                yield indices[local_idx], outcome
+
+    def execute_batch(
+        self, requests: List[Tuple[str, str]], timeout: int
+    ) -> List[ITPState]:
+        outcomes: List[Optional[ITPState]] = [None] * len(requests)
+        for idx, outcome in self.iter_execute_batch(requests, timeout):
+            outcomes[idx] = outcome
+        return outcomes
+
     def clone_state(self, state_id: str) -> ITPState:
         pass
 
     def remove_state(self, state_id: str) -> None:
         pass
 
+    def remove_states(self, state_ids: List[str]) -> None:
+        for state_id in state_ids:
+            self.remove_state(state_id)
+
     def clear_and_rename_state(self, state_id: str, new_state_id: str) -> ITPState:
         pass
 
@@ -207,110 +389,441 @@ class IsaCommand(ITPCommand):
 
 
 class IsaEvalClient(EvalClient):
-    def __init__(self, port: int):
+    def __init__(
+        self,
+        port: int,
+        host: str = "localhost",
+        options: Optional[Sequence[Tuple[str, Any]]] = None,
+        sledgehammer_concurrency: int = 2,
+        sledgehammer_timeout: Optional[int] = None,
+        sledgehammer_cache_size: int = 4096,
+    ):
         super().__init__(port)
+        self.host = host
+        self.options = list(options if options is not None else DEFAULT_CHANNEL_OPTIONS)
+        self.channel: Optional[grpc.Channel] = None
         self.stub: Optional[isa_eval_pb2_grpc.IsaEvalStub] = None
+        # sledgehammer calls run next to the other commands of a batch, at
+        # most `sledgehammer_concurrency` at a time, and may each search for
+        # `sledgehammer_timeout` seconds, three step timeouts by default
+        self.sledgehammer_concurrency = sledgehammer_concurrency
+        self.sledgehammer_timeout = sledgehammer_timeout
+        self.sledgehammer_cache_size = sledgehammer_cache_size
+        self.sledgehammer_calls = 0
+        self.sledgehammer_hits = 0
+        self._sledgehammer_lock = threading.Lock()
+        self._sledgehammer_pool: Optional[ThreadPoolExecutor] = None
+        # the outcome class and message of sledgehammer by goal fingerprint,
+        # for the theory file of `_sledgehammer_theory`
+        self._sledgehammer_outcomes: "OrderedDict[str, Future]" = OrderedDict()
+        self._sledgehammer_theory: Optional[Path] = None
+        # the goals of the live states this client returned, which key the
+        # sledgehammer outcomes
+        self._goals: Dict[str, str] = {}
 
     def _check_stub(self):
         assert self.stub is not None, "stub is not initialized"
 
     def open_stub(self):
         if self.stub is None:
-            self.stub = isa_eval_pb2_grpc.IsaEvalStub(
-                grpc.insecure_channel(f"localhost:{self.port}")
+            self.channel = grpc.insecure_channel(
+                f"{self.host}:{self.port}", options=self.options
             )
+            self.stub = isa_eval_pb2_grpc.IsaEvalStub(self.channel)
+
+    def close(self) -> None:
+        with self._sledgehammer_lock:
+            pool, self._sledgehammer_pool = self._sledgehammer_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self.channel is not None:
+            self.channel.close()
+        self.channel = None
+        self.stub = None
+
+    def _reset_sledgehammer(self, thy_path: Optional[Path] = None) -> None:
+        with self._sledgehammer_lock:
+            self._sledgehammer_outcomes = OrderedDict()
+            self._sledgehammer_theory = thy_path
+
+    def _remember_goal(self, state_id: str, goal: str) -> None:
+        if self.sledgehammer_cache_size > 0:
+            self._goals[state_id] = goal
+
+    def sledgehammer_stats(self) -> Dict[str, float]:
+        return {
+            "calls": self.sledgehammer_calls,
+            "hits": self.sledgehammer_hits,
+            "hit_rate": self.sledgehammer_hits / max(self.sledgehammer_calls, 1),
+        }
 
-    def setup_itp(self, setup: IsaSetup):
+    @timed_rpc("SetupIsabelle")
+    def setup_itp(self, setup: IsaSetup, force_new: bool = False):
         self.open_stub()
-        return self.stub.SetupIsabelle(
+        self.setup = None
+        self._reset_sledgehammer()
+        self._goals = {}
+        response = self.stub.SetupIsabelle(
             make_setup(
                 setup.isa_path,
                 setup.session,
                 setup.working_directory,
                 setup.session_roots,
+                force_new,
             )
         )
+        self.setup = setup
+        return response
 
-    def close_itp(self) -> None:
+    def close_itp(self, keep_warm: bool = False) -> None:
+        self.setup = None
+        self._reset_sledgehammer()
+        self._goals = {}
         if self.stub is not None:
-            self.stub.CloseIsabelle(isa_eval_pb2.Empty())
-            self.stub = None
+            if keep_warm:
+                self._release_isabelle()
+            else:
+                self._close_isabelle()
+            self.close()
 
+    @timed_rpc("CloseIsabelle")
+    def _close_isabelle(self) -> None:
+        self.stub.CloseIsabelle(isa_eval_pb2.Empty())
+
+    @timed_rpc("ReleaseIsabelle")
+    def _release_isabelle(self) -> None:
+        self.stub.ReleaseIsabelle(isa_eval_pb2.Empty())
+
+    @timed_rpc("ProceedUntil")
     @return_isa_state
     def proceed_until(self, thy_path: Path, content: str, timeout: int) -> IsaState:
         self._check_stub()
-        return self.stub.ProceedUntil(make_theory_content(thy_path, content, timeout))
+        # the facts sledgehammer uses depend on the theory
+        if thy_path != self._sledgehammer_theory:
+            self._reset_sledgehammer(thy_path)
+        response = self.stub.ProceedUntil(
+            make_theory_content(thy_path, content, timeout)
+        )
+        self._remember_goal(response.id, response.state)
+        return response
 
-    @return_isa_state
     def execute(self, state_id: str, commands: str, timeout: int) -> IsaState:
+        # sledgehammer is timed as CallSledgehammer only
+        if is_sledgehammer(commands):
+            return self.call_sledgehammer(
+                state_id, timeout, self._sledgehammer_budget(timeout)
+            )
+        return self._execute(state_id, commands, timeout)
+
+    @timed_rpc("Execute")
+    @return_isa_state
+    def _execute(self, state_id: str, commands: str, timeout: int) -> IsaState:
         self._check_stub()
-        if commands.strip().lower() == "sledgehammer":
-            return self.stub.CallSledgehammer(
-                make_sledgehammer_request(
-                    state_id, timeout, sledgehammer_timeout=timeout * 3
+        response = self.stub.Execute(make_proof_commands(state_id, commands, timeout))
+        self._remember_goal(response.id, response.state)
+        return response
+
+    def _sledgehammer_budget(self, timeout: int) -> int:
+        return sledgehammer_budget(timeout, self.sledgehammer_timeout)
+
+    def _start_sledgehammer(
+        self,
+        requests: List[Tuple[int, str, int]],
+        token: Optional[CancellationToken] = None,
+    ) -> Dict[Future, int]:
+        # submits (index, state id, timeout) requests to the sledgehammer pool,
+        # whose size bounds the number of concurrent calls
+        if len(requests) == 0:
+            return {}
+        with self._sledgehammer_lock:
+            if self._sledgehammer_pool is None:
+                self._sledgehammer_pool = ThreadPoolExecutor(
+                    max_workers=self.sledgehammer_concurrency,
+                    thread_name_prefix="sledgehammer",
                 )
-            )
-        return self.stub.Execute(make_proof_commands(state_id, commands, timeout))
+            pool = self._sledgehammer_pool
+        futures = {
+            pool.submit(
+                self.call_sledgehammer,
+                state_id,
+                timeout,
+                self._sledgehammer_budget(timeout),
+            ): idx
+            for idx, state_id, timeout in requests
+        }
+        if token is not None:
+            submitted = list(futures)
+
+            def cancel() -> None:
+                for future in submitted:
+                    future.cancel()
+
+            token.register(cancel)
+        return futures
+
+    def _discard_sledgehammer(self, futures: Iterable[Future]) -> None:
+        # nobody waits for these outcomes anymore, remove their states
+        for future in futures:
+            if not future.cancel():
+                future.add_done_callback(self._remove_outcome)
+
+    def _remove_outcome(self, future: Future) -> None:
+        if future.exception() is not None or self.stub is None:
+            return
+        try:
+            self.remove_state(future.result().state_id)
+        except grpc.RpcError:
+            # e.g. the ITP was closed in the meantime
+            pass
+
+    def _read_stream(
+        self,
+        method: str,
+        responses,
+        normal_indices: List[int],
+        token: Optional[CancellationToken],
+    ) -> Iterator[Tuple[int, IsaState]]:
+        try:
+            for response in timed_outcomes(method, responses):
+                self._remember_goal(response.id, response.state)
+                yield normal_indices[response.index], make_outcome_state(response)
+        except grpc.RpcError as rpc_error:
+            if token is None or not token.cancelled:
+                raise rpc_error
+
+    def _merge_outcomes(
+        self,
+        method: str,
+        responses,
+        normal_indices: List[int],
+        futures: Dict[Future, int],
+        token: Optional[CancellationToken],
+    ) -> Iterator[Tuple[int, IsaState]]:
+        # yields the outcomes of the `responses` stream and of the sledgehammer
+        # `futures` in completion order; with both, a helper thread reads the
+        # stream, and `futures` is left with the outcomes not handed out
+        outcomes = (
+            self._read_stream(method, responses, normal_indices, token)
+            if responses is not None
+            else iter([])
+        )
+        if len(futures) == 0:
+            yield from outcomes
+            return
+
+        merged = queue.SimpleQueue()
+
+        def read() -> None:
+            try:
+                for outcome in outcomes:
+                    merged.put(outcome)
+            except BaseException as error:
+                merged.put(error)
+            finally:
+                merged.put(None)
+
+        reader = threading.Thread(target=read, name="outcome-stream", daemon=True)
+        reader.start()
+        for future in list(futures):
+            future.add_done_callback(merged.put)
+        reading = True
+        try:
+            while reading or len(futures) > 0:
+                item = merged.get()
+                if item is None:
+                    reading = False
+                elif isinstance(item, Future):
+                    if token is not None and token.cancelled:
+                        return
+                    yield futures.pop(item), item.result()
+                elif isinstance(item, BaseException):
+                    raise item
+                else:
+                    yield item
+        finally:
+            if responses is not None:
+                responses.cancel()
+            reader.join()
+            # the outcomes that were read but not handed out
+            unused = []
+            while not merged.empty():
+                item = merged.get()
+                if isinstance(item, tuple):
+                    unused.append(item[1].state_id)
+            if len(unused) > 0:
+                try:
+                    self.remove_states(unused)
+                except grpc.RpcError:
+                    pass
 
     def execute_many(
         self, state_id: str, commands_lst: List[str], timeout: int
     ) -> List[IsaState]:
         self._check_stub()
-        normal_proof_commands = [
-            make_proof_commands(state_id, cmd, timeout)
-            for cmd in commands_lst
-            if cmd != "sledgehammer"
+        # sledgehammer runs while the other commands are executed
+        futures = self._start_sledgehammer(
+            [
+                (idx, state_id, timeout)
+                for idx, cmd in enumerate(commands_lst)
+                if is_sledgehammer(cmd)
+            ]
+        )
+        normal_indices = [
+            idx for idx, cmd in enumerate(commands_lst) if not is_sledgehammer(cmd)
         ]
-        if len(normal_proof_commands) == 0:
-            outputs = []
-        else:
-            outputs_string = self.stub.ExecuteMany(iter(normal_proof_commands))
-            outputs_string_list = outputs_string.outcomes.split("<OUTCOME_SEP>")
-            outcome_pattern = re.compile(
-                r"<STATE>(.*?)<RESULT>(.*?)<MSG>(.*?)<LEVEL>(\d+)<DESCR>(.*?)", re.S
+        outputs: List[Optional[IsaState]] = [None] * len(commands_lst)
+        try:
+            if len(normal_indices) > 0:
+                for idx, output in zip(
+                    normal_indices,
+                    self._execute_many(
+                        state_id, [commands_lst[idx] for idx in normal_indices], timeout
+                    ),
+                ):
+                    outputs[idx] = output
+            for future in as_completed(list(futures)):
+                outputs[futures.pop(future)] = future.result()
+        finally:
+            self._discard_sledgehammer(futures)
+        return outputs
+
+    # the sledgehammer calls of execute_many are timed on their own
+    @timed_rpc("ExecuteMany")
+    def _execute_many(
+        self, state_id: str, commands_lst: List[str], timeout: int
+    ) -> List[IsaState]:
+        outputs_string = self.stub.ExecuteMany(
+            iter(
+                [
+                    make_proof_commands(state_id, commands, timeout)
+                    for commands in commands_lst
+                ]
             )
-            outputs = []
-            for outcome_string in outputs_string_list:
-                match = outcome_pattern.match(outcome_string)
-                assert match is not None
-                outputs.append(
-                    IsaState(
-                        state_id=match.group(1),
-                        result=match.group(2),
-                        message=match.group(3),
-                        proof_level=int(match.group(4)),
-                        state=match.group(5),
-                    )
-                )
+        )
+        outputs = parse_outcome_states(outputs_string.outcomes)
+        for output in outputs:
+            self._remember_goal(output.state_id, output.state)
+        return outputs
 
+    def iter_execute_many(
+        self,
+        state_id: str,
+        commands_lst: List[str],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+    ) -> Iterator[Tuple[int, IsaState]]:
+        self._check_stub()
+        futures = self._start_sledgehammer(
+            [
+                (idx, state_id, timeout)
+                for idx, cmd in enumerate(commands_lst)
+                if is_sledgehammer(cmd)
+            ],
+            token,
+        )
+        normal_indices = [
+            idx for idx, cmd in enumerate(commands_lst) if not is_sledgehammer(cmd)
+        ]
+        responses = None
+        if len(normal_indices) > 0:
+            responses = self.stub.ExecuteManyStreamed(
+                iter(
+                    [
+                        make_proof_commands(state_id, commands_lst[idx], timeout)
+                        for idx in normal_indices
+                    ]
+                )
+            )
+            # cancelling the call makes the server abort the remaining commands
+            if token is not None:
+                token.register(responses.cancel)
         try:
-            if (idx := commands_lst.index("sledgehammer")) != -1:
-                sledgehammer_request = make_sledgehammer_request(
-                    state_id, timeout, timeout * 3
+            yield from self._merge_outcomes(
+                "ExecuteManyStreamed", responses, normal_indices, futures, token
+            )
+        finally:
+            if responses is not None:
+                # a no-op when the stream is exhausted, otherwise the consumer
+                # stopped early and the remaining outcomes are not needed
+                responses.cancel()
+            self._discard_sledgehammer(futures)
+
+    def iter_execute_batch(
+        self,
+        requests: List[Tuple[str, str]],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+        timeouts: Optional[List[int]] = None,
+    ) -> Iterator[Tuple[int, IsaState]]:
+        self._check_stub()
+        if timeouts is None:
+            timeouts = [timeout] * len(requests)
+        futures = self._start_sledgehammer(
+            [
+                (idx, state_id, timeouts[idx])
+                for idx, (state_id, cmd) in enumerate(requests)
+                if is_sledgehammer(cmd)
+            ],
+            token,
+        )
+        normal_indices = [
+            idx for idx, (_, cmd) in enumerate(requests) if not is_sledgehammer(cmd)
+        ]
+        responses = None
+        if len(normal_indices) > 0:
+            # all commands run in one server-side parallel batch
+            responses = self.stub.ExecuteBatch(
+                iter(
+                    [
+                        make_proof_commands(*requests[idx], timeouts[idx])
+                        for idx in normal_indices
+                    ]
                 )
-                extra_output = self.stub.CallSledgehammer(sledgehammer_request)
-                outputs.insert(idx, make_isa_state_recursive(extra_output))
-        except ValueError as _:
-            pass
-
-        return outputs
+            )
+            if token is not None:
+                token.register(responses.cancel)
+        try:
+            yield from self._merge_outcomes(
+                "ExecuteBatch", responses, normal_indices, futures, token
+            )
+        finally:
+            if responses is not None:
+                responses.cancel()
+            self._discard_sledgehammer(futures)
 
+    @timed_rpc("CloneState")
     @return_isa_state
     def clone_state(self, state_id: str) -> IsaState:
         self._check_stub()
-        return self.stub.CloneState(make_state_request(state_id))
+        response = self.stub.CloneState(make_state_request(state_id))
+        self._remember_goal(response.id, response.state)
+        return response
 
+    @timed_rpc("RemoveState")
     def remove_state(self, state_id: str) -> None:
         self._check_stub()
+        self._goals.pop(state_id, None)
         self.stub.RemoveState(make_state_request(state_id))
 
+    @timed_rpc("RemoveStates")
+    def remove_states(self, state_ids: List[str]) -> None:
+        self._check_stub()
+        for state_id in state_ids:
+            self._goals.pop(state_id, None)
+        self.stub.RemoveStates(make_state_list(state_ids))
+
+    @timed_rpc("ClearAndRename")
     @return_isa_state
     def clear_and_rename_state(self, state_id: str, new_state_id: str) -> IsaState:
         self._check_stub()
-        return self.stub.ClearAndRename(
+        response = self.stub.ClearAndRename(
             make_clear_and_rename_request(state_id, new_state_id)
         )
+        self._goals = {}
+        self._remember_goal(response.id, response.state)
+        return response
 
+    @timed_rpc("GetTheoryCommands")
     @return_isa_state
     def get_theory_commands(
         self, thy_path: Path, only_statements: bool, remove_ignored: bool
@@ -319,27 +832,514 @@ class IsaEvalClient(EvalClient):
         isa_cmd_string = self.stub.GetTheoryCommands(
             make_parse_request(thy_path, only_statements, remove_ignored)
         )
-        isa_cmd_string_list = isa_cmd_string.commands.split("<CMD_SEP>")
-        isa_cmd_list = []
-        isa_cmd_pattern = re.compile(r"<CMD>(.*?)<NAME>(.*?)<LINE>(\d+)", re.S)
-        for isa_cmd_string in isa_cmd_string_list:
-            match = isa_cmd_pattern.match(isa_cmd_string)
-            assert match is not None, f"cannot parse {isa_cmd_string}"
-            isa_cmd = IsaCommand(
-                command=match.group(1), name=match.group(2), line=int(match.group(3))
-            )
-            isa_cmd_list.append(isa_cmd)
-
-        return isa_cmd_list
+        return parse_theory_commands(isa_cmd_string.commands)
 
+    @timed_rpc("CallSledgehammer")
     @return_isa_state
-    def call_sledgehammer(
+    def _call_sledgehammer(
         self, state_id: str, timeout: int, sledgehammer_timeout: int
     ) -> IsaState:
         self._check_stub()
-        return self.stub.CallSledgehammer(
+        response = self.stub.CallSledgehammer(
             make_sledgehammer_request(state_id, timeout, sledgehammer_timeout)
         )
+        self._remember_goal(response.id, response.state)
+        return response
+
+    def call_sledgehammer(
+        self, state_id: str, timeout: int, sledgehammer_timeout: int
+    ) -> IsaState:
+        # the proofs sledgehammer found are replayed on other states with the
+        # same goal, and concurrent calls on the same goal wait for the first
+        # one; failures are not kept, a later lemma may have the missing facts
+        goal = self._goals.get(state_id)
+        if self.sledgehammer_cache_size <= 0 or goal is None:
+            return self._call_sledgehammer(state_id, timeout, sledgehammer_timeout)
+        key = hashlib.sha1(f"{sledgehammer_timeout}:{goal}".encode()).hexdigest()
+        with self._sledgehammer_lock:
+            self.sledgehammer_calls += 1
+            cached = self._sledgehammer_outcomes.get(key)
+            if cached is None:
+                outcome_future = self._sledgehammer_outcomes[key] = Future()
+                if len(self._sledgehammer_outcomes) > self.sledgehammer_cache_size:
+                    self._sledgehammer_outcomes.popitem(last=False)
+            else:
+                self._sledgehammer_outcomes.move_to_end(key)
+                self.sledgehammer_hits += 1
+
+        if cached is None:
+            try:
+                outcome = self._call_sledgehammer(
+                    state_id, timeout, sledgehammer_timeout
+                )
+            except BaseException as error:
+                self._forget_sledgehammer(key, outcome_future)
+                outcome_future.set_exception(error)
+                raise
+            if outcome.result != "SUCCESS":
+                self._forget_sledgehammer(key, outcome_future)
+            outcome_future.set_result((outcome.result, outcome.message))
+            return outcome
+
+        result, message = cached.result()
+        # the replay calls the stub directly, so that the latency histograms
+        # only count the RPCs the caller made
+        self._check_stub()
+        # the clone is the state of failed outcomes, like on the server
+        clone = make_isa_state_recursive(
+            self.stub.CloneState(make_state_request(state_id))
+        )
+        if result != "SUCCESS":
+            self._remember_goal(clone.state_id, clone.state)
+            return IsaState(
+                clone.state_id, result, message, clone.proof_level, clone.state
+            )
+        # commands run in place, the proof is replayed on the clone
+        outcome = make_isa_state_recursive(
+            self.stub.Execute(make_proof_commands(clone.state_id, message, timeout))
+        )
+        if outcome.result == "SUCCESS":
+            self._remember_goal(outcome.state_id, outcome.state)
+            # the found proof is the message, as for sledgehammer itself
+            outcome.message = message
+            return outcome
+        self.stub.RemoveState(make_state_request(clone.state_id))
+        return self._call_sledgehammer(state_id, timeout, sledgehammer_timeout)
+
+    def _forget_sledgehammer(self, key: str, outcome_future: Future) -> None:
+        with self._sledgehammer_lock:
+            if self._sledgehammer_outcomes.get(key) is outcome_future:
+                del self._sledgehammer_outcomes[key]
+
+
+class AsyncEvalClient:
+    def __init__(self, port: int) -> None:
+        self.port = port
+
+    def open_stub(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def setup_itp(self, setup: ITPSetup, force_new: bool = False) -> ITPSetup:
+        pass
+
+    async def close_itp(self, keep_warm: bool = False) -> None:
+        pass
+
+    async def proceed_until(
+        self, thy_path: Path, content: str, timeout: int
+    ) -> ITPState:
+        pass
+
+    async def execute(self, state_id: str, commands: str, timeout: int) -> ITPState:
+        pass
+
+    async def execute_many(
+        self, state_id: str, commands_lst: List[str], timeout: int
+    ) -> List[ITPState]:
+        pass
+
+    async def iter_execute_many(
+        self,
+        state_id: str,
+        commands_lst: List[str],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+    ) -> AsyncIterator[Tuple[int, ITPState]]:
+        outcomes = await self.execute_many(state_id, commands_lst, timeout)
+        consumed = 0
+        try:
+            for idx, outcome in enumerate(outcomes):
+                consumed = idx + 1
+                yield idx, outcome
+        finally:
+            for outcome in outcomes[consumed:]:
+                await self.remove_state(outcome.state_id)
+
+    async def iter_execute_batch(
+        self,
+        requests: List[Tuple[str, str]],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+        timeouts: Optional[List[int]] = None,
+    ) -> AsyncIterator[Tuple[int, ITPState]]:
+        groups: Dict[Tuple[str, int], List[int]] = {}
+        for idx, (state_id, _) in enumerate(requests):
+            request_timeout = timeouts[idx] if timeouts is not None else timeout
+            groups.setdefault((state_id, request_timeout), []).append(idx)
+        for (state_id, group_timeout), indices in groups.items():
+            if token is not None and token.cancelled:
+                return
+            async for local_idx, outcome in self.iter_execute_many(
+                state_id, [requests[idx][1] for idx in indices], group_timeout, token
+            ):
+                yield indices[local_idx], outcome
+
+    async def execute_batch(
+        self, requests: List[Tuple[str, str]], timeout: int
+    ) -> List[ITPState]:
+        outcomes: List[Optional[ITPState]] = [None] * len(requests)
+        async for idx, outcome in self.iter_execute_batch(requests, timeout):
+            outcomes[idx] = outcome
+        return outcomes
+
+    async def clone_state(self, state_id: str) -> ITPState:
+        pass
+
+    async def remove_state(self, state_id: str) -> None:
+        pass
+
+    async def remove_states(self, state_ids: List[str]) -> None:
+        for state_id in state_ids:
+            await self.remove_state(state_id)
+
+    async def clear_and_rename_state(
+        self, state_id: str, new_state_id: str
+    ) -> ITPState:
+        pass
+
+    async def get_theory_commands(
+        self, thy_path: Path, only_statements: bool, remove_ignored: bool
+    ) -> List[ITPCommand]:
+        pass
+
+    async def __aenter__(self):
+        self.open_stub()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class AsyncIsaEvalClient(AsyncEvalClient):
+    def __init__(
+        self,
+        port: int,
+        host: str = "localhost",
+        pool_size: int = 4,
+        options: Optional[Sequence[Tuple[str, Any]]] = None,
+        sledgehammer_concurrency: int = 2,
+        sledgehammer_timeout: Optional[int] = None,
+    ):
+        super().__init__(port)
+        assert pool_size > 0, "pool_size should be positive"
+        self.host = host
+        self.pool_size = pool_size
+        self.options = list(options if options is not None else DEFAULT_CHANNEL_OPTIONS)
+        self.channels: List[grpc.aio.Channel] = []
+        self.stubs: List[isa_eval_pb2_grpc.IsaEvalStub] = []
+        self._stub_cycle = None
+        # sledgehammer is handled as in IsaEvalClient: it runs next to the
+        # other commands, at most `sledgehammer_concurrency` calls at a time
+        self.sledgehammer_concurrency = sledgehammer_concurrency
+        self.sledgehammer_timeout = sledgehammer_timeout
+        self._sledgehammer_semaphore = asyncio.Semaphore(sledgehammer_concurrency)
+
+    @property
+    def stub(self) -> isa_eval_pb2_grpc.IsaEvalStub:
+        assert self._stub_cycle is not None, "stub is not initialized"
+        return next(self._stub_cycle)
+
+    def open_stub(self) -> None:
+        if len(self.channels) > 0:
+            return
+        # a local subchannel pool makes every channel open its own connection,
+        # otherwise grpc would multiplex all of them over one socket
+        options = self.options + [("grpc.use_local_subchannel_pool", 1)]
+        self.channels = [
+            grpc.aio.insecure_channel(f"{self.host}:{self.port}", options=options)
+            for _ in range(self.pool_size)
+        ]
+        self.stubs = [isa_eval_pb2_grpc.IsaEvalStub(ch) for ch in self.channels]
+        self._stub_cycle = itertools.cycle(self.stubs)
+
+    async def close(self) -> None:
+        channels, self.channels = self.channels, []
+        self.stubs = []
+        self._stub_cycle = None
+        for channel in channels:
+            await channel.close()
+
+    async def setup_itp(self, setup: IsaSetup, force_new: bool = False):
+        self.open_stub()
+        return await self.stub.SetupIsabelle(
+            make_setup(
+                setup.isa_path,
+                setup.session,
+                setup.working_directory,
+                setup.session_roots,
+                force_new,
+            )
+        )
+
+    async def close_itp(self, keep_warm: bool = False) -> None:
+        if len(self.channels) > 0:
+            if keep_warm:
+                await self.stub.ReleaseIsabelle(isa_eval_pb2.Empty())
+            else:
+                await self.stub.CloseIsabelle(isa_eval_pb2.Empty())
+            await self.close()
+
+    async def proceed_until(
+        self, thy_path: Path, content: str, timeout: int
+    ) -> IsaState:
+        return make_outcome_state(
+            await self.stub.ProceedUntil(
+                make_theory_content(thy_path, content, timeout)
+            )
+        )
+
+    async def execute(self, state_id: str, commands: str, timeout: int) -> IsaState:
+        if is_sledgehammer(commands):
+            return await self.call_sledgehammer(
+                state_id, timeout, self._sledgehammer_budget(timeout)
+            )
+        return make_outcome_state(
+            await self.stub.Execute(make_proof_commands(state_id, commands, timeout))
+        )
+
+    def _sledgehammer_budget(self, timeout: int) -> int:
+        return sledgehammer_budget(timeout, self.sledgehammer_timeout)
+
+    async def _bounded_sledgehammer(
+        self, state_id: str, timeout: int, stopped: asyncio.Event
+    ) -> Optional[IsaState]:
+        async with self._sledgehammer_semaphore:
+            # calls that have not started when the batch stops are skipped,
+            # running ones are left to finish so that their states are known
+            if stopped.is_set():
+                return None
+            return await self.call_sledgehammer(
+                state_id, timeout, self._sledgehammer_budget(timeout)
+            )
+
+    def _start_sledgehammer(
+        self, requests: List[Tuple[int, str, int]], stopped: asyncio.Event
+    ) -> Dict[asyncio.Task, int]:
+        return {
+            asyncio.ensure_future(
+                self._bounded_sledgehammer(state_id, timeout, stopped)
+            ): idx
+            for idx, state_id, timeout in requests
+        }
+
+    def _discard_sledgehammer(
+        self, tasks: Iterable[asyncio.Task], stopped: asyncio.Event
+    ) -> None:
+        # nobody waits for these outcomes anymore, remove their states
+        stopped.set()
+        for task in tasks:
+            task.add_done_callback(self._remove_outcome)
+
+    def _remove_outcome(self, task: asyncio.Task) -> None:
+        if task.cancelled() or task.exception() is not None or task.result() is None:
+            return
+        if len(self.channels) > 0:
+            asyncio.ensure_future(self._remove_state_quietly(task.result().state_id))
+
+    async def _remove_state_quietly(self, state_id: str) -> None:
+        try:
+            await self.remove_state(state_id)
+        except grpc.RpcError:
+            # e.g. the ITP was closed in the meantime
+            pass
+
+    async def _merge_outcomes(
+        self,
+        call,
+        normal_indices: List[int],
+        tasks: Dict[asyncio.Task, int],
+        stopped: asyncio.Event,
+        token: Optional[CancellationToken],
+    ) -> AsyncIterator[Tuple[int, IsaState]]:
+        # yields the streamed outcomes of `call` and the sledgehammer outcomes
+        # of `tasks` in completion order
+        if token is not None:
+            loop = asyncio.get_running_loop()
+
+            def cancel() -> None:
+                stopped.set()
+                if call is not None:
+                    call.cancel()
+
+            token.register(lambda: loop.call_soon_threadsafe(cancel))
+        read = asyncio.ensure_future(call.read()) if call is not None else None
+        stop = asyncio.ensure_future(stopped.wait())
+        try:
+            while read is not None or len(tasks) > 0:
+                waiting = list(tasks) + ([read] if read is not None else [])
+                done, _ = await asyncio.wait(
+                    waiting + [stop], return_when=asyncio.FIRST_COMPLETED
+                )
+                if stopped.is_set():
+                    return
+                if read in done:
+                    response = read.result()
+                    if response is grpc.aio.EOF:
+                        read = None
+                    else:
+                        read = asyncio.ensure_future(call.read())
+                        yield normal_indices[response.index], make_outcome_state(
+                            response
+                        )
+                for task in [task for task in tasks if task in done]:
+                    yield tasks.pop(task), task.result()
+        finally:
+            stop.cancel()
+            if read is not None:
+                read.cancel()
+            if call is not None:
+                # a no-op when the stream is exhausted, otherwise the consumer
+                # stopped early and the remaining outcomes are not needed
+                call.cancel()
+            self._discard_sledgehammer(tasks, stopped)
+
+    async def execute_many(
+        self, state_id: str, commands_lst: List[str], timeout: int
+    ) -> List[IsaState]:
+        # sledgehammer runs while the other commands are executed
+        stopped = asyncio.Event()
+        tasks = self._start_sledgehammer(
+            [
+                (idx, state_id, timeout)
+                for idx, cmd in enumerate(commands_lst)
+                if is_sledgehammer(cmd)
+            ],
+            stopped,
+        )
+        normal_indices = [
+            idx for idx, cmd in enumerate(commands_lst) if not is_sledgehammer(cmd)
+        ]
+        outputs: List[Optional[IsaState]] = [None] * len(commands_lst)
+        try:
+            if len(normal_indices) > 0:
+                outputs_string = await self.stub.ExecuteMany(
+                    iter(
+                        [
+                            make_proof_commands(state_id, commands_lst[idx], timeout)
+                            for idx in normal_indices
+                        ]
+                    )
+                )
+                for idx, output in zip(
+                    normal_indices, parse_outcome_states(outputs_string.outcomes)
+                ):
+                    outputs[idx] = output
+            for task in list(tasks):
+                outputs[tasks[task]] = await task
+                del tasks[task]
+        finally:
+            self._discard_sledgehammer(tasks, stopped)
+        return outputs
+
+    async def iter_execute_many(
+        self,
+        state_id: str,
+        commands_lst: List[str],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+    ) -> AsyncIterator[Tuple[int, IsaState]]:
+        stopped = asyncio.Event()
+        tasks = self._start_sledgehammer(
+            [
+                (idx, state_id, timeout)
+                for idx, cmd in enumerate(commands_lst)
+                if is_sledgehammer(cmd)
+            ],
+            stopped,
+        )
+        normal_indices = [
+            idx for idx, cmd in enumerate(commands_lst) if not is_sledgehammer(cmd)
+        ]
+        call = None
+        if len(normal_indices) > 0:
+            call = self.stub.ExecuteManyStreamed(
+                iter(
+                    [
+                        make_proof_commands(state_id, commands_lst[idx], timeout)
+                        for idx in normal_indices
+                    ]
+                )
+            )
+        async for idx, outcome in self._merge_outcomes(
+            call, normal_indices, tasks, stopped, token
+        ):
+            yield idx, outcome
+
+    async def iter_execute_batch(
+        self,
+        requests: List[Tuple[str, str]],
+        timeout: int,
+        token: Optional[CancellationToken] = None,
+        timeouts: Optional[List[int]] = None,
+    ) -> AsyncIterator[Tuple[int, IsaState]]:
+        if timeouts is None:
+            timeouts = [timeout] * len(requests)
+        stopped = asyncio.Event()
+        tasks = self._start_sledgehammer(
+            [
+                (idx, state_id, timeouts[idx])
+                for idx, (state_id, cmd) in enumerate(requests)
+                if is_sledgehammer(cmd)
+            ],
+            stopped,
+        )
+        normal_indices = [
+            idx for idx, (_, cmd) in enumerate(requests) if not is_sledgehammer(cmd)
+        ]
+        call = None
+        if len(normal_indices) > 0:
+            call = self.stub.ExecuteBatch(
+                iter(
+                    [
+                        make_proof_commands(*requests[idx], timeouts[idx])
+                        for idx in normal_indices
+                    ]
+                )
+            )
+        async for idx, outcome in self._merge_outcomes(
+            call, normal_indices, tasks, stopped, token
+        ):
+            yield idx, outcome
+
+    async def clone_state(self, state_id: str) -> IsaState:
+        return make_outcome_state(
+            await self.stub.CloneState(make_state_request(state_id))
+        )
+
+    async def remove_state(self, state_id: str) -> None:
+        await self.stub.RemoveState(make_state_request(state_id))
+
+    async def remove_states(self, state_ids: List[str]) -> None:
+        await self.stub.RemoveStates(make_state_list(state_ids))
+
+    async def clear_and_rename_state(
+        self, state_id: str, new_state_id: str
+    ) -> IsaState:
+        return make_outcome_state(
+            await self.stub.ClearAndRename(
+                make_clear_and_rename_request(state_id, new_state_id)
+            )
+        )
+
+    async def get_theory_commands(
+        self, thy_path: Path, only_statements: bool, remove_ignored: bool
+    ) -> List[IsaCommand]:
+        isa_cmd_string = await self.stub.GetTheoryCommands(
+            make_parse_request(thy_path, only_statements, remove_ignored)
+        )
+        return parse_theory_commands(isa_cmd_string.commands)
+
+    async def call_sledgehammer(
+        self, state_id: str, timeout: int, sledgehammer_timeout: int
+    ) -> IsaState:
+        return make_outcome_state(
+            await self.stub.CallSledgehammer(
+                make_sledgehammer_request(state_id, timeout, sledgehammer_timeout)
+            )
+        )
 
 
 def run():
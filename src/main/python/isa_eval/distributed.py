@@ -0,0 +1,809 @@
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from grpc._channel import _InactiveRpcError as InactiveRpcError
+from grpc._channel import _MultiThreadedRendezvous as MultiThreadedRendezvous
+
+from agent import EvalAgent
+from client import IsaSetup, ISA_PROOF_COMMANDS
+from cache import TheoryCommandsCache
+from evaluate import evaluate_single_theory, make_eval_client, prepare_setups
+from journal import EvalJournal, EvalRecord, record_from_json, record_to_json
+from launcher import IsaEvalServerProcess, build_server, stop_on_terminate
+from recovery import ITPRecovery
+from search import BestFirstSearch
+from utils import prepare_logger
+
+# Workers talk to the coordinator over one TCP connection each, with one JSON
+# object per line in both directions; every message gets exactly one reply.
+#
+#   worker                                      coordinator
+#   {"type": "request", "worker", "session"} -> {"type": "unit", "lease", ...}
+#                                               | {"type": "wait", "seconds"}
+#                                               | {"type": "done"}
+#   {"type": "lemmas", "lease", "lemmas"}    -> lease state
+#   {"type": "heartbeat", "lease"}           -> lease state
+#   {"type": "record", "lease", "session",
+#    "theory", "lemma", "record"}            -> lease state
+#   {"type": "complete", "lease", "time"}    -> {"type": "ok"}
+#   {"type": "fail", "lease", "reason"}      -> {"type": "ok"}
+#
+# The lease state is {"type": "ok", "stop"} with the (possibly reduced) end of
+# the lemma range of the lease, or {"type": "revoked"} once the lease expired.
+
+
+@dataclass
+class WorkUnit:
+    unit_id: int
+    session: str
+    wd: Path
+    thy_path: Path
+    # the lemmas [start, stop) of the theory file by position, where a stop
+    # of None is the end of the file
+    start: int = 0
+    stop: Optional[int] = None
+    attempts: int = 0
+    # the workers that failed on the unit do not get it again
+    failed_workers: Set[str] = field(default_factory=set)
+
+
+@dataclass
+class Lease:
+    lease_id: str
+    unit: WorkUnit
+    worker: str
+    expires: float
+
+
+class _CoordinatorHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            reply = self.server.coordinator.handle(message)
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+
+class _CoordinatorServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class EvalCoordinator:
+    # hands out the theory files of a dataset to workers on other hosts and
+    # collects their records. A lease on a unit expires if its worker sends
+    # no heartbeat for `lease_seconds`, and the lemmas it did not record are
+    # handed out again, at most `max_attempts` times. A unit is not handed
+    # out again to a worker that failed on it, and it is given up once every
+    # active worker failed on it. When no unit is left, an idle worker steals
+    # the second half of the lemmas the busiest worker has not reached yet.
+    def __init__(
+        self,
+        theories_path: Union[os.PathLike, str],
+        host: str = "0.0.0.0",
+        port: int = 8990,
+        lease_seconds: float = 120.0,
+        heartbeat_interval: float = 10.0,
+        max_attempts: int = 3,
+        journal_path: Optional[Union[os.PathLike, str]] = None,
+        resume: bool = False,
+        logger: Optional[logging.Logger] = None,
+    ):
+        assert (
+            heartbeat_interval < lease_seconds
+        ), "leases would expire between heartbeats"
+        if logger is None:
+            logger = prepare_logger("Coordinator")
+        self.logger = logger
+        self.host = host
+        self.port = port
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self.journal = (
+            EvalJournal(journal_path, resume) if journal_path is not None else None
+        )
+
+        self.records: Dict[Tuple[str, str, Path], EvalRecord] = {}
+        self.times: Dict[Tuple[str, Path], float] = {}
+        if self.journal is not None:
+            self.records.update(self.journal.records)
+            self.times.update(self.journal.times)
+        self.pending: List[WorkUnit] = []
+        self.leases: Dict[str, Lease] = {}
+        # the lemmas of each theory file, as reported by the first worker
+        self.theory_lemmas: Dict[Tuple[str, Path], List[str]] = {}
+        self.recorded: Dict[Tuple[str, Path], Set[str]] = {}
+        for lemma, session, thy_path in self.records:
+            self.recorded.setdefault((session, thy_path), set()).add(lemma)
+        # the units of each theory file that are pending or leased
+        self.open_units: Dict[Tuple[str, Path], int] = {}
+        self.eval_times: Dict[Tuple[str, Path], float] = {}
+        self.abandoned: Set[Tuple[str, Path]] = set()
+        # when each worker was last heard of, and the sessions it failed on
+        self.workers: Dict[str, float] = {}
+        self.failed_sessions: Dict[str, Set[str]] = {}
+        self._next_unit_id = 0
+        for session, wd, thy_files in prepare_setups(Path(theories_path)):
+            for thy_path in thy_files:
+                if self.journal is not None and self.journal.theory_done(
+                    session, thy_path
+                ):
+                    continue
+                self.pending.append(self._new_unit(session, wd, thy_path))
+
+        self.finished = threading.Event()
+        if len(self.pending) == 0:
+            self.finished.set()
+        self._lock = threading.Lock()
+        self._server: Optional[_CoordinatorServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        # the actual port if the coordinator was started on port 0
+        if self._server is not None:
+            return self.host, self._server.server_address[1]
+        return self.host, self.port
+
+    def start(self) -> "EvalCoordinator":
+        self._server = _CoordinatorServer((self.host, self.port), _CoordinatorHandler)
+        self._server.coordinator = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.logger.info(
+            f"Serving {len(self.pending)} theory files on {self.address[0]}:"
+            f"{self.address[1]}"
+        )
+        return self
+
+    def wait(
+        self,
+        alive: Optional[Callable[[], bool]] = None,
+        timeout: Optional[float] = None,
+    ) -> bool:
+        # until all units are finished, `alive` tells whether any worker is
+        # left to finish them
+        deadline = time.time() + timeout if timeout is not None else None
+        while not self.finished.wait(min(self.heartbeat_interval, 1.0)):
+            with self._lock:
+                self._expire_leases()
+            if alive is not None and not alive():
+                self.logger.warning(
+                    f"All workers exited with {self._open_unit_count()} units unfinished"
+                )
+                return False
+            if deadline is not None and time.time() > deadline:
+                return False
+        return True
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.journal is not None:
+            self.journal.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def serve(
+        self,
+    ) -> Tuple[Dict[Tuple[str, str, Path], EvalRecord], Dict[Tuple[str, Path], float]]:
+        with self:
+            self.wait()
+            # the workers learn that there is nothing left on their next request
+            time.sleep(self.heartbeat_interval)
+        return self.records, self.times
+
+    def _new_unit(
+        self,
+        session: str,
+        wd: Path,
+        thy_path: Path,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> WorkUnit:
+        unit = WorkUnit(self._next_unit_id, session, wd, thy_path, start, stop)
+        self._next_unit_id += 1
+        self.open_units[(session, thy_path)] = (
+            self.open_units.get((session, thy_path), 0) + 1
+        )
+        return unit
+
+    def _open_unit_count(self) -> int:
+        with self._lock:
+            return sum(self.open_units.values())
+
+    def handle(self, message: dict) -> dict:
+        with self._lock:
+            kind = message.get("type")
+            if kind == "request":
+                return self._hand_out(message["worker"], message.get("session"))
+            if kind == "lemmas":
+                return self._on_lemmas(message["lease"], message["lemmas"])
+            if kind == "heartbeat":
+                return self._renew(message["lease"])
+            if kind == "record":
+                return self._on_record(message)
+            if kind == "complete":
+                return self._on_complete(message["lease"], message["time"])
+            if kind == "fail":
+                return self._on_fail(message["lease"], message["reason"])
+            return {"type": "error", "message": f"unknown message type {kind}"}
+
+    def _lease_state(self, lease_id: str) -> dict:
+        lease = self.leases.get(lease_id)
+        if lease is None:
+            return {"type": "revoked"}
+        return {"type": "ok", "stop": lease.unit.stop}
+
+    def _renew(self, lease_id: str) -> dict:
+        lease = self.leases.get(lease_id)
+        if lease is not None:
+            lease.expires = time.time() + self.lease_seconds
+            self.workers[lease.worker] = time.time()
+        return self._lease_state(lease_id)
+
+    def _hand_out(self, worker: str, session: Optional[str]) -> dict:
+        self.workers[worker] = time.time()
+        self._expire_leases()
+        self._abandon_failed()
+        if self.finished.is_set():
+            return {"type": "done"}
+        candidates = [u for u in self.pending if worker not in u.failed_workers]
+        # prefer the session the worker has already set up
+        unit = next((u for u in candidates if u.session == session), None)
+        if unit is None and len(candidates) > 0:
+            unit = candidates[0]
+        if unit is not None:
+            self.pending.remove(unit)
+        else:
+            unit = self._steal(worker)
+        if unit is None:
+            return {"type": "wait", "seconds": self.heartbeat_interval}
+
+        lease = Lease(uuid.uuid4().hex, unit, worker, time.time() + self.lease_seconds)
+        self.leases[lease.lease_id] = lease
+        self.logger.info(
+            f"Leased {unit.thy_path} (lemmas {unit.start} to "
+            f"{unit.stop if unit.stop is not None else 'end'}) to {worker}"
+        )
+        return {
+            "type": "unit",
+            "lease": lease.lease_id,
+            "session": unit.session,
+            "wd": str(unit.wd),
+            "theory": str(unit.thy_path),
+            "start": unit.start,
+            "stop": unit.stop,
+            "done": sorted(self.recorded.get((unit.session, unit.thy_path), ())),
+            "heartbeat_interval": self.heartbeat_interval,
+        }
+
+    def _steal(self, worker: str) -> Optional[WorkUnit]:
+        victim: Optional[Lease] = None
+        victim_remaining: List[int] = []
+        failed_sessions = self.failed_sessions.get(worker, set())
+        for lease in self.leases.values():
+            unit = lease.unit
+            if unit.session in failed_sessions:
+                continue
+            lemmas = self.theory_lemmas.get((unit.session, unit.thy_path))
+            if lemmas is None:
+                continue
+            stop = unit.stop if unit.stop is not None else len(lemmas)
+            recorded = self.recorded.get((unit.session, unit.thy_path), set())
+            # the first lemma not recorded yet is most likely being searched
+            remaining = [
+                i for i in range(unit.start, stop) if lemmas[i] not in recorded
+            ][1:]
+            if len(remaining) > max(len(victim_remaining), 1):
+                victim, victim_remaining = lease, remaining
+        if victim is None:
+            return None
+
+        unit = victim.unit
+        split = victim_remaining[len(victim_remaining) // 2]
+        stolen = self._new_unit(unit.session, unit.wd, unit.thy_path, split, unit.stop)
+        unit.stop = split
+        self.logger.info(
+            f"Stealing lemmas {split} to {stolen.stop if stolen.stop is not None else 'end'}"
+            f" of {unit.thy_path} from {victim.worker}"
+        )
+        return stolen
+
+    def _expire_leases(self) -> None:
+        now = time.time()
+        for lease_id, lease in list(self.leases.items()):
+            if lease.expires < now:
+                self.logger.warning(
+                    f"Lease of {lease.unit.thy_path} by {lease.worker} expired"
+                )
+                del self.leases[lease_id]
+                self._retry(lease.unit)
+
+    def _abandon_failed(self) -> None:
+        # a unit that every active worker failed on would never be leased again
+        now = time.time()
+        active = {
+            worker
+            for worker, seen in self.workers.items()
+            if now - seen < self.lease_seconds
+        }
+        for unit in [u for u in self.pending if active <= u.failed_workers]:
+            self.pending.remove(unit)
+            self._abandon(unit)
+
+    def _abandon(self, unit: WorkUnit) -> None:
+        self.logger.warning(
+            f"Giving up on {unit.thy_path} after {unit.attempts} attempts"
+        )
+        self.abandoned.add((unit.session, unit.thy_path))
+        self._close_unit(unit)
+
+    def _retry(self, unit: WorkUnit) -> None:
+        unit.attempts += 1
+        if unit.attempts >= self.max_attempts:
+            self._abandon(unit)
+        else:
+            # the recorded lemmas are skipped by the next worker
+            self.pending.insert(0, unit)
+
+    def _close_unit(self, unit: WorkUnit) -> None:
+        key = (unit.session, unit.thy_path)
+        self.open_units[key] -= 1
+        if self.open_units[key] == 0:
+            del self.open_units[key]
+            # theory files with abandoned units are evaluated again on resume
+            if key not in self.abandoned:
+                self.times[key] = self.eval_times.get(key, 0.0)
+                if self.journal is not None:
+                    self.journal.record_theory(
+                        unit.session, unit.thy_path, self.times[key]
+                    )
+                self.logger.info(
+                    f"Finished {unit.thy_path} in {self.times[key]:.2f} seconds "
+                    f"({len(self.open_units)} theory files remaining)"
+                )
+        if len(self.open_units) == 0:
+            self.finished.set()
+
+    def _on_lemmas(self, lease_id: str, lemmas: List[str]) -> dict:
+        lease = self.leases.get(lease_id)
+        if lease is not None:
+            key = (lease.unit.session, lease.unit.thy_path)
+            self.theory_lemmas.setdefault(key, lemmas)
+        return self._renew(lease_id)
+
+    def _on_record(self, message: dict) -> dict:
+        # records of expired leases are still valid
+        session, thy_path = message["session"], Path(message["theory"])
+        lemma, record = message["lemma"], record_from_json(message["record"])
+        previous = self.records.get((lemma, session, thy_path))
+        if previous is None or not previous.solved:
+            self.records[(lemma, session, thy_path)] = record
+            if self.journal is not None:
+                self.journal.record_lemma(session, thy_path, lemma, record)
+        self.recorded.setdefault((session, thy_path), set()).add(lemma)
+        return self._renew(message["lease"])
+
+    def _on_complete(self, lease_id: str, eval_time: float) -> dict:
+        lease = self.leases.pop(lease_id, None)
+        if lease is not None:
+            key = (lease.unit.session, lease.unit.thy_path)
+            self.eval_times[key] = self.eval_times.get(key, 0.0) + eval_time
+            self._close_unit(lease.unit)
+        return {"type": "ok"}
+
+    def _on_fail(self, lease_id: str, reason: str) -> dict:
+        lease = self.leases.pop(lease_id, None)
+        if lease is not None:
+            self.logger.warning(
+                f"{lease.worker} failed on {lease.unit.thy_path}: {reason}"
+            )
+            lease.unit.failed_workers.add(lease.worker)
+            self.failed_sessions.setdefault(lease.worker, set()).add(lease.unit.session)
+            self._retry(lease.unit)
+        return {"type": "ok"}
+
+
+class _CoordinatorConnection:
+    def __init__(self, host: str, port: int, timeout: float = 60.0):
+        self._socket = socket.create_connection((host, port), timeout=timeout)
+        self._file = self._socket.makefile("rw", encoding="utf-8")
+        # the heartbeats are sent from another thread
+        self._lock = threading.Lock()
+
+    def call(self, message: dict) -> dict:
+        with self._lock:
+            self._file.write(json.dumps(message) + "\n")
+            self._file.flush()
+            line = self._file.readline()
+        if not line:
+            raise ConnectionError("the coordinator closed the connection")
+        return json.loads(line)
+
+    def close(self) -> None:
+        self._file.close()
+        self._socket.close()
+
+
+class _LeaseKeeper:
+    # sends the heartbeats of a lease and narrows down the lemmas of the
+    # worker when the coordinator shortens or revokes its lease
+    def __init__(
+        self,
+        connection: _CoordinatorConnection,
+        lease_id: str,
+        interval: float,
+        skip_lemmas: Set[str],
+        logger: logging.Logger,
+    ):
+        self.connection = connection
+        self.lease_id = lease_id
+        self.interval = interval
+        self.skip_lemmas = skip_lemmas
+        self.logger = logger
+        self.lemmas: Optional[List[str]] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "_LeaseKeeper":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.apply(
+                    self.connection.call({"type": "heartbeat", "lease": self.lease_id})
+                )
+            except (OSError, ValueError) as error:
+                self.logger.warning(f"Failed to send a heartbeat: {error}")
+
+    def apply(self, reply: dict) -> None:
+        # evaluate_single_theory checks the skipped lemmas before each lemma;
+        # the lemmas are only known once the theory file is parsed
+        if self.lemmas is None:
+            return
+        if reply["type"] == "revoked":
+            self.skip_lemmas.update(self.lemmas)
+        elif reply.get("stop") is not None:
+            self.skip_lemmas.update(self.lemmas[reply["stop"] :])
+
+
+def run_eval_worker(
+    coordinator_address: Tuple[str, int],
+    port: int,
+    isa_path: Union[os.PathLike, str],
+    agent: EvalAgent,
+    solver: BestFirstSearch,
+    session_roots: Optional[Union[os.PathLike, str]] = None,
+    tactic_cache_path: Optional[Union[os.PathLike, str]] = None,
+    parallel_searches: int = 1,
+    commands_cache_path: Optional[Union[os.PathLike, str]] = None,
+    sledgehammer_concurrency: int = 2,
+    sledgehammer_timeout: Optional[int] = None,
+    worker_id: Optional[str] = None,
+    max_recoveries: int = 3,
+    launch_server: bool = False,
+    server_command: Optional[Sequence[str]] = None,
+) -> int:
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}:{port}"
+    logger = prepare_logger(f"Worker-{worker_id}")
+    client = make_eval_client(
+        port,
+        tactic_cache_path,
+        sledgehammer_concurrency=sledgehammer_concurrency,
+        sledgehammer_timeout=sledgehammer_timeout,
+    )
+    commands_cache = (
+        TheoryCommandsCache(commands_cache_path)
+        if commands_cache_path is not None
+        else None
+    )
+    # a server the worker launched itself is restarted if it dies; it runs
+    # `server_command` if the server was already built, and is built first
+    # otherwise
+    server = IsaEvalServerProcess(port, server_command) if launch_server else None
+    if server is not None:
+        stop_on_terminate(server)
+        server.start()
+    recovery = ITPRecovery(server, max_recoveries) if max_recoveries > 0 else None
+    connection = _CoordinatorConnection(*coordinator_address)
+    failed_setup: Optional[IsaSetup] = None
+    finished_units = 0
+
+    try:
+        while True:
+            reply = connection.call(
+                {
+                    "type": "request",
+                    "worker": worker_id,
+                    "session": client.setup.session if client.setup else None,
+                }
+            )
+            if reply["type"] == "done":
+                break
+            if reply["type"] == "wait":
+                time.sleep(reply["seconds"])
+                continue
+
+            lease_id = reply["lease"]
+            thy_path = Path(reply["theory"])
+            skip_lemmas = set(reply["done"])
+            keeper = _LeaseKeeper(
+                connection, lease_id, reply["heartbeat_interval"], skip_lemmas, logger
+            ).start()
+            try:
+                setup = IsaSetup(
+                    Path(isa_path),
+                    reply["session"],
+                    Path(reply["wd"]),
+                    Path(session_roots) if session_roots is not None else None,
+                )
+                if setup == failed_setup:
+                    connection.call(
+                        {"type": "fail", "lease": lease_id, "reason": "setup failed"}
+                    )
+                    continue
+                if setup != client.setup:
+                    if client.setup is not None:
+                        client.close_itp(keep_warm=True)
+                    logger.info(
+                        f"Setting up ITP (session {setup.session} with {setup.isa_path})"
+                    )
+                    try:
+                        client.setup_itp(setup)
+                    except InactiveRpcError as rpc_error:
+                        logger.warning(f"Failed to setup ITP: {rpc_error.details()}")
+                        failed_setup = setup
+                        connection.call(
+                            {
+                                "type": "fail",
+                                "lease": lease_id,
+                                "reason": "setup failed",
+                            }
+                        )
+                        continue
+
+                try:
+                    if commands_cache is not None:
+                        commands = commands_cache.get_theory_commands(
+                            client, thy_path, only_statements=False, remove_ignored=True
+                        )
+                    else:
+                        commands = client.get_theory_commands(
+                            thy_path, only_statements=False, remove_ignored=True
+                        )
+                except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
+                    connection.call(
+                        {
+                            "type": "fail",
+                            "lease": lease_id,
+                            "reason": rpc_error.details(),
+                        }
+                    )
+                    continue
+                lemmas = [c.command for c in commands if c.name in ISA_PROOF_COMMANDS]
+                skip_lemmas.update(lemmas[: reply["start"]])
+                keeper.lemmas = lemmas
+                keeper.apply(reply)
+                keeper.apply(
+                    connection.call(
+                        {"type": "lemmas", "lease": lease_id, "lemmas": lemmas}
+                    )
+                )
+
+                def on_record(lemma: str, record: EvalRecord):
+                    keeper.apply(
+                        connection.call(
+                            {
+                                "type": "record",
+                                "lease": lease_id,
+                                "session": setup.session,
+                                "theory": str(thy_path),
+                                "lemma": lemma,
+                                "record": record_to_json(record),
+                            }
+                        )
+                    )
+
+                time_before_eval = time.time()
+                evaluate_single_theory(
+                    thy_path,
+                    agent,
+                    client,
+                    solver,
+                    skip_lemmas=skip_lemmas,
+                    on_record=on_record,
+                    parallel_searches=parallel_searches,
+                    commands_cache=commands_cache,
+                    recovery=recovery,
+                )
+                connection.call(
+                    {
+                        "type": "complete",
+                        "lease": lease_id,
+                        "time": time.time() - time_before_eval,
+                    }
+                )
+                finished_units += 1
+            finally:
+                keeper.stop()
+    except OSError as error:
+        logger.warning(f"Lost the connection to the coordinator: {error}")
+    finally:
+        connection.close()
+        if client.setup is not None:
+            client.close_itp()
+        if commands_cache is not None:
+            commands_cache.close()
+        if solver.trace is not None:
+            solver.trace.close()
+        if solver.timeout_policy is not None:
+            logger.info(
+                f"Timeout policy statistics:\n{solver.timeout_policy.summary()}"
+            )
+        if server is not None:
+            server.stop()
+    logger.info(f"Finished {finished_units} units")
+    return finished_units
+
+
+def evaluate_isabelle_agent_distributed(
+    isa_path: Union[os.PathLike, str],
+    theories_path: Union[os.PathLike, str],
+    agent: EvalAgent,
+    solver: BestFirstSearch,
+    ports: Sequence[int],
+    session_roots: Optional[Union[os.PathLike, str]] = None,
+    launch_servers: bool = False,
+    start_method: Optional[str] = None,
+    coordinator_port: int = 0,
+    lease_seconds: float = 120.0,
+    heartbeat_interval: float = 10.0,
+    tactic_cache_path: Optional[Union[os.PathLike, str]] = None,
+    journal_path: Optional[Union[os.PathLike, str]] = None,
+    resume: bool = False,
+    parallel_searches: int = 1,
+    commands_cache_path: Optional[Union[os.PathLike, str]] = None,
+    sledgehammer_concurrency: int = 2,
+    sledgehammer_timeout: Optional[int] = None,
+    max_recoveries: int = 3,
+    logger: Optional[logging.Logger] = None,
+) -> Tuple[Dict[Tuple[str, str, Path], EvalRecord], Dict[Tuple[str, Path], float]]:
+    # a coordinator and one worker process per port on this host, with the
+    # same protocol as workers on other hosts
+    coordinator = EvalCoordinator(
+        theories_path,
+        "127.0.0.1",
+        coordinator_port,
+        lease_seconds,
+        heartbeat_interval,
+        journal_path=journal_path,
+        resume=resume,
+        logger=logger,
+    )
+    # the server is built once for all the workers that launch one
+    server_command = build_server() if launch_servers else None
+    mp_context = multiprocessing.get_context(start_method)
+    workers = []
+    try:
+        with coordinator:
+            workers = [
+                mp_context.Process(
+                    target=run_eval_worker,
+                    args=(
+                        coordinator.address,
+                        port,
+                        isa_path,
+                        agent,
+                        solver,
+                        session_roots,
+                        tactic_cache_path,
+                        parallel_searches,
+                        commands_cache_path,
+                        sledgehammer_concurrency,
+                        sledgehammer_timeout,
+                        f"local:{port}",
+                        max_recoveries,
+                        # each worker owns its server, so that it can restart it
+                        launch_servers,
+                        server_command,
+                    ),
+                    daemon=True,
+                )
+                for port in ports
+            ]
+            for worker in workers:
+                worker.start()
+            coordinator.wait(alive=lambda: any(w.is_alive() for w in workers))
+            for worker in workers:
+                worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    return coordinator.records, coordinator.times
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    from agent import EvalAgentOutput
+    from evaluate import pretty_print_eval_summary
+    from search import IsaBestFirstSearch
+
+    class SimpleAgent(EvalAgent):
+        def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+            return [
+                EvalAgentOutput("by auto", random.random()) for _ in range(gen_length)
+            ]
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="role", required=True)
+    coordinator_parser = subparsers.add_parser("coordinator")
+    coordinator_parser.add_argument("theories_path", type=Path)
+    coordinator_parser.add_argument("--host", default="0.0.0.0")
+    coordinator_parser.add_argument("--port", type=int, default=8990)
+    coordinator_parser.add_argument("--lease-seconds", type=float, default=120.0)
+    coordinator_parser.add_argument("--journal", type=Path, default=None)
+    coordinator_parser.add_argument("--resume", action="store_true")
+    worker_parser = subparsers.add_parser("worker")
+    worker_parser.add_argument("coordinator", help="host:port of the coordinator")
+    worker_parser.add_argument("isa_path", type=Path)
+    worker_parser.add_argument("--port", type=int, default=8980)
+    worker_parser.add_argument("--session-roots", type=Path, default=None)
+    worker_parser.add_argument(
+        "--launch-server",
+        action="store_true",
+        help="start the server on --port and restart it if it dies",
+    )
+    args = parser.parse_args()
+
+    if args.role == "coordinator":
+        eval_records, times_dict = EvalCoordinator(
+            args.theories_path,
+            args.host,
+            args.port,
+            args.lease_seconds,
+            journal_path=args.journal,
+            resume=args.resume,
+        ).serve()
+        pretty_print_eval_summary(eval_records, times_dict)
+    else:
+        host, coordinator_port = args.coordinator.rsplit(":", 1)
+        run_eval_worker(
+            (host, int(coordinator_port)),
+            args.port,
+            args.isa_path.expanduser(),
+            SimpleAgent(),
+            IsaBestFirstSearch(step_timeout=10),
+            session_roots=args.session_roots,
+            launch_server=args.launch_server,
+        )
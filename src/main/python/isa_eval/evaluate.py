@@ -1,32 +1,39 @@
 import logging
+import multiprocessing
 import os
+import queue
 import time
-from dataclasses import dataclass
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
 
 from grpc._channel import _InactiveRpcError as InactiveRpcError
 from grpc._channel import _MultiThreadedRendezvous as MultiThreadedRendezvous
 
 from agent import EvalAgent, EvalAgentOutput
-from client import IsaEvalClient, IsaSetup, ISA_PROOF_COMMANDS
+from cache import CachingEvalClient, TacticCache, TheoryCommandsCache
+from client import EvalClient, ITPState, IsaEvalClient, IsaSetup, ISA_PROOF_COMMANDS
+from journal import EvalJournal, EvalRecord
+from launcher import IsaEvalServerProcess, build_server, stop_on_terminate
+from metrics import METRICS, enable_metrics
+from replay import RecordingEvalClient, ReplayStore
+from recovery import ITPRecovery
 from search import IsaBestFirstSearch, BestFirstSearch, SearchSummary
 from utils import chop_by_condition, parse_root_file, prepare_logger
 
 
-@dataclass
-class EvalRecord:
-    solved: bool
-    proof_steps: List[str]
-    search_summary: SearchSummary
-
-
 def evaluate_single_theory(
     thy_path: Union[os.PathLike, str],
     agent: EvalAgent,
-    client: IsaEvalClient,
+    client: EvalClient,
     solver: BestFirstSearch,
     logger: Optional[logging.Logger] = None,
+    skip_lemmas: Optional[Set[str]] = None,
+    on_record: Optional[Callable[[str, EvalRecord], None]] = None,
+    parallel_searches: int = 1,
+    commands_cache: Optional[TheoryCommandsCache] = None,
+    recovery: Optional[ITPRecovery] = None,
+    lemma_order: Optional[Sequence[str]] = None,
 ) -> Dict[str, EvalRecord]:
     if logger is None:
         logger = prepare_logger(f"Evaluate-{Path(thy_path).stem}")
@@ -35,9 +42,14 @@ def evaluate_single_theory(
     logger.debug(f"Start evaluating theory file {thy_path}, parsing commands")
     # assume that the ITP is already set up
     try:
-        commands = client.get_theory_commands(
-            Path(thy_path), only_statements=False, remove_ignored=True
-        )
+        if commands_cache is not None:
+            commands = commands_cache.get_theory_commands(
+                client, Path(thy_path), only_statements=False, remove_ignored=True
+            )
+        else:
+            commands = client.get_theory_commands(
+                Path(thy_path), only_statements=False, remove_ignored=True
+            )
     except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
         logger.warning(f"Failed to parse theory file {thy_path}: {rpc_error.details()}")
         return {}
@@ -53,77 +65,244 @@ def evaluate_single_theory(
         commands[:-1], lambda c: c.name in ISA_PROOF_COMMANDS
     )
     evaluation_records: Dict[str, EvalRecord] = {}
-
-    # solve all lemmas
-    for idx, group in enumerate(grouped_commands[1:]):
-
+    if skip_lemmas is None:
+        skip_lemmas = set()
+    # when resuming, jump directly to the first lemma that is not recorded yet
+    started = False
+
+    # after an RPC error, the ITP is set up again and the default state is
+    # rebuilt by proceed_until at the next lemma to search, instead of a
+    # replay from the top of the file
+    setup = client.setup
+    recoveries = 0
+
+    # with a lemma order, the replay only takes a snapshot of the statement
+    # state of each lemma, the searches then run in that order; lemmas
+    # missing from the order come last, in file order
+    rank = {lemma: i for i, lemma in enumerate(lemma_order or [])}
+    deferred: Dict[str, ITPState] = {}
+    # the lemmas whose snapshot or search was lost with the ITP, searched
+    # again from their statement after a recovery
+    lost_lemmas: List[str] = []
+
+    def ordered(lemmas: List[str]) -> List[str]:
+        return sorted(lemmas, key=lambda l: rank.get(l, len(rank)))
+
+    def recover() -> bool:
+        nonlocal recoveries, started
+        if recovery is None or setup is None:
+            return False
+        if recoveries >= recovery.max_recoveries:
+            logger.warning(f"Giving up on {thy_path} after {recoveries} recoveries")
+            return False
+        recoveries += 1
+        logger.info(f"Recovering the ITP ({recoveries} / {recovery.max_recoveries})")
+        if not recovery.recover(client, setup, logger):
+            return False
+        started = False
+        # the snapshots are gone with the replaced ITP instance
+        lost_lemmas.extend(deferred)
+        deferred.clear()
+        return True
+
+    def record(lemma: str, solved: bool, proof_steps: List[str], search_summary):
+        evaluation_records[lemma] = EvalRecord(solved, proof_steps, search_summary)
+        if on_record is not None:
+            on_record(lemma, evaluation_records[lemma])
         logger.info(
-            f"Ready to process {group[0].command} ({idx + 1} / {len(grouped_commands) - 1})"
+            f"Solver {'succeeded' if solved else 'failed'} in "
+            f"{search_summary.total_time} seconds ({lemma})"
         )
 
-        logger.debug(group)
+    # with parallel searches, the theory is replayed once and each lemma is
+    # searched from a snapshot of its statement state on a worker pool
+    executor = ThreadPoolExecutor(parallel_searches) if parallel_searches > 1 else None
+    pending: Dict[Future, str] = {}
 
+    def solve_from_snapshot(snapshot: ITPState, lemma: str):
         try:
-            if idx == 0:
-                default_state = client.proceed_until(
-                    Path(thy_path), group[0].command, 60
-                )
-            else:
-                default_state = client.execute("default", group[0].command, 60)
-        except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
-            logger.warning(
-                f"Failed to proceed to {group[0].command}: {rpc_error.details()}"
+            return solver.solve(
+                snapshot,
+                agent,
+                client,
+                ignore_duplicate_inputs=True,
+                isolated=True,
+                name=lemma,
             )
-            return evaluation_records
-
-        # try to prove the lemma, 'default' state is the only remaining state
-        logger.info(f"Start searching with {solver.__class__.__name__}")
-
-        # try:
-        solved, proof_steps, search_summary = solver.solve(
-            default_state, agent, client, ignore_duplicate_inputs=True
-        )
-        # except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
-        #     logger.warning(f"Error when trying to solve {group[0].command}: {rpc_error.details()}")
-        #     return evaluation_records
-
-        evaluation_records[group[0].command] = EvalRecord(
-            solved, proof_steps, search_summary
-        )
-
-        logger.info(
-            f"Solver {'succeeded' if solved else 'failed'} in "
-            f"{search_summary.total_time} seconds ({group[0].command})"
-        )
+        finally:
+            client.remove_state(snapshot.state_id)
 
-        # proceed to the next lemma, note that all errors are ignored
-        for command in group[1:]:
-            logger.debug(f"Executing {command.command}")
+    def collect_searches() -> List[str]:
+        # records the finished snapshot searches, and returns the lemmas whose
+        # search failed with an RPC error
+        crashed_lemmas = []
+        for future in as_completed(pending):
             try:
-                default_state = client.execute("default", command.command, 60)
+                record(pending[future], *future.result())
             except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
                 logger.warning(
-                    f"Failed when executing {command.command}: {rpc_error.details()}"
+                    f"Error when trying to solve {pending[future]}: {rpc_error.details()}"
                 )
-                return evaluation_records
-            assert default_state.state_id == "default", "state_id should be 'default'"
-            logger.debug(f"Default state: {default_state}")
-
-    # only applies to Isabelle
-    logger.info(f"Finishing theory file {thy_path}")
+                crashed_lemmas.append(pending[future])
+        pending.clear()
+        return crashed_lemmas
 
     try:
-        if len(grouped_commands) > 1:
-            default_state = client.execute("default", commands[-1].command, 60)
-        else:
-            default_state = client.proceed_until(
-                Path(thy_path), commands[-1].command, 60
+        # solve all lemmas
+        for idx, group in enumerate(grouped_commands[1:]):
+            lemma = group[0].command
+            skipped = lemma in skip_lemmas
+            if skipped and not started:
+                continue
+
+            logger.info(
+                f"Ready to process {lemma} ({idx + 1} / {len(grouped_commands) - 1})"
             )
-    except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
-        logger.warning(
-            f"Failed when trying to finish theory file {thy_path}: {rpc_error.details()}"
-        )
-        return evaluation_records
+
+            logger.debug(group)
+
+            # after a recovery, a lemma is searched again unless its search
+            # already finished or crashed the ITP before
+            searched = skipped
+            crashed = False
+            while True:
+                try:
+                    if not started:
+                        default_state = client.proceed_until(Path(thy_path), lemma, 60)
+                        started = True
+                    else:
+                        default_state = client.execute("default", lemma, 60)
+
+                    if skipped:
+                        logger.info(f"Skipping {lemma}, already recorded")
+                    elif searched:
+                        pass
+                    elif lemma_order is not None:
+                        deferred[lemma] = client.clone_state("default")
+                        searched = True
+                    elif executor is not None:
+                        snapshot = client.clone_state("default")
+                        logger.info(
+                            f"Submitting search from snapshot {snapshot.state_id}"
+                        )
+                        future = executor.submit(solve_from_snapshot, snapshot, lemma)
+                        pending[future] = lemma
+                        searched = True
+                    else:
+                        # try to prove the lemma, 'default' state is the only remaining state
+                        logger.info(f"Start searching with {solver.__class__.__name__}")
+                        solved, proof_steps, search_summary = solver.solve(
+                            default_state,
+                            agent,
+                            client,
+                            ignore_duplicate_inputs=True,
+                            name=lemma,
+                        )
+                        record(lemma, solved, proof_steps, search_summary)
+                        searched = True
+
+                    # proceed to the next lemma, note that all errors are ignored
+                    for command in group[1:]:
+                        logger.debug(f"Executing {command.command}")
+                        default_state = client.execute("default", command.command, 60)
+                        assert (
+                            default_state.state_id == "default"
+                        ), "state_id should be 'default'"
+                        logger.debug(f"Default state: {default_state}")
+                    break
+                except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
+                    logger.warning(
+                        f"Failed when processing {lemma}: {rpc_error.details()}"
+                    )
+                    if not searched and crashed:
+                        record(
+                            lemma, False, [], SearchSummary(failure_reason="ITP error")
+                        )
+                        searched = True
+                    crashed = True
+                    if not recover():
+                        return evaluation_records
+                    if searched:
+                        # the next lemma rebuilds the default state
+                        break
+
+        for lemma in ordered(list(deferred)):
+            if lemma not in deferred:
+                # lost in a recovery
+                continue
+            snapshot = deferred.pop(lemma)
+            try:
+                if lemma in skip_lemmas:
+                    client.remove_state(snapshot.state_id)
+                elif executor is not None:
+                    future = executor.submit(solve_from_snapshot, snapshot, lemma)
+                    pending[future] = lemma
+                else:
+                    record(lemma, *solve_from_snapshot(snapshot, lemma))
+            except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
+                logger.warning(
+                    f"Error when trying to solve {lemma}: {rpc_error.details()}"
+                )
+                if lemma not in skip_lemmas:
+                    lost_lemmas.append(lemma)
+                if not recover():
+                    return evaluation_records
+
+        # the snapshot searches that failed with the ITP are searched again
+        # from the statement of their lemma after a recovery
+        crashed_lemmas = collect_searches()
+        if len(crashed_lemmas) > 0 and recover():
+            lost_lemmas.extend(crashed_lemmas)
+        if len(lost_lemmas) > 0:
+            for lemma in ordered(lost_lemmas):
+                if lemma in skip_lemmas:
+                    continue
+                try:
+                    default_state = client.proceed_until(Path(thy_path), lemma, 60)
+                    record(
+                        lemma,
+                        *solver.solve(
+                            default_state,
+                            agent,
+                            client,
+                            ignore_duplicate_inputs=True,
+                            name=lemma,
+                        ),
+                    )
+                except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
+                    logger.warning(
+                        f"Error when trying to solve {lemma}: {rpc_error.details()}"
+                    )
+                    record(lemma, False, [], SearchSummary(failure_reason="ITP error"))
+                    if not recover():
+                        return evaluation_records
+            # the default state is inside the proof of the last lemma
+            started = False
+
+        # only applies to Isabelle
+        logger.info(f"Finishing theory file {thy_path}")
+
+        while True:
+            try:
+                if started:
+                    default_state = client.execute("default", commands[-1].command, 60)
+                else:
+                    default_state = client.proceed_until(
+                        Path(thy_path), commands[-1].command, 60
+                    )
+                break
+            except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
+                logger.warning(
+                    f"Failed when trying to finish theory file {thy_path}: {rpc_error.details()}"
+                )
+                if not recover():
+                    return evaluation_records
+    finally:
+        # searches from snapshots outlive the replay, the returned records
+        # are completed here even when the replay stopped early
+        collect_searches()
+        if executor is not None:
+            executor.shutdown()
 
     assert (
         default_state.state == "Mode: Toplevel"
@@ -155,6 +334,26 @@ def prepare_setups(
     return [(f"HOL", theories_path, piece) for piece in pieces]
 
 
+def make_eval_client(
+    port: int,
+    tactic_cache_path: Optional[Union[os.PathLike, str]] = None,
+    record_path: Optional[Union[os.PathLike, str]] = None,
+    sledgehammer_concurrency: int = 2,
+    sledgehammer_timeout: Optional[int] = None,
+) -> EvalClient:
+    client = IsaEvalClient(
+        port,
+        sledgehammer_concurrency=sledgehammer_concurrency,
+        sledgehammer_timeout=sledgehammer_timeout,
+    )
+    if tactic_cache_path is not None:
+        client = CachingEvalClient(client, TacticCache(tactic_cache_path))
+    if record_path is not None:
+        # outermost, so that outcomes answered by the tactic cache are recorded
+        client = RecordingEvalClient(client, ReplayStore(record_path))
+    return client
+
+
 def evaluate_isabelle_agent(
     isa_path: Union[os.PathLike, str],
     theories_path: Union[os.PathLike, str],
@@ -162,46 +361,414 @@ def evaluate_isabelle_agent(
     solver: BestFirstSearch,
     session_roots: Optional[Union[os.PathLike, str]] = None,
     port: int = 8980,
+    tactic_cache_path: Optional[Union[os.PathLike, str]] = None,
+    journal_path: Optional[Union[os.PathLike, str]] = None,
+    resume: bool = False,
+    parallel_searches: int = 1,
+    commands_cache_path: Optional[Union[os.PathLike, str]] = None,
+    metrics_path: Optional[Union[os.PathLike, str]] = None,
+    record_path: Optional[Union[os.PathLike, str]] = None,
+    sledgehammer_concurrency: int = 2,
+    sledgehammer_timeout: Optional[int] = None,
+    max_recoveries: int = 3,
+    server: Optional[IsaEvalServerProcess] = None,
     logger: Optional[logging.Logger] = None,
 ) -> Tuple[Dict[Tuple[str, str, Path], EvalRecord], Dict[Tuple[str, Path], float]]:
     if logger is None:
         logger = prepare_logger("Evaluate")
+    if metrics_path is not None:
+        enable_metrics()
 
+    journal = EvalJournal(journal_path, resume) if journal_path is not None else None
     eval_time_dict: Dict[Tuple[str, Path], float] = {}
-
-    client = IsaEvalClient(port)
     final_eval_records: Dict[Tuple[str, str, Path], EvalRecord] = {}
+    if journal is not None:
+        final_eval_records.update(journal.records)
+        eval_time_dict.update(journal.times)
+        logger.info(
+            f"Resuming from {len(journal.records)} lemmas "
+            f"in {len(journal.times)} finished theory files"
+        )
+
+    client = make_eval_client(
+        port,
+        tactic_cache_path,
+        record_path,
+        sledgehammer_concurrency,
+        sledgehammer_timeout,
+    )
+    commands_cache = (
+        TheoryCommandsCache(commands_cache_path)
+        if commands_cache_path is not None
+        else None
+    )
+    # `server`, the process of the IsaEval server on `port`, is restarted if
+    # it dies during the evaluation
+    recovery = ITPRecovery(server, max_recoveries) if max_recoveries > 0 else None
+    failed_setup: Optional[IsaSetup] = None
     for session, wd, thy_files in prepare_setups(Path(theories_path)):
+        if journal is not None:
+            thy_files = [p for p in thy_files if not journal.theory_done(session, p)]
+            if len(thy_files) == 0:
+                continue
         setup = IsaSetup(
             Path(isa_path),
             session,
             wd,
             Path(session_roots) if session_roots is not None else None,
         )
-        time_before_eval = time.time()
-        logger.info(f"Setting up ITP (session {setup.session} with {setup.isa_path})")
-
-        try:
-            client.open_stub()
-            client.setup_itp(setup)
-        except InactiveRpcError as rpc_error:
-            logger.warning(f"Failed to setup ITP: {rpc_error.details()}")
+        if setup == failed_setup:
             continue
-        finally:
+        # consecutive setups are often identical, e.g. the chunks of a
+        # directory without ROOT file, and keep the running session
+        if setup != client.setup:
+            time_before_eval = time.time()
             logger.info(
-                f"ITP setup finished in {time.time() - time_before_eval:.2f} seconds"
+                f"Setting up ITP (session {setup.session} with {setup.isa_path})"
             )
 
+            try:
+                client.open_stub()
+                client.setup_itp(setup)
+            except InactiveRpcError as rpc_error:
+                logger.warning(f"Failed to setup ITP: {rpc_error.details()}")
+                failed_setup = setup
+                continue
+            finally:
+                logger.info(
+                    f"ITP setup finished in {time.time() - time_before_eval:.2f} seconds"
+                )
+
         for thy_path in thy_files:
             time_before_eval = time.time()
-            eval_record = evaluate_single_theory(thy_path, agent, client, solver)
+            eval_record = evaluate_single_theory(
+                thy_path,
+                agent,
+                client,
+                solver,
+                skip_lemmas=(
+                    journal.recorded_lemmas(session, thy_path)
+                    if journal is not None
+                    else None
+                ),
+                on_record=(
+                    (
+                        lambda lemma, record: journal.record_lemma(
+                            session, thy_path, lemma, record
+                        )
+                    )
+                    if journal is not None
+                    else None
+                ),
+                parallel_searches=parallel_searches,
+                commands_cache=commands_cache,
+                recovery=recovery,
+            )
             eval_time_dict[(session, thy_path)] = time.time() - time_before_eval
             final_eval_records.update(
                 {(key, session, thy_path): value for key, value in eval_record.items()}
             )
+            if journal is not None:
+                journal.record_theory(
+                    session, thy_path, eval_time_dict[(session, thy_path)]
+                )
 
+    if client.setup is not None:
         client.close_itp()
 
+    if isinstance(client, RecordingEvalClient):
+        logger.info(f"Recorded {len(client.cache)} outcomes in {record_path}")
+        client.store.close()
+        client = client.client
+    if isinstance(client, CachingEvalClient):
+        logger.info(f"Tactic cache statistics: {client.cache.stats()}")
+        client = client.client
+    if isinstance(client, IsaEvalClient) and client.sledgehammer_calls > 0:
+        logger.info(f"Sledgehammer statistics: {client.sledgehammer_stats()}")
+    if commands_cache is not None:
+        logger.info(f"Theory commands cache statistics: {commands_cache.stats()}")
+        commands_cache.close()
+    if recovery is not None and recovery.recoveries + recovery.failures > 0:
+        logger.info(f"ITP recovery statistics: {recovery.stats()}")
+    if journal is not None:
+        journal.close()
+    if solver.trace is not None:
+        solver.trace.close()
+    if solver.timeout_policy is not None:
+        logger.info(f"Timeout policy statistics:\n{solver.timeout_policy.summary()}")
+    if metrics_path is not None:
+        METRICS.dump(metrics_path)
+        logger.info(f"Latency metrics written to {metrics_path}")
+
+    return final_eval_records, eval_time_dict
+
+
+def _parallel_evaluation_worker(
+    port: int,
+    isa_path: Path,
+    session_roots: Optional[Path],
+    agent: EvalAgent,
+    solver: BestFirstSearch,
+    task_queue: multiprocessing.Queue,
+    result_queue: multiprocessing.Queue,
+    tactic_cache_path: Optional[Path] = None,
+    parallel_searches: int = 1,
+    commands_cache_path: Optional[Path] = None,
+    collect_metrics: bool = False,
+    record_path: Optional[Path] = None,
+    sledgehammer_concurrency: int = 2,
+    sledgehammer_timeout: Optional[int] = None,
+    max_recoveries: int = 3,
+    server_command: Optional[Sequence[str]] = None,
+) -> None:
+    logger = prepare_logger(f"Evaluate-{port}")
+    enable_metrics(collect_metrics)
+    client = make_eval_client(
+        port,
+        tactic_cache_path,
+        record_path,
+        sledgehammer_concurrency,
+        sledgehammer_timeout,
+    )
+    commands_cache = (
+        TheoryCommandsCache(commands_cache_path)
+        if commands_cache_path is not None
+        else None
+    )
+    # a server the worker launched itself is restarted if it dies
+    server = (
+        IsaEvalServerProcess(port, server_command)
+        if server_command is not None
+        else None
+    )
+    if server is not None:
+        stop_on_terminate(server)
+        server.start()
+    recovery = ITPRecovery(server, max_recoveries) if max_recoveries > 0 else None
+    current_setup: Optional[IsaSetup] = None
+    failed_setup: Optional[IsaSetup] = None
+
+    try:
+        while (task := task_queue.get()) is not None:
+            session, wd, thy_path, skip_lemmas = task
+            setup = IsaSetup(isa_path, session, wd, session_roots)
+
+            # the ITP is only restarted when the session changes, tasks are queued
+            # in session order so that each worker keeps its session warm
+            if setup != current_setup:
+                if current_setup is not None:
+                    client.close_itp(keep_warm=True)
+                    current_setup = None
+                if setup == failed_setup:
+                    result_queue.put(("theory", session, thy_path, None, None))
+                    continue
+                time_before_setup = time.time()
+                logger.info(f"Setting up ITP (session {session} with {isa_path})")
+                try:
+                    client.setup_itp(setup)
+                    current_setup = setup
+                except InactiveRpcError as rpc_error:
+                    logger.warning(f"Failed to setup ITP: {rpc_error.details()}")
+                    failed_setup = setup
+                    result_queue.put(("theory", session, thy_path, None, None))
+                    continue
+                finally:
+                    logger.info(
+                        f"ITP setup finished in {time.time() - time_before_setup:.2f} seconds"
+                    )
+
+            # each lemma is reported as soon as it is solved so that the journal
+            # survives a crashing worker
+            time_before_eval = time.time()
+            eval_record = evaluate_single_theory(
+                thy_path,
+                agent,
+                client,
+                solver,
+                skip_lemmas=skip_lemmas,
+                on_record=lambda lemma, record: result_queue.put(
+                    ("lemma", session, thy_path, lemma, record)
+                ),
+                parallel_searches=parallel_searches,
+                commands_cache=commands_cache,
+                recovery=recovery,
+            )
+            result_queue.put(
+                (
+                    "theory",
+                    session,
+                    thy_path,
+                    eval_record,
+                    time.time() - time_before_eval,
+                )
+            )
+
+        if current_setup is not None:
+            client.close_itp()
+        if commands_cache is not None:
+            commands_cache.close()
+        if recovery is not None and recovery.recoveries + recovery.failures > 0:
+            logger.info(f"ITP recovery statistics: {recovery.stats()}")
+        if solver.trace is not None:
+            solver.trace.close()
+        if solver.timeout_policy is not None:
+            logger.info(
+                f"Timeout policy statistics:\n{solver.timeout_policy.summary()}"
+            )
+        if collect_metrics:
+            result_queue.put(("metrics", None, None, METRICS.to_json()))
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def evaluate_isabelle_agent_parallel(
+    isa_path: Union[os.PathLike, str],
+    theories_path: Union[os.PathLike, str],
+    agent: EvalAgent,
+    solver: BestFirstSearch,
+    ports: Sequence[int],
+    session_roots: Optional[Union[os.PathLike, str]] = None,
+    launch_servers: bool = False,
+    start_method: Optional[str] = None,
+    tactic_cache_path: Optional[Union[os.PathLike, str]] = None,
+    journal_path: Optional[Union[os.PathLike, str]] = None,
+    resume: bool = False,
+    parallel_searches: int = 1,
+    commands_cache_path: Optional[Union[os.PathLike, str]] = None,
+    metrics_path: Optional[Union[os.PathLike, str]] = None,
+    record_path: Optional[Union[os.PathLike, str]] = None,
+    sledgehammer_concurrency: int = 2,
+    sledgehammer_timeout: Optional[int] = None,
+    max_recoveries: int = 3,
+    logger: Optional[logging.Logger] = None,
+) -> Tuple[Dict[Tuple[str, str, Path], EvalRecord], Dict[Tuple[str, Path], float]]:
+    if logger is None:
+        logger = prepare_logger("Evaluate")
+    if metrics_path is not None:
+        enable_metrics()
+
+    journal = EvalJournal(journal_path, resume) if journal_path is not None else None
+    eval_time_dict: Dict[Tuple[str, Path], float] = {}
+    final_eval_records: Dict[Tuple[str, str, Path], EvalRecord] = {}
+    if journal is not None:
+        final_eval_records.update(journal.records)
+        eval_time_dict.update(journal.times)
+
+    tasks = [
+        (
+            session,
+            wd,
+            thy_path,
+            journal.recorded_lemmas(session, thy_path) if journal is not None else None,
+        )
+        for session, wd, thy_files in prepare_setups(Path(theories_path))
+        for thy_path in thy_files
+        if journal is None or not journal.theory_done(session, thy_path)
+    ]
+    logger.info(f"Evaluating {len(tasks)} theory files with {len(ports)} workers")
+
+    # the server is built once for all the workers that launch one
+    server_command = build_server() if launch_servers else None
+    mp_context = multiprocessing.get_context(start_method)
+    task_queue = mp_context.Queue()
+    result_queue = mp_context.Queue()
+    for task in tasks:
+        task_queue.put(task)
+    for _ in ports:
+        task_queue.put(None)
+
+    workers = [
+        mp_context.Process(
+            target=_parallel_evaluation_worker,
+            args=(
+                port,
+                Path(isa_path),
+                Path(session_roots) if session_roots is not None else None,
+                agent,
+                solver,
+                task_queue,
+                result_queue,
+                tactic_cache_path,
+                parallel_searches,
+                commands_cache_path,
+                metrics_path is not None,
+                record_path,
+                sledgehammer_concurrency,
+                sledgehammer_timeout,
+                max_recoveries,
+                # each worker owns its server, so that it can restart it
+                server_command,
+            ),
+            daemon=True,
+        )
+        for port in ports
+    ]
+
+    try:
+        for worker in workers:
+            worker.start()
+
+        remaining = len(tasks)
+        metrics_remaining = len(workers) if metrics_path is not None else 0
+        while remaining > 0:
+            try:
+                kind, session, thy_path, *result = result_queue.get(timeout=10)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    logger.warning(
+                        f"All workers exited with {remaining} theory files unfinished"
+                    )
+                    break
+                continue
+
+            if kind == "lemma":
+                if journal is not None:
+                    journal.record_lemma(session, thy_path, *result)
+                continue
+            if kind == "metrics":
+                METRICS.merge_json(*result)
+                metrics_remaining -= 1
+                continue
+
+            remaining -= 1
+            eval_record, eval_time = result
+            if eval_record is None:
+                continue
+            eval_time_dict[(session, thy_path)] = eval_time
+            if journal is not None:
+                journal.record_theory(session, thy_path, eval_time)
+            final_eval_records.update(
+                {(key, session, thy_path): value for key, value in eval_record.items()}
+            )
+            logger.info(
+                f"Finished {thy_path} in {eval_time:.2f} seconds ({remaining} remaining)"
+            )
+
+        # the workers report their metrics after the last task
+        while metrics_remaining > 0:
+            try:
+                kind, _, _, *result = result_queue.get(timeout=10)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+            if kind == "metrics":
+                METRICS.merge_json(*result)
+                metrics_remaining -= 1
+
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        if journal is not None:
+            journal.close()
+    if metrics_path is not None:
+        METRICS.dump(metrics_path)
+        logger.info(f"Latency metrics written to {metrics_path}")
+
     return final_eval_records, eval_time_dict
 
 
@@ -226,6 +793,9 @@ def pretty_print_eval_summary(
         sum(len(r.proof_steps) for r in records.values() if r.solved) / solved_count
     )
     avg_search_time = sum(r.search_summary.total_time for r in records.values()) / num
+    avg_search_overlap_time = (
+        sum(r.search_summary.overlap_time for r in records.values()) / num
+    )
     print(f"Solved {solved_count} out of {num} lemmas")
     print(f"Generated {generated_cmd_count} commands, succeeded {succeeded_cmd_count}")
     print(f"Total query count: {query_count}, timeout count: {timeout_count}")
@@ -235,6 +805,18 @@ def pretty_print_eval_summary(
         f"Average search time: {avg_search_time:.4f} seconds"
         f" (query {avg_search_query_time:.4f} / ITP {avg_search_itp_running_time:.4f})"
     )
+    if avg_search_overlap_time > 0:
+        print(f"Average query / ITP overlap: {avg_search_overlap_time:.4f} seconds")
+    # averages hide the tail, e.g. a few lemmas that hit the total timeout
+    search_times = sorted(r.search_summary.total_time for r in records.values())
+    print(
+        f"Search time p50 {search_times[num // 2]:.4f}"
+        f" / p90 {search_times[int(num * 0.9)]:.4f}"
+        f" / max {search_times[-1]:.4f} seconds"
+    )
+    if METRICS.enabled and len(METRICS.histograms) > 0:
+        print("Latency histograms:")
+        print(METRICS.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,273 @@
+import itertools
+from typing import Any, Callable, Dict, Generic, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class MinMaxHeap(Generic[T]):
+    # elements on even levels are smaller than their descendants, elements on
+    # odd levels are larger, so both ends are reachable in O(1) and removable
+    # in O(log n)
+    def __init__(self) -> None:
+        self.heap: List[T] = []
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    def __iter__(self):
+        return iter(self.heap)
+
+    @staticmethod
+    def _is_min_level(idx: int) -> bool:
+        return (idx + 1).bit_length() % 2 == 1
+
+    def push(self, item: T) -> None:
+        heap = self.heap
+        heap.append(item)
+        idx = len(heap) - 1
+        if idx == 0:
+            return
+        parent = (idx - 1) // 2
+        if self._is_min_level(idx):
+            if heap[parent] < heap[idx]:
+                heap[idx], heap[parent] = heap[parent], heap[idx]
+                self._bubble_up(parent, is_min=False)
+            else:
+                self._bubble_up(idx, is_min=True)
+        else:
+            if heap[idx] < heap[parent]:
+                heap[idx], heap[parent] = heap[parent], heap[idx]
+                self._bubble_up(parent, is_min=True)
+            else:
+                self._bubble_up(idx, is_min=False)
+
+    def _bubble_up(self, idx: int, is_min: bool) -> None:
+        heap = self.heap
+        while idx > 2:
+            grandparent = ((idx - 1) // 2 - 1) // 2
+            if is_min:
+                if not heap[idx] < heap[grandparent]:
+                    return
+            elif not heap[grandparent] < heap[idx]:
+                return
+            heap[idx], heap[grandparent] = heap[grandparent], heap[idx]
+            idx = grandparent
+
+    def peek_min(self) -> T:
+        return self.heap[0]
+
+    def _max_index(self) -> int:
+        heap = self.heap
+        if len(heap) <= 2:
+            return len(heap) - 1
+        return 1 if heap[2] < heap[1] else 2
+
+    def peek_max(self) -> T:
+        return self.heap[self._max_index()]
+
+    def pop_min(self) -> T:
+        return self._pop_at(0)
+
+    def pop_max(self) -> T:
+        return self._pop_at(self._max_index())
+
+    def _pop_at(self, idx: int) -> T:
+        heap = self.heap
+        last = heap.pop()
+        if idx == len(heap):
+            return last
+        item = heap[idx]
+        heap[idx] = last
+        self._trickle_down(idx)
+        return item
+
+    def _trickle_down(self, idx: int) -> None:
+        heap = self.heap
+        size = len(heap)
+        is_min = self._is_min_level(idx)
+        while True:
+            first_child = 2 * idx + 1
+            if first_child >= size:
+                return
+            # the extreme element among children and grandchildren
+            candidates = [first_child, first_child + 1]
+            candidates += range(4 * idx + 3, min(4 * idx + 7, size))
+            best = first_child
+            for candidate in candidates[1:]:
+                if candidate >= size:
+                    continue
+                if is_min:
+                    if heap[candidate] < heap[best]:
+                        best = candidate
+                elif heap[best] < heap[candidate]:
+                    best = candidate
+
+            if best <= first_child + 1:
+                # a child, no further level to fix
+                if (is_min and heap[best] < heap[idx]) or (
+                    not is_min and heap[idx] < heap[best]
+                ):
+                    heap[idx], heap[best] = heap[best], heap[idx]
+                return
+
+            # a grandchild
+            if is_min:
+                if not heap[best] < heap[idx]:
+                    return
+            elif not heap[idx] < heap[best]:
+                return
+            heap[idx], heap[best] = heap[best], heap[idx]
+            parent = (best - 1) // 2
+            if (is_min and heap[parent] < heap[best]) or (
+                not is_min and heap[best] < heap[parent]
+            ):
+                heap[best], heap[parent] = heap[parent], heap[best]
+            idx = best
+
+
+class _Entry:
+    __slots__ = ("score", "order", "node")
+
+    def __init__(self, score: float, order: int, node: Any) -> None:
+        self.score = score
+        self.order = order
+        self.node = node
+
+    def __lt__(self, other: "_Entry") -> bool:
+        # ties are broken by insertion order, like heapq with SNode
+        if self.score != other.score:
+            return self.score < other.score
+        return self.order < other.order
+
+
+class Frontier:
+    # nodes are ordered by their `score` attribute, lower is better, and
+    # evicted nodes are passed to `on_evict` so that their states can be freed
+    def __init__(self, on_evict: Optional[Callable[[Any], None]] = None) -> None:
+        self.on_evict = on_evict
+        self._counter = itertools.count()
+        self.evicted_num = 0
+
+    def _entry(self, node: Any) -> _Entry:
+        return _Entry(node.score, next(self._counter), node)
+
+    def _evict(self, node: Any) -> None:
+        self.evicted_num += 1
+        if self.on_evict is not None:
+            self.on_evict(node)
+
+    def push(self, node: Any) -> None:
+        pass
+
+    def pop(self) -> Any:
+        pass
+
+    def nodes(self) -> List[Any]:
+        pass
+
+    def __len__(self) -> int:
+        pass
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+
+class BestFirstFrontier(Frontier):
+    def __init__(
+        self, capacity: int, on_evict: Optional[Callable[[Any], None]] = None
+    ) -> None:
+        super().__init__(on_evict)
+        self.capacity = capacity
+        self.heap: MinMaxHeap[_Entry] = MinMaxHeap()
+
+    def push(self, node: Any) -> None:
+        self.heap.push(self._entry(node))
+        if len(self.heap) > self.capacity:
+            self._evict(self.heap.pop_max().node)
+
+    def pop(self) -> Any:
+        return self.heap.pop_min().node
+
+    def nodes(self) -> List[Any]:
+        return [entry.node for entry in self.heap]
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+
+class DepthCappedFrontier(Frontier):
+    # best-first over all depths, with at most `depth_cap` nodes per depth and
+    # `capacity` nodes in total; popping scans the heads of the depth levels
+    def __init__(
+        self,
+        capacity: int,
+        depth_cap: int,
+        on_evict: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        super().__init__(on_evict)
+        self.capacity = capacity
+        self.depth_cap = depth_cap
+        self.levels: Dict[int, MinMaxHeap[_Entry]] = {}
+        self.size = 0
+
+    def push(self, node: Any) -> None:
+        level = self.levels.setdefault(node.depth, MinMaxHeap())
+        level.push(self._entry(node))
+        self.size += 1
+        if len(level) > self.depth_cap:
+            self._evict_from(node.depth)
+        if self.size > self.capacity:
+            worst_depth = max(
+                (depth for depth, lvl in self.levels.items() if len(lvl) > 0),
+                key=lambda depth: self.levels[depth].peek_max(),
+            )
+            self._evict_from(worst_depth)
+
+    def _evict_from(self, depth: int) -> None:
+        self.size -= 1
+        self._evict(self.levels[depth].pop_max().node)
+
+    def _pop_from(self, depth: int) -> Any:
+        self.size -= 1
+        return self.levels[depth].pop_min().node
+
+    def pop(self) -> Any:
+        best_depth = min(
+            (depth for depth, lvl in self.levels.items() if len(lvl) > 0),
+            key=lambda depth: self.levels[depth].peek_min(),
+        )
+        return self._pop_from(best_depth)
+
+    def nodes(self) -> List[Any]:
+        return [entry.node for level in self.levels.values() for entry in level]
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class BeamFrontier(DepthCappedFrontier):
+    # level-by-level expansion: the shallowest depth is exhausted first, and
+    # each depth keeps only its `depth_cap` best nodes
+    def pop(self) -> Any:
+        shallowest = min(depth for depth, lvl in self.levels.items() if len(lvl) > 0)
+        return self._pop_from(shallowest)
+
+
+FRONTIER_POLICIES = ["best_first", "beam", "depth_capped"]
+
+
+def make_frontier(
+    policy: str,
+    capacity: int,
+    depth_cap: Optional[int] = None,
+    on_evict: Optional[Callable[[Any], None]] = None,
+) -> Frontier:
+    if policy == "best_first":
+        return BestFirstFrontier(capacity, on_evict)
+    if depth_cap is None:
+        depth_cap = capacity
+    if policy == "beam":
+        return BeamFrontier(capacity, depth_cap, on_evict)
+    if policy == "depth_capped":
+        return DepthCappedFrontier(capacity, depth_cap, on_evict)
+    raise ValueError(f"unknown frontier policy {policy}, expected {FRONTIER_POLICIES}")
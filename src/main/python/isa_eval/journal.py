@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+from typing import Dict, List, Set, Tuple, Union
+
+from search import SearchSummary
+
+
+@dataclass
+class EvalRecord:
+    solved: bool
+    proof_steps: List[str]
+    search_summary: SearchSummary
+
+
+def record_to_json(record: EvalRecord) -> dict:
+    return {
+        "solved": record.solved,
+        "proof_steps": record.proof_steps,
+        "summary": asdict(record.search_summary),
+    }
+
+
+def record_from_json(entry: dict) -> EvalRecord:
+    # fields of older versions of SearchSummary are dropped
+    summary_fields = {f.name for f in fields(SearchSummary)}
+    summary = {k: v for k, v in entry["summary"].items() if k in summary_fields}
+    return EvalRecord(entry["solved"], entry["proof_steps"], SearchSummary(**summary))
+
+
+class EvalJournal:
+    # an append-only JSONL log of evaluation results, one line per solved or
+    # failed lemma and one line per finished theory file, flushed as soon as
+    # they are produced so that an interrupted run can be resumed
+    def __init__(self, path: Union[os.PathLike, str], resume: bool = True):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.records: Dict[Tuple[str, str, Path], EvalRecord] = {}
+        self.times: Dict[Tuple[str, Path], float] = {}
+        self.lemmas: Dict[Tuple[str, Path], Set[str]] = {}
+        if resume and self.path.exists():
+            self._load()
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        if self._file.tell() > 0:
+            with open(self.path, "rb") as journal_file:
+                journal_file.seek(-1, os.SEEK_END)
+                if journal_file.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def _load(self) -> None:
+        with open(self.path, encoding="utf-8") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line may be truncated if the run was killed
+                    continue
+                thy_path = Path(entry["theory"])
+                if entry["type"] == "lemma":
+                    self._add_record(
+                        entry["session"],
+                        thy_path,
+                        entry["lemma"],
+                        record_from_json(entry),
+                    )
+                elif entry["type"] == "theory":
+                    self.times[(entry["session"], thy_path)] = entry["time"]
+
+    def _add_record(
+        self, session: str, thy_path: Path, lemma: str, record: EvalRecord
+    ) -> None:
+        self.records[(lemma, session, thy_path)] = record
+        self.lemmas.setdefault((session, thy_path), set()).add(lemma)
+
+    def _append(self, entry: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def record_lemma(
+        self, session: str, thy_path: Path, lemma: str, record: EvalRecord
+    ) -> None:
+        self._add_record(session, Path(thy_path), lemma, record)
+        self._append(
+            {
+                "type": "lemma",
+                "session": session,
+                "theory": str(thy_path),
+                "lemma": lemma,
+                **record_to_json(record),
+            }
+        )
+
+    def record_theory(self, session: str, thy_path: Path, eval_time: float) -> None:
+        self.times[(session, Path(thy_path))] = eval_time
+        self._append(
+            {
+                "type": "theory",
+                "session": session,
+                "theory": str(thy_path),
+                "time": eval_time,
+            }
+        )
+
+    def theory_done(self, session: str, thy_path: Path) -> bool:
+        return (session, Path(thy_path)) in self.times
+
+    def recorded_lemmas(self, session: str, thy_path: Path) -> Set[str]:
+        return set(self.lemmas.get((session, Path(thy_path)), ()))
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
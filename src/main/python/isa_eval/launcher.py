@@ -0,0 +1,159 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import grpc
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[4]
+
+SERVER_MAIN_CLASS = "xk.luan.isa_eval.IsaEvalServer"
+
+# compiles the server and prints the classpath to run it with on the last line
+BUILD_COMMAND = ("sbt", "--batch", "-error", "export Runtime/fullClasspath")
+
+
+def build_server(
+    cwd: Path = PROJECT_ROOT, build_command: Sequence[str] = BUILD_COMMAND
+) -> List[str]:
+    # several `sbt run` in the same project directory would all compile into
+    # the same target directory and fight over the sbt server, so the project
+    # is built once and the servers run from its classpath
+    result = subprocess.run(
+        list(build_command),
+        cwd=cwd,
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+    )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or len(lines) == 0:
+        raise RuntimeError(
+            f"failed to build the server (exit code {result.returncode}):\n"
+            f"{result.stdout}{result.stderr}"
+        )
+    return ["java", "-cp", lines[-1], SERVER_MAIN_CLASS]
+
+
+class IsaEvalServerProcess:
+    # without a `command`, the server is built with `build_server` before it
+    # is started for the first time
+    def __init__(
+        self,
+        port: int,
+        command: Optional[Sequence[str]] = None,
+        cwd: Path = PROJECT_ROOT,
+        log_file: Optional[Path] = None,
+    ):
+        self.port = port
+        self.command = list(command) if command is not None else None
+        self.cwd = cwd
+        self.log_file = log_file
+        self.process: Optional[subprocess.Popen] = None
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def spawn(self) -> None:
+        if self.is_running():
+            return
+        if self.command is None:
+            self.command = build_server(self.cwd)
+        env = dict(os.environ, ISA_EVAL_PORT=str(self.port))
+        output = (
+            open(self.log_file, "a")
+            if self.log_file is not None
+            else subprocess.DEVNULL
+        )
+        self.process = subprocess.Popen(
+            self.command,
+            cwd=self.cwd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=output,
+            stderr=subprocess.STDOUT,
+        )
+        if self.log_file is not None:
+            output.close()
+
+    def start(self, timeout: float = 600.0) -> None:
+        self.spawn()
+        self.wait_until_ready(timeout)
+
+    def wait_until_ready(self, timeout: float = 600.0) -> None:
+        deadline = time.time() + timeout
+        with grpc.insecure_channel(f"localhost:{self.port}") as channel:
+            while True:
+                if self.process is not None and self.process.poll() is not None:
+                    raise RuntimeError(
+                        f"server on port {self.port} exited with code {self.process.returncode}"
+                    )
+                try:
+                    grpc.channel_ready_future(channel).result(
+                        timeout=min(5.0, max(deadline - time.time(), 0.1))
+                    )
+                    return
+                except grpc.FutureTimeoutError:
+                    if time.time() > deadline:
+                        raise TimeoutError(
+                            f"server on port {self.port} not ready after {timeout} seconds"
+                        )
+
+    def stop(self, timeout: float = 30.0) -> None:
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def restart(self, timeout: float = 600.0) -> None:
+        self.stop()
+        self.start(timeout)
+
+
+def stop_on_terminate(server: IsaEvalServerProcess) -> None:
+    # a worker process that launched its own server is terminated by its
+    # parent, and the server would outlive it otherwise
+    def handler(signum, frame):
+        server.stop()
+        sys.exit(128 + signum)
+
+    signal.signal(signal.SIGTERM, handler)
+
+
+def launch_local_servers(
+    ports: Sequence[int],
+    command: Optional[Sequence[str]] = None,
+    log_dir: Optional[Path] = None,
+    timeout: float = 600.0,
+) -> List[IsaEvalServerProcess]:
+    if command is None:
+        command = build_server()
+    servers = [
+        IsaEvalServerProcess(
+            port,
+            command,
+            log_file=log_dir / f"server-{port}.log" if log_dir is not None else None,
+        )
+        for port in ports
+    ]
+    # the JVMs take a while to boot, so spawn all servers before waiting for any
+    try:
+        for server in servers:
+            server.spawn()
+        for server in servers:
+            server.wait_until_ready(timeout)
+    except (RuntimeError, TimeoutError):
+        for server in servers:
+            server.stop()
+        raise
+    return servers
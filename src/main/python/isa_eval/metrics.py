@@ -0,0 +1,199 @@
+import bisect
+import functools
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# seconds, from fast tactics up to sledgehammer calls and session setups
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(buckets)
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket containing the q-quantile
+        if self.count == 0:
+            return math.nan
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+
+class MetricsRegistry:
+    # histograms keyed by metric name and labels; when disabled, `observe`
+    # and `timer` return immediately so instrumentation costs one attribute
+    # lookup per call
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        time_before = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - time_before, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms = {}
+
+    def to_json(self) -> Dict[str, List[dict]]:
+        with self._lock:
+            return {
+                name: [
+                    {
+                        "labels": dict(labels),
+                        "buckets": list(histogram.buckets),
+                        "counts": list(histogram.counts),
+                        "sum": histogram.sum,
+                        "count": histogram.count,
+                    }
+                    for labels, histogram in series.items()
+                ]
+                for name, series in self.histograms.items()
+            }
+
+    def merge_json(self, data: Dict[str, List[dict]]) -> None:
+        # e.g. to collect the metrics of evaluation worker processes
+        with self._lock:
+            for name, series in data.items():
+                for entry in series:
+                    key = tuple(sorted(entry["labels"].items()))
+                    histogram = self.histograms.setdefault(name, {}).get(key)
+                    if histogram is None:
+                        histogram = Histogram(entry["buckets"])
+                        self.histograms[name][key] = histogram
+                    histogram.counts = [
+                        a + b for a, b in zip(histogram.counts, entry["counts"])
+                    ]
+                    histogram.sum += entry["sum"]
+                    histogram.count += entry["count"]
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in self.histograms.items():
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series.items():
+                    label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                    prefix = label_text + "," if label_text else ""
+                    cumulative = 0
+                    for bound, count in zip(
+                        histogram.buckets + (math.inf,), histogram.counts
+                    ):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+                    suffix = "{" + label_text + "}" if label_text else ""
+                    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+                    lines.append(f"{name}_count{suffix} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        with open(path, "w") as metrics_file:
+            if str(path).endswith(".json"):
+                json.dump(self.to_json(), metrics_file, indent=2)
+            else:
+                metrics_file.write(self.to_prometheus())
+
+    def summary(self, quantiles: Sequence[float] = (0.5, 0.9, 0.99)) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self.histograms.items()):
+                for labels, histogram in sorted(series.items()):
+                    label_text = ", ".join(f"{k}={v}" for k, v in labels)
+                    quantile_text = ", ".join(
+                        f"p{int(q * 100)} <= {histogram.quantile(q):g}s"
+                        for q in quantiles
+                    )
+                    lines.append(
+                        f"{name} ({label_text}): {histogram.count} calls, "
+                        f"mean {histogram.sum / histogram.count:.4f}s, {quantile_text}"
+                    )
+        return "\n".join(lines)
+
+
+METRICS = MetricsRegistry()
+
+
+def enable_metrics(enabled: bool = True) -> MetricsRegistry:
+    METRICS.enabled = enabled
+    return METRICS
+
+
+def timed_rpc(method: str):
+    # records the latency of an RPC, and the outcome class of single outcomes
+    def decorator(call):
+        @functools.wraps(call)
+        def inner(*args, **kwargs):
+            if not METRICS.enabled:
+                return call(*args, **kwargs)
+            time_before = time.perf_counter()
+            result = call(*args, **kwargs)
+            elapsed = time.perf_counter() - time_before
+            METRICS.observe("isa_eval_rpc_seconds", elapsed, method=method)
+            outcome_class: Optional[str] = getattr(result, "result", None)
+            if isinstance(outcome_class, str):
+                METRICS.observe(
+                    "isa_eval_command_seconds", elapsed, result=outcome_class
+                )
+            return result
+
+        return inner
+
+    return decorator
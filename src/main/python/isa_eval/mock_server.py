@@ -0,0 +1,407 @@
+import random
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import grpc
+
+import isa_eval_pb2
+import isa_eval_pb2_grpc
+
+
+@dataclass
+class MockConfig:
+    # latencies of tactics are log-normally distributed around `latency_median`
+    # seconds, and all sleeps are multiplied by `time_scale`, e.g. 0 measures
+    # the overhead of the Python layer alone
+    latency_median: float = 0.05
+    latency_sigma: float = 1.0
+    time_scale: float = 1.0
+    success_prob: float = 0.3
+    timeout_prob: float = 0.05
+    # a successful tactic closes a subgoal with `progress_prob`, and the
+    # lemmas need between 1 and `proof_depth` subgoals to be closed
+    progress_prob: float = 0.5
+    proof_depth: int = 3
+    goal_size: int = 200
+    sledgehammer_success_prob: float = 0.2
+    sledgehammer_latency: float = 2.0
+    seed: int = 0
+
+
+@dataclass
+class MockState:
+    key: int
+    level: int
+    remaining: int
+    text: str
+
+
+def write_mock_theories(
+    directory: Union[Path, str], theory_num: int = 1, lemma_num: int = 10
+) -> List[Path]:
+    # one command per line, the format the mock server parses
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(theory_num):
+        lines = [f"theory Mock_{i} imports Main begin"]
+        for j in range(lemma_num):
+            lines.append(f'lemma mock_{i}_{j}: "P {i} {j}"')
+            lines.append("by auto")
+        lines.append("end")
+        path = directory / f"Mock_{i}.thy"
+        path.write_text("\n".join(lines) + "\n")
+        paths.append(path)
+    return paths
+
+
+class MockIsaEvalServicer(isa_eval_pb2_grpc.IsaEvalServicer):
+    # a stand-in for the Scala server that simulates tactics instead of running
+    # Isabelle; outcomes only depend on the seed, the state and the command,
+    # so repeated runs explore the same search trees
+    def __init__(self, config: Optional[MockConfig] = None):
+        self.config = config if config is not None else MockConfig()
+        self.states: Dict[str, MockState] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(64)
+        self.executed_num = 0
+        # Isabelle instances set up so far, a setup like the last one reuses
+        # the running instance as the server pool does unless it is forced
+        self.setup_num = 0
+        self._last_setup: Optional[Tuple[str, str, str, str]] = None
+
+    def _rng(self, *keys) -> random.Random:
+        return random.Random(
+            zlib.crc32(":".join(map(str, (self.config.seed,) + keys)).encode())
+        )
+
+    def _goal_text(self, key: int, remaining: int) -> str:
+        prefix = f"goal ({remaining} subgoals) {key:08x}: "
+        filler = "x" * max(self.config.goal_size - len(prefix), 0)
+        return prefix + filler
+
+    def _get(self, state_id: str, context) -> MockState:
+        with self.lock:
+            state = self.states.get(state_id)
+        if state is None:
+            context.abort(grpc.StatusCode.INTERNAL, f"key not found: {state_id}")
+        return state
+
+    def _put(self, state_id: str, state: MockState) -> None:
+        with self.lock:
+            self.states[state_id] = state
+
+    @staticmethod
+    def _outcome(
+        state_id: str, state: MockState, result: str = "SUCCESS", message: str = ""
+    ) -> isa_eval_pb2.OutcomeState:
+        return isa_eval_pb2.OutcomeState(
+            id=state_id,
+            result=result,
+            message=message,
+            level=state.level,
+            state=state.text,
+        )
+
+    def _sleep(self, seconds: float, cancelled: Optional[threading.Event]) -> bool:
+        # returns False if the command is cancelled while sleeping
+        seconds *= self.config.time_scale
+        if seconds <= 0:
+            return cancelled is None or not cancelled.is_set()
+        if cancelled is None:
+            time.sleep(seconds)
+            return True
+        return not cancelled.wait(seconds)
+
+    def _apply(
+        self, state: MockState, command: str, timeout: int
+    ) -> Tuple[str, MockState, float, str]:
+        # returns the result, the new state, the latency and the message
+        config = self.config
+        if state.level == 0:
+            return self._apply_theory_command(state, command)
+
+        rng = self._rng(state.key, command)
+        draw = rng.random()
+        latency = rng.lognormvariate(0.0, config.latency_sigma) * config.latency_median
+        # tactics slower than their timeout time out as well
+        if draw < config.timeout_prob or latency > timeout:
+            return "TIMEOUT", state, float(timeout), f"Timeout after {timeout}s"
+        if draw >= config.timeout_prob + config.success_prob:
+            return "ERROR", state, latency, "Failed to apply proof method"
+        remaining = state.remaining - (1 if rng.random() < config.progress_prob else 0)
+        key = rng.getrandbits(32)
+        new_state = MockState(
+            key,
+            0 if remaining == 0 else state.level,
+            remaining,
+            "" if remaining == 0 else self._goal_text(key, remaining),
+        )
+        return "SUCCESS", new_state, latency, ""
+
+    def _apply_theory_command(
+        self, state: MockState, command: str
+    ) -> Tuple[str, MockState, float, str]:
+        name = command.split(maxsplit=1)[0] if command.strip() else ""
+        if name in ("lemma", "theorem"):
+            key = zlib.crc32(command.encode())
+            remaining = self._rng(command).randint(1, self.config.proof_depth)
+            return (
+                "SUCCESS",
+                MockState(key, 1, remaining, self._goal_text(key, remaining)),
+                0.0,
+                "",
+            )
+        if name == "end":
+            return "SUCCESS", MockState(0, 0, 0, "Mode: Toplevel"), 0.0, ""
+        return "SUCCESS", MockState(state.key, 0, 0, ""), 0.0, ""
+
+    def _run_command(
+        self,
+        parent_id: str,
+        parent: MockState,
+        command: str,
+        timeout: int,
+        cancelled: Optional[threading.Event] = None,
+    ) -> Tuple[str, MockState, str, str, float]:
+        # runs a command on a fresh clone of its parent, like the real server,
+        # and also returns the simulated latency
+        new_id = str(uuid.uuid4())
+        self._put(new_id, parent)
+        result, new_state, latency, message = self._apply(parent, command, timeout)
+        if not self._sleep(latency, cancelled):
+            with self.lock:
+                self.states.pop(new_id, None)
+            return new_id, parent, "CANCELLED", "", 0.0
+        with self.lock:
+            self.executed_num += 1
+        if result == "SUCCESS":
+            self._put(new_id, new_state)
+        state = new_state if result == "SUCCESS" else parent
+        return new_id, state, result, message, latency
+
+    def _run_stream(
+        self, requests: List[isa_eval_pb2.ProofCommands], context
+    ) -> Iterator[isa_eval_pb2.OutcomeState]:
+        parents = {r.id: self._get(r.id, context) for r in requests}
+        cancelled = threading.Event()
+        context.add_callback(cancelled.set)
+        futures = {
+            self.executor.submit(
+                self._run_command,
+                r.id,
+                parents[r.id],
+                r.commands,
+                r.timeout,
+                cancelled,
+            ): (index, r.id)
+            for index, r in enumerate(requests)
+        }
+        delivered = set()
+        try:
+            for future in as_completed(futures):
+                index, parent_id = futures[future]
+                new_id, state, result, message, latency = future.result()
+                outcome = self._outcome(new_id, state, result, message)
+                outcome.index = index
+                outcome.parent_id = parent_id
+                outcome.elapsed = latency
+                # like the Scala server, an outcome counts as sent once it is
+                # handed to the transport, the stream may be closed right at
+                # the yield
+                delivered.add(future)
+                yield outcome
+        finally:
+            cancelled.set()
+            # the client never sees the states of a cancelled stream that
+            # finished after all
+            for future in futures:
+                if future not in delivered:
+                    future.add_done_callback(self._discard_outcome)
+
+    def _discard_outcome(self, future: Future) -> None:
+        with self.lock:
+            self.states.pop(future.result()[0], None)
+
+    def SetupIsabelle(self, request, context):
+        setup = (
+            request.isa_path,
+            request.session,
+            request.working_directory,
+            request.session_roots,
+        )
+        with self.lock:
+            self.states = {}
+            if request.force_new or setup != self._last_setup:
+                self.setup_num += 1
+            self._last_setup = setup
+        return isa_eval_pb2.Setup(
+            isa_path=request.isa_path,
+            session=request.session,
+            working_directory=request.working_directory,
+        )
+
+    def CloseIsabelle(self, request, context):
+        with self.lock:
+            self.states = {}
+            self._last_setup = None
+        return isa_eval_pb2.Empty()
+
+    def ReleaseIsabelle(self, request, context):
+        with self.lock:
+            self.states = {}
+        return isa_eval_pb2.Empty()
+
+    def _theory_commands(self, theory: str, context) -> List[Tuple[str, str, int]]:
+        path = Path(theory)
+        if not path.exists():
+            context.abort(grpc.StatusCode.INTERNAL, f"theory not found: {theory}")
+        return [
+            (line.strip(), line.split(maxsplit=1)[0], idx + 1)
+            for idx, line in enumerate(path.read_text().splitlines())
+            if line.strip() != ""
+        ]
+
+    def ProceedUntil(self, request, context):
+        state = MockState(0, 0, 0, "")
+        for command, _, _ in self._theory_commands(request.theory, context):
+            _, state, _, _ = self._apply_theory_command(state, command)
+            if command == request.content.strip():
+                break
+        with self.lock:
+            self.states = {"default": state}
+        return self._outcome("default", state)
+
+    def Execute(self, request, context):
+        # only used to replay the commands of a theory, which always succeed
+        state = self._get(request.id, context)
+        _, new_state, _, _ = self._apply_theory_command(state, request.commands.strip())
+        self._put(request.id, new_state)
+        return self._outcome(request.id, new_state)
+
+    def ExecuteMany(self, request_iterator, context):
+        requests = list(request_iterator)
+        outcomes = sorted(self._run_stream(requests, context), key=lambda o: o.index)
+        return isa_eval_pb2.OutcomeStateStream(
+            outcomes="<OUTCOME_SEP>".join(
+                f"<STATE>{o.id}<RESULT>{o.result}<MSG>{o.message}"
+                f"<LEVEL>{o.level}<DESCR>{o.state}"
+                for o in outcomes
+            )
+        )
+
+    def ExecuteManyStreamed(self, request_iterator, context):
+        yield from self._run_stream(list(request_iterator), context)
+
+    def ExecuteBatch(self, request_iterator, context):
+        yield from self._run_stream(list(request_iterator), context)
+
+    def CallSledgehammer(self, request, context):
+        state = self._get(request.id, context)
+        rng = self._rng(state.key, "sledgehammer")
+        found = state.level > 0 and rng.random() < self.config.sledgehammer_success_prob
+        self._sleep(
+            min(self.config.sledgehammer_latency, request.sledgehammer_timeout), None
+        )
+        new_id = str(uuid.uuid4())
+        if not found:
+            self._put(new_id, state)
+            return self._outcome(new_id, state, "ERROR", "No proof found")
+        remaining = state.remaining - 1
+        key = rng.getrandbits(32)
+        new_state = MockState(
+            key,
+            0 if remaining == 0 else state.level,
+            remaining,
+            "" if remaining == 0 else self._goal_text(key, remaining),
+        )
+        self._put(new_id, new_state)
+        return self._outcome(new_id, new_state, "SUCCESS", f"by (metis mock_{key})")
+
+    def CloneState(self, request, context):
+        state = self._get(request.id, context)
+        new_id = str(uuid.uuid4())
+        self._put(new_id, state)
+        return self._outcome(new_id, state)
+
+    def RemoveState(self, request, context):
+        with self.lock:
+            self.states.pop(request.id, None)
+        return isa_eval_pb2.Empty()
+
+    def RemoveStates(self, request, context):
+        with self.lock:
+            for state_id in request.ids:
+                self.states.pop(state_id, None)
+        return isa_eval_pb2.Empty()
+
+    def ClearAndRename(self, request, context):
+        state = self._get(request.id, context)
+        with self.lock:
+            self.states = {request.new_id: state}
+        return self._outcome(request.new_id, state)
+
+    def GetTheoryCommands(self, request, context):
+        commands = self._theory_commands(request.theory, context)
+        if request.only_statements:
+            commands = [c for c in commands if c[1] in ("lemma", "theorem")]
+        return isa_eval_pb2.IsabelleCommandStream(
+            commands="<CMD_SEP>".join(
+                f"<CMD>{cmd}<NAME>{name}<LINE>{line}" for cmd, name, line in commands
+            )
+        )
+
+
+class MockIsaEvalServer:
+    def __init__(
+        self,
+        port: int = 0,
+        config: Optional[MockConfig] = None,
+        max_workers: int = 16,
+    ):
+        # port 0 picks a free port, see `self.port` after starting
+        self.servicer = MockIsaEvalServicer(config)
+        self.server = grpc.server(ThreadPoolExecutor(max_workers))
+        isa_eval_pb2_grpc.add_IsaEvalServicer_to_server(self.servicer, self.server)
+        self.port = self.server.add_insecure_port(f"localhost:{port}")
+
+    def start(self) -> "MockIsaEvalServer":
+        self.server.start()
+        return self
+
+    def stop(self, grace: Optional[float] = None) -> None:
+        self.server.stop(grace)
+        self.servicer.executor.shutdown(wait=False, cancel_futures=True)
+
+    @property
+    def live_states(self) -> int:
+        with self.servicer.lock:
+            return len(self.servicer.states)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a mock IsaEval server")
+    parser.add_argument("--port", type=int, default=8980)
+    parser.add_argument("--time-scale", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock_server = MockIsaEvalServer(
+        args.port, MockConfig(time_scale=args.time_scale, seed=args.seed)
+    ).start()
+    print(f"Mock server listening on port {mock_server.port}")
+    mock_server.server.wait_for_termination()
@@ -0,0 +1,78 @@
+import logging
+from typing import Dict, Optional
+
+from grpc._channel import _InactiveRpcError as InactiveRpcError
+from grpc._channel import _MultiThreadedRendezvous as MultiThreadedRendezvous
+
+from client import EvalClient, ITPSetup
+from launcher import IsaEvalServerProcess
+
+
+class ITPRecovery:
+    # brings the ITP of a client back after an RPC error in the middle of a
+    # theory file: Isabelle is set up again with a new instance in place of
+    # the pooled one, which may be left in a bad state, and a `server`
+    # process that died or cannot be set up anymore is restarted first. Only
+    # a `server` this process launched can be restarted, otherwise the ITP is
+    # given up on when the server is gone. A theory file gives up after
+    # `max_recoveries` recoveries, so that a lemma that keeps crashing the
+    # server does not stall the evaluation.
+    def __init__(
+        self,
+        server: Optional[IsaEvalServerProcess] = None,
+        max_recoveries: int = 3,
+        ready_timeout: float = 600.0,
+    ):
+        self.server = server
+        self.max_recoveries = max_recoveries
+        self.ready_timeout = ready_timeout
+        self.recoveries = 0
+        self.restarts = 0
+        self.failures = 0
+
+    def _restart_server(self, logger: logging.Logger) -> bool:
+        logger.warning(f"Restarting the server on port {self.server.port}")
+        try:
+            self.server.restart(self.ready_timeout)
+        except (RuntimeError, TimeoutError) as error:
+            logger.warning(f"Failed to restart the server: {error}")
+            return False
+        self.restarts += 1
+        return True
+
+    def _setup(self, client: EvalClient, setup: ITPSetup) -> None:
+        # the channel and the pending calls of the old server are dropped
+        client.close()
+        client.open_stub()
+        client.setup_itp(setup, force_new=True)
+
+    def recover(
+        self, client: EvalClient, setup: ITPSetup, logger: logging.Logger
+    ) -> bool:
+        if self.server is not None and not self.server.is_running():
+            logger.warning(f"The server on port {self.server.port} exited")
+            if not self._restart_server(logger):
+                self.failures += 1
+                return False
+        try:
+            self._setup(client, setup)
+        except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
+            logger.warning(f"Failed to setup ITP again: {rpc_error.details()}")
+            if self.server is None or not self._restart_server(logger):
+                self.failures += 1
+                return False
+            try:
+                self._setup(client, setup)
+            except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
+                logger.warning(f"Failed to setup ITP again: {rpc_error.details()}")
+                self.failures += 1
+                return False
+        self.recoveries += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "recoveries": self.recoveries,
+            "restarts": self.restarts,
+            "failures": self.failures,
+        }
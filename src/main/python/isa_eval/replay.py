@@ -0,0 +1,284 @@
+import os
+import threading
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from cache import (
+    CachedOutcome,
+    CachingEvalClient,
+    TacticCache,
+    TheoryCommandsCache,
+    fingerprint,
+)
+from client import EvalClient, ITPCommand, ITPSetup, ITPState, IsaState
+
+# the pseudo command under which the outcome of proceed_until is recorded
+PROCEED_UNTIL_COMMAND = "<proceed_until>"
+
+
+class ReplayMissError(LookupError):
+    pass
+
+
+class ReplayStore:
+    # the outcomes of every command a RecordingEvalClient sent to the ITP, with
+    # the parsed theory files and the states reached by proceed_until; all of
+    # them live in one SQLite file and are never evicted
+    def __init__(self, path: Union[os.PathLike, str]):
+        self.path = Path(path)
+        self.outcomes = TacticCache(self.path, max_entries=2**62, track_access=False)
+        self.theories = TheoryCommandsCache(self.path)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {
+            "outcomes": self.outcomes.stats(),
+            "theories": self.theories.stats(),
+        }
+
+    def close(self) -> None:
+        self.outcomes.close()
+        self.theories.close()
+
+
+def _outcome_of(state: ITPState, timeout: int) -> CachedOutcome:
+    return CachedOutcome(
+        state.result, state.message, state.proof_level, state.state, timeout
+    )
+
+
+class RecordingEvalClient(CachingEvalClient):
+    # forwards every call to the wrapped client, e.g. an IsaEvalClient, and
+    # records the outcomes in a ReplayStore. Commands executed in place, i.e.
+    # the replay of a theory on the default state, are also recorded by their
+    # position in the theory alone, so that they can be replayed whatever the
+    # searches in between did.
+    def __init__(self, client: EvalClient, store: ReplayStore):
+        super().__init__(client, store.outcomes)
+        self.store = store
+
+    @staticmethod
+    def _position_key(context: str, command: str) -> str:
+        return TacticCache.make_key(context, "", command)
+
+    def _cacheable(self, command: str) -> bool:
+        return True
+
+    def _cached(self, key: str, timeout: int) -> Optional[CachedOutcome]:
+        return None
+
+    def proceed_until(self, thy_path: Path, content: str, timeout: int) -> ITPState:
+        state = super().proceed_until(thy_path, content, timeout)
+        self.cache.put(
+            self._position_key(
+                self._proceed_context(thy_path, content), PROCEED_UNTIL_COMMAND
+            ),
+            _outcome_of(state, timeout),
+        )
+        return state
+
+    def execute(self, state_id: str, commands: str, timeout: int) -> ITPState:
+        with self._lock:
+            context = self._contexts.get(state_id)
+        state = super().execute(state_id, commands, timeout)
+        if context is not None:
+            self.cache.put(
+                self._position_key(context, commands), _outcome_of(state, timeout)
+            )
+        return state
+
+    def get_theory_commands(
+        self, thy_path: Path, only_statements: bool, remove_ignored: bool
+    ) -> List[ITPCommand]:
+        return self.store.theories.get_theory_commands(
+            self.client, thy_path, only_statements, remove_ignored
+        )
+
+
+class _UnknownOutcomeClient(EvalClient):
+    # the fallback of an offline replay, commands that were never recorded
+    # have the "UNKNOWN" result
+    def __init__(self) -> None:
+        super().__init__(0)
+        self.unknown_num = 0
+        self._lock = threading.Lock()
+
+    def setup_itp(self, setup: ITPSetup, force_new: bool = False) -> ITPSetup:
+        self.setup = setup
+        return setup
+
+    def close_itp(self, keep_warm: bool = False) -> None:
+        self.setup = None
+
+    def unknown(self, state_id: str, proof_level: int, state: str) -> ITPState:
+        with self._lock:
+            self.unknown_num += 1
+        return IsaState(state_id, "UNKNOWN", "not recorded", proof_level, state)
+
+    def execute_many(
+        self, state_id: str, commands_lst: List[str], timeout: int
+    ) -> List[ITPState]:
+        return [
+            self.unknown(CachingEvalClient.CACHED_PREFIX + uuid.uuid4().hex, -1, "")
+            for _ in commands_lst
+        ]
+
+    def remove_state(self, state_id: str) -> None:
+        pass
+
+    def remove_states(self, state_ids: List[str]) -> None:
+        pass
+
+
+class ReplayEvalClient(RecordingEvalClient):
+    # answers commands from a ReplayStore. On misses, it falls through to the
+    # `fallback` client and records the new outcomes. Without a fallback, no
+    # ITP is needed at all: states only exist on the client, and commands that
+    # were never recorded have the "UNKNOWN" result.
+    def __init__(self, store: ReplayStore, fallback: Optional[EvalClient] = None):
+        self.offline = fallback is None
+        super().__init__(
+            fallback if fallback is not None else _UnknownOutcomeClient(), store
+        )
+        # the outcomes of the states changed in place, e.g. "default"
+        self._states: Dict[str, ITPState] = {}
+
+    @property
+    def unknown_num(self) -> int:
+        return self.client.unknown_num if self.offline else 0
+
+    def stats(self) -> Dict[str, float]:
+        return dict(self.cache.stats(), unknown=self.unknown_num)
+
+    def _reset(self) -> None:
+        super()._reset()
+        self._states = {}
+
+    def _cacheable(self, command: str) -> bool:
+        # with a live fallback, lazy sledgehammer successes could not be
+        # executed again
+        return self.offline or CachingEvalClient._cacheable(self, command)
+
+    def _cached(self, key: str, timeout: int) -> Optional[CachedOutcome]:
+        return self.cache.get(key, timeout)
+
+    def _servable(self, cached: CachedOutcome) -> bool:
+        # offline, recorded proofs are all there is
+        return self.offline or super()._servable(cached)
+
+    def _resolve(self, state_id: str) -> Optional[str]:
+        # offline, states are never executed
+        if self.offline:
+            return state_id
+        return super()._resolve(state_id)
+
+    def _remember(self, state: ITPState, context: Optional[str]) -> ITPState:
+        with self._lock:
+            if context is not None:
+                self._track(state, context)
+            self._states[state.state_id] = state
+        return state
+
+    def proceed_until(self, thy_path: Path, content: str, timeout: int) -> ITPState:
+        if not self.offline:
+            return super().proceed_until(thy_path, content, timeout)
+        context = self._proceed_context(thy_path, content)
+        cached = self.cache.get(
+            self._position_key(context, PROCEED_UNTIL_COMMAND), timeout
+        )
+        if cached is None:
+            raise ReplayMissError(f"{content} in {thy_path} was not recorded")
+        with self._lock:
+            self._reset()
+        return self._remember(
+            IsaState(
+                "default",
+                cached.result,
+                cached.message,
+                cached.proof_level,
+                cached.state,
+            ),
+            context,
+        )
+
+    def execute(self, state_id: str, commands: str, timeout: int) -> ITPState:
+        if not self.offline:
+            return super().execute(state_id, commands, timeout)
+        with self._lock:
+            context = self._contexts.get(state_id)
+            previous = self._states.get(state_id)
+        cached = (
+            self.cache.get(self._position_key(context, commands), timeout)
+            if context is not None
+            else None
+        )
+        if cached is None:
+            state = self.client.unknown(
+                state_id,
+                previous.proof_level if previous is not None else -1,
+                previous.state if previous is not None else "",
+            )
+        else:
+            state = IsaState(
+                state_id,
+                cached.result,
+                cached.message,
+                cached.proof_level,
+                cached.state,
+            )
+        return self._remember(
+            state,
+            fingerprint(context, commands.strip()) if context is not None else None,
+        )
+
+    def _copy_state(self, state_id: str, new_state_id: str) -> ITPState:
+        with self._lock:
+            previous = self._states.get(state_id)
+            text = self._texts.get(state_id, "")
+        return IsaState(
+            new_state_id,
+            "SUCCESS",
+            "",
+            previous.proof_level if previous is not None else -1,
+            text,
+        )
+
+    def clone_state(self, state_id: str) -> ITPState:
+        if not self.offline:
+            return super().clone_state(state_id)
+        with self._lock:
+            context = self._contexts.get(state_id)
+        return self._remember(
+            self._copy_state(state_id, self._new_id(self.CACHED_PREFIX)), context
+        )
+
+    def clear_and_rename_state(self, state_id: str, new_state_id: str) -> ITPState:
+        if not self.offline:
+            return super().clear_and_rename_state(state_id, new_state_id)
+        state = self._copy_state(state_id, new_state_id)
+        with self._lock:
+            context = self._contexts.get(state_id)
+            self._reset()
+        return self._remember(state, context)
+
+    def call_sledgehammer(
+        self, state_id: str, timeout: int, sledgehammer_timeout: int
+    ) -> ITPState:
+        if not self.offline:
+            return super().call_sledgehammer(state_id, timeout, sledgehammer_timeout)
+        return self.execute_many(state_id, ["sledgehammer"], timeout)[0]
+
+    def get_theory_commands(
+        self, thy_path: Path, only_statements: bool, remove_ignored: bool
+    ) -> List[ITPCommand]:
+        if not self.offline:
+            return super().get_theory_commands(
+                thy_path, only_statements, remove_ignored
+            )
+        _, key = TheoryCommandsCache.make_key(
+            self.setup, thy_path, only_statements, remove_ignored
+        )
+        commands = self.store.theories.get(key)
+        if commands is None:
+            raise ReplayMissError(f"{thy_path} was not recorded")
+        return commands
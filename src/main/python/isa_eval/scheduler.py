@@ -0,0 +1,470 @@
+import copy
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from grpc._channel import _InactiveRpcError as InactiveRpcError
+from grpc._channel import _MultiThreadedRendezvous as MultiThreadedRendezvous
+
+from agent import EvalAgent
+from cache import CachingEvalClient, TheoryCommandsCache
+from client import EvalClient, IsaEvalClient, IsaSetup, ISA_PROOF_COMMANDS
+from evaluate import evaluate_single_theory, make_eval_client, prepare_setups
+from journal import EvalRecord
+from launcher import IsaEvalServerProcess
+from recovery import ITPRecovery
+from search import BestFirstSearch
+from utils import prepare_logger
+
+# "wall" counts the wall-clock time of the whole evaluation, replays and ITP
+# setups included; "itp" only counts the ITP running time of the searches
+BUDGET_KINDS = ["wall", "itp"]
+
+
+@dataclass
+class LemmaProgress:
+    session: str
+    thy_path: Path
+    lemma: str
+    # the position of the lemma in the evaluation, i.e. the file order
+    position: int
+    # the solved record, or the one of the last failed attempt
+    record: Optional[EvalRecord] = None
+    attempts: int = 0
+    search_seconds: float = 0.0
+    itp_seconds: float = 0.0
+
+    @property
+    def solved(self) -> bool:
+        return self.record is not None and self.record.solved
+
+    @property
+    def exhausted(self) -> bool:
+        # a larger budget would search the same, already explored tree again
+        return (
+            self.record is not None
+            and self.record.search_summary.failure_reason == "empty queue"
+        )
+
+
+# the lemmas with the lowest priority value are attempted first in each pass
+def file_order_priority(progress: LemmaProgress) -> float:
+    return progress.position
+
+
+def cheapest_priority(progress: LemmaProgress) -> float:
+    return progress.search_seconds
+
+
+def most_progress_priority(progress: LemmaProgress) -> float:
+    # the share of generated commands that succeeded in the last attempt
+    summary = progress.record.search_summary
+    return -summary.succeeded_num / max(summary.generated_num, 1)
+
+
+PRIORITIES: Dict[str, Callable[[LemmaProgress], float]] = {
+    "file_order": file_order_priority,
+    "cheapest": cheapest_priority,
+    "most_progress": most_progress_priority,
+}
+
+
+@dataclass
+class PassSummary:
+    index: int
+    scale: float
+    attempted: int = 0
+    solved: int = 0
+    seconds: float = 0.0
+
+    def __str__(self):
+        return (
+            f"pass {self.index} (scale {self.scale:g}): "
+            f"solved {self.solved} / {self.attempted} lemmas "
+            f"in {self.seconds:.2f} seconds"
+        )
+
+
+def scale_solver(solver: BestFirstSearch, scale: float) -> BestFirstSearch:
+    # the search limits of a pass; the trace, timeout policy and logger are
+    # shared with the original solver
+    scaled = copy.copy(solver)
+    scaled.query_limit = max(1, round(solver.query_limit * scale))
+    scaled.total_timeout = solver.total_timeout * scale
+    scaled.step_timeout_limit = max(1, round(solver.step_timeout_limit * scale))
+    return scaled
+
+
+class BudgetScheduler:
+    # spends a global budget of `budget_seconds` on the lemmas of a dataset in
+    # passes of iterative deepening. The first pass attempts every lemma with
+    # the search limits of the solver scaled by `first_pass_scale`, each later
+    # pass attempts the unsolved lemmas again, ordered by `priority`, with
+    # limits `growth` times larger, until the budget is spent or no lemma is
+    # left. Lemmas whose search ran out of candidates are not attempted again.
+    # A theory is replayed once per pass, so a pass visits the theories by
+    # their most urgent lemma and searches the lemmas of each theory by
+    # priority; a lemma never runs before a more urgent one of its theory,
+    # but may run before a more urgent one of a theory visited later.
+    def __init__(
+        self,
+        solver: BestFirstSearch,
+        budget_seconds: float,
+        budget_kind: str = "wall",
+        first_pass_scale: float = 0.1,
+        growth: float = 2.0,
+        max_scale: float = 1.0,
+        priority: Union[str, Callable[[LemmaProgress], float]] = "most_progress",
+    ):
+        assert budget_kind in BUDGET_KINDS, f"unknown budget kind {budget_kind}"
+        assert growth > 1, "the search limits should grow from pass to pass"
+        self.solver = solver
+        self.budget_seconds = budget_seconds
+        self.budget_kind = budget_kind
+        self.first_pass_scale = first_pass_scale
+        self.growth = growth
+        self.max_scale = max_scale
+        self.priority = PRIORITIES[priority] if isinstance(priority, str) else priority
+        self.progress: Dict[Tuple[str, str, Path], LemmaProgress] = {}
+        self.theory_lemmas: Dict[Tuple[str, Path], List[str]] = {}
+        self.passes: List[PassSummary] = []
+        self.start_time: Optional[float] = None
+        self.itp_seconds = 0.0
+
+    def start(self) -> None:
+        self.start_time = time.time()
+
+    @property
+    def spent(self) -> float:
+        if self.budget_kind == "itp":
+            return self.itp_seconds
+        return time.time() - self.start_time if self.start_time is not None else 0.0
+
+    @property
+    def remaining(self) -> float:
+        return max(self.budget_seconds - self.spent, 0.0)
+
+    @property
+    def exhausted(self) -> bool:
+        return self.spent >= self.budget_seconds
+
+    def scale_of(self, index: int) -> float:
+        return min(self.first_pass_scale * self.growth**index, self.max_scale)
+
+    def solver_for(self, index: int) -> BestFirstSearch:
+        solver = scale_solver(self.solver, self.scale_of(index))
+        if self.budget_kind == "wall":
+            # a search never runs past the end of the budget
+            solver.total_timeout = min(solver.total_timeout, self.remaining)
+        return solver
+
+    def register(self, session: str, thy_path: Path, lemmas: List[str]) -> None:
+        theory_lemmas = self.theory_lemmas.setdefault((session, thy_path), [])
+        for lemma in lemmas:
+            key = (lemma, session, thy_path)
+            if key not in self.progress:
+                self.progress[key] = LemmaProgress(
+                    session, thy_path, lemma, len(self.progress)
+                )
+                theory_lemmas.append(lemma)
+
+    def candidates(self, index: int) -> List[LemmaProgress]:
+        # the first pass attempts every lemma in file order
+        if index == 0:
+            return sorted(self.progress.values(), key=file_order_priority)
+        if self.scale_of(index) <= self.scale_of(index - 1):
+            return []
+        # lemmas the first pass could not reach, e.g. after a failed replay,
+        # are not attempted again
+        return sorted(
+            (
+                p
+                for p in self.progress.values()
+                if p.record is not None and not p.solved and not p.exhausted
+            ),
+            key=lambda p: (self.priority(p), p.position),
+        )
+
+    def observe(
+        self, session: str, thy_path: Path, lemma: str, record: EvalRecord
+    ) -> None:
+        progress = self.progress.get((lemma, session, thy_path))
+        if progress is None:
+            self.register(session, thy_path, [lemma])
+            progress = self.progress[(lemma, session, thy_path)]
+        progress.attempts += 1
+        progress.search_seconds += record.search_summary.total_time
+        progress.itp_seconds += record.search_summary.itp_running_time
+        self.itp_seconds += record.search_summary.itp_running_time
+        if not progress.solved:
+            progress.record = record
+        if len(self.passes) > 0:
+            self.passes[-1].attempted += 1
+            self.passes[-1].solved += record.solved
+
+    def records(self) -> Dict[Tuple[str, str, Path], EvalRecord]:
+        return {
+            key: progress.record
+            for key, progress in self.progress.items()
+            if progress.record is not None
+        }
+
+
+def _theory_lemmas(
+    client: EvalClient,
+    thy_path: Path,
+    commands_cache: Optional[TheoryCommandsCache],
+) -> List[str]:
+    # the same parse as evaluate_single_theory, which then hits the commands
+    # cache if there is one
+    if commands_cache is not None:
+        commands = commands_cache.get_theory_commands(
+            client, thy_path, only_statements=False, remove_ignored=True
+        )
+    else:
+        commands = client.get_theory_commands(
+            thy_path, only_statements=False, remove_ignored=True
+        )
+    return [c.command for c in commands if c.name in ISA_PROOF_COMMANDS]
+
+
+def evaluate_with_budget(
+    isa_path: Union[os.PathLike, str],
+    theories_path: Union[os.PathLike, str],
+    agent: EvalAgent,
+    solver: BestFirstSearch,
+    budget_seconds: float,
+    budget_kind: str = "wall",
+    first_pass_scale: float = 0.1,
+    growth: float = 2.0,
+    max_scale: float = 1.0,
+    priority: Union[str, Callable[[LemmaProgress], float]] = "most_progress",
+    session_roots: Optional[Union[os.PathLike, str]] = None,
+    port: int = 8980,
+    tactic_cache_path: Optional[Union[os.PathLike, str]] = None,
+    parallel_searches: int = 1,
+    commands_cache_path: Optional[Union[os.PathLike, str]] = None,
+    sledgehammer_concurrency: int = 2,
+    sledgehammer_timeout: Optional[int] = None,
+    max_recoveries: int = 3,
+    server: Optional[IsaEvalServerProcess] = None,
+    logger: Optional[logging.Logger] = None,
+) -> Tuple[Dict[Tuple[str, str, Path], EvalRecord], Dict[Tuple[str, Path], float]]:
+    if logger is None:
+        logger = prepare_logger("Schedule")
+
+    scheduler = BudgetScheduler(
+        solver,
+        budget_seconds,
+        budget_kind,
+        first_pass_scale,
+        growth,
+        max_scale,
+        priority,
+    )
+    client = make_eval_client(
+        port,
+        tactic_cache_path,
+        sledgehammer_concurrency=sledgehammer_concurrency,
+        sledgehammer_timeout=sledgehammer_timeout,
+    )
+    commands_cache = (
+        TheoryCommandsCache(commands_cache_path)
+        if commands_cache_path is not None
+        else None
+    )
+    # `server`, the process of the IsaEval server on `port`, is restarted if
+    # it dies during the evaluation
+    recovery = ITPRecovery(server, max_recoveries) if max_recoveries > 0 else None
+    setups = {
+        (session, thy_path): IsaSetup(
+            Path(isa_path),
+            session,
+            wd,
+            Path(session_roots) if session_roots is not None else None,
+        )
+        for session, wd, thy_files in prepare_setups(Path(theories_path))
+        for thy_path in thy_files
+    }
+    failed_setups: List[IsaSetup] = []
+    # the theories not parsed yet, the first pass registers their lemmas
+    unparsed: Set[Tuple[str, Path]] = set(setups)
+    eval_time_dict: Dict[Tuple[str, Path], float] = {}
+
+    scheduler.start()
+    index = 0
+    while not scheduler.exhausted:
+        candidates = scheduler.candidates(index)
+        if index == 0:
+            # theories in file order, their lemmas are not known yet
+            theories = list(setups)
+        elif len(candidates) == 0:
+            break
+        else:
+            # theories by their most urgent lemma
+            theories = []
+            for progress in candidates:
+                if (progress.session, progress.thy_path) not in theories:
+                    theories.append((progress.session, progress.thy_path))
+        scheduled = {(p.session, p.thy_path, p.lemma) for p in candidates}
+        pass_solver = scheduler.solver_for(index)
+        pass_summary = PassSummary(index, scheduler.scale_of(index))
+        scheduler.passes.append(pass_summary)
+        time_before_pass = time.time()
+        logger.info(
+            f"Starting pass {index} with query limit {pass_solver.query_limit} and "
+            f"total timeout {pass_solver.total_timeout:.2f} seconds "
+            f"({scheduler.spent:.2f} / {budget_seconds} {budget_kind} seconds spent)"
+        )
+
+        for session, thy_path in theories:
+            if scheduler.exhausted:
+                break
+            setup = setups[(session, thy_path)]
+            if setup in failed_setups:
+                continue
+            if setup != client.setup:
+                logger.info(
+                    f"Setting up ITP (session {setup.session} with {setup.isa_path})"
+                )
+                try:
+                    client.open_stub()
+                    client.setup_itp(setup)
+                except InactiveRpcError as rpc_error:
+                    logger.warning(f"Failed to setup ITP: {rpc_error.details()}")
+                    failed_setups.append(setup)
+                    continue
+
+            if (session, thy_path) in unparsed:
+                unparsed.discard((session, thy_path))
+                try:
+                    lemmas = _theory_lemmas(client, thy_path, commands_cache)
+                except (InactiveRpcError, MultiThreadedRendezvous) as rpc_error:
+                    logger.warning(
+                        f"Failed to parse theory file {thy_path}: {rpc_error.details()}"
+                    )
+                    continue
+                scheduler.register(session, thy_path, lemmas)
+                if index == 0:
+                    scheduled.update((session, thy_path, lemma) for lemma in lemmas)
+            lemmas = scheduler.theory_lemmas.get((session, thy_path), [])
+            # evaluate_single_theory checks this set before each lemma, so that
+            # the lemmas left when the budget runs out are skipped
+            skip_lemmas = {
+                lemma for lemma in lemmas if (session, thy_path, lemma) not in scheduled
+            }
+            if len(skip_lemmas) == len(lemmas):
+                continue
+
+            def on_record(lemma: str, record: EvalRecord):
+                scheduler.observe(session, thy_path, lemma, record)
+                if scheduler.exhausted:
+                    skip_lemmas.update(lemmas)
+
+            if budget_kind == "wall":
+                pass_solver.total_timeout = min(
+                    pass_solver.total_timeout, scheduler.remaining
+                )
+            time_before_eval = time.time()
+            evaluate_single_theory(
+                thy_path,
+                agent,
+                client,
+                pass_solver,
+                skip_lemmas=skip_lemmas,
+                on_record=on_record,
+                parallel_searches=parallel_searches,
+                commands_cache=commands_cache,
+                recovery=recovery,
+                # the first pass searches in file order along the replay
+                lemma_order=(
+                    None
+                    if index == 0
+                    else [
+                        p.lemma
+                        for p in candidates
+                        if (p.session, p.thy_path) == (session, thy_path)
+                    ]
+                ),
+            )
+            eval_time_dict[(session, thy_path)] = eval_time_dict.get(
+                (session, thy_path), 0.0
+            ) + (time.time() - time_before_eval)
+
+        pass_summary.seconds = time.time() - time_before_pass
+        logger.info(f"Finished {pass_summary}")
+        index += 1
+
+    if client.setup is not None:
+        client.close_itp()
+
+    if isinstance(client, CachingEvalClient):
+        logger.info(f"Tactic cache statistics: {client.cache.stats()}")
+        client = client.client
+    if isinstance(client, IsaEvalClient) and client.sledgehammer_calls > 0:
+        logger.info(f"Sledgehammer statistics: {client.sledgehammer_stats()}")
+    if commands_cache is not None:
+        logger.info(f"Theory commands cache statistics: {commands_cache.stats()}")
+        commands_cache.close()
+    if solver.trace is not None:
+        solver.trace.close()
+    if solver.timeout_policy is not None:
+        logger.info(f"Timeout policy statistics:\n{solver.timeout_policy.summary()}")
+    if recovery is not None and recovery.recoveries + recovery.failures > 0:
+        logger.info(f"ITP recovery statistics: {recovery.stats()}")
+
+    records = scheduler.records()
+    solved_count = sum(r.solved for r in records.values())
+    hours = (time.time() - scheduler.start_time) / 3600
+    logger.info(
+        f"Solved {solved_count} out of {len(scheduler.progress)} lemmas in "
+        f"{len(scheduler.passes)} passes, {scheduler.spent:.2f} / {budget_seconds} "
+        f"{budget_kind} seconds spent ({solved_count / max(hours, 1e-9):.1f} lemmas "
+        f"per hour)"
+    )
+    return records, eval_time_dict
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+
+    from agent import EvalAgentOutput
+    from evaluate import pretty_print_eval_summary
+    from search import IsaBestFirstSearch
+
+    class SimpleAgent(EvalAgent):
+        def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+            return [
+                EvalAgentOutput("by auto", random.random()) for _ in range(gen_length)
+            ]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("isa_path", type=Path)
+    parser.add_argument("theories_path", type=Path)
+    parser.add_argument("--session-roots", type=Path, default=None)
+    parser.add_argument("--port", type=int, default=8980)
+    parser.add_argument("--budget", type=float, default=3600.0)
+    parser.add_argument("--budget-kind", choices=BUDGET_KINDS, default="wall")
+    parser.add_argument("--first-pass-scale", type=float, default=0.1)
+    parser.add_argument("--growth", type=float, default=2.0)
+    parser.add_argument("--priority", choices=list(PRIORITIES), default="most_progress")
+    args = parser.parse_args()
+
+    eval_records, times_dict = evaluate_with_budget(
+        args.isa_path.expanduser(),
+        args.theories_path,
+        SimpleAgent(),
+        IsaBestFirstSearch(step_timeout=10),
+        args.budget,
+        args.budget_kind,
+        args.first_pass_scale,
+        args.growth,
+        priority=args.priority,
+        session_roots=args.session_roots,
+        port=args.port,
+    )
+    pretty_print_eval_summary(eval_records, times_dict)
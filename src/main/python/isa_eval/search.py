@@ -1,25 +1,53 @@
-import heapq
 import logging
 import re
+import sys
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import List, Optional, Set, Tuple
 
 from agent import EvalAgent, EvalAgentOutput
-from client import EvalClient, ITPState, IsaState
+from client import CancellationToken, EvalClient, ITPState, IsaState, is_sledgehammer
+from frontier import Frontier, make_frontier
+from metrics import METRICS
+from search_trace import SearchTrace
+from states import StateTracker
+from timeouts import AdaptiveTimeoutPolicy
 from utils import prepare_logger
 
 
-@dataclass
 class SNode:
-    score: float
-    proof_steps: List[str]
-    state: ITPState
+    # nodes share the proof path of their parent, which is only materialized
+    # once a proof is found, and drop their state once they are expanded
+    __slots__ = ("score", "state", "parent", "command", "depth")
+
+    def __init__(
+        self,
+        score: float,
+        state: Optional[ITPState],
+        parent: Optional["SNode"] = None,
+        command: Optional[str] = None,
+    ) -> None:
+        self.score = score
+        self.state = state
+        self.parent = parent
+        self.command = command
+        self.depth = parent.depth + 1 if parent is not None else 0
 
     @property
     def state_id(self):
         return self.state.state_id
 
+    @property
+    def proof_steps(self) -> List[str]:
+        proof_steps = []
+        node = self
+        while node.parent is not None:
+            proof_steps.append(node.command)
+            node = node.parent
+        proof_steps.reverse()
+        return proof_steps
+
     def __lt__(self, other):
         return self.score < other.score
 
@@ -28,21 +56,38 @@ class SNode:
 class SearchSummary:
     succeeded_num: int = 0
     generated_num: int = 0
+    cancelled_num: int = 0
     query_count: int = 0
     timeout_count: int = 0
+    early_timeout_count: int = 0
     itp_running_time: float = 0.0
     agent_query_time: float = 0.0
+    agent_query_time_saved: float = 0.0
     total_time: float = 0.0
+    overlap_time: float = 0.0
+    agent_idle_time: float = 0.0
+    itp_idle_time: float = 0.0
+    peak_live_states: int = 0
     failure_reason: Optional[str] = None
 
     def __str__(self):
         text = ""
         text += f"total time {self.total_time:.2f} seconds "
-        text += (
-            f"(itp {self.itp_running_time:.2f}, agent {self.agent_query_time:.2f}); "
-        )
-        text += f"query {self.query_count}, timeout {self.timeout_count}; "
+        text += f"(itp {self.itp_running_time:.2f}, agent {self.agent_query_time:.2f}"
+        if self.overlap_time > 0:
+            text += f", overlap {self.overlap_time:.2f}"
+        text += "); "
+        if self.agent_query_time_saved > 0:
+            text += f"agent time saved by cache {self.agent_query_time_saved:.2f}; "
+        text += f"idle itp {self.itp_idle_time:.2f}, agent {self.agent_idle_time:.2f}; "
+        text += f"query {self.query_count}, timeout {self.timeout_count}"
+        if self.early_timeout_count > 0:
+            text += f" (and {self.early_timeout_count} early)"
+        text += "; "
+        text += f"peak live states {self.peak_live_states}; "
         text += f"commands {self.succeeded_num} / {self.generated_num}"
+        if self.cancelled_num > 0:
+            text += f" ({self.cancelled_num} cancelled)"
         if self.failure_reason:
             text += f"; failed due to {self.failure_reason}"
         return text
@@ -57,6 +102,12 @@ class BestFirstSearch:
         step_timeout: float = 10.0,
         total_timeout: float = 600.0,
         step_timeout_limit: int = 60,
+        batch_size: int = 1,
+        pipelined: bool = False,
+        frontier_policy: str = "best_first",
+        depth_cap: Optional[int] = None,
+        trace: Optional[SearchTrace] = None,
+        timeout_policy: Optional[AdaptiveTimeoutPolicy] = None,
         logger: Optional[logging.Logger] = None,
     ):
         self.gen_length = gen_length
@@ -65,6 +116,13 @@ class BestFirstSearch:
         self.step_timeout = step_timeout
         self.total_timeout = total_timeout
         self.step_timeout_limit = step_timeout_limit
+        self.batch_size = batch_size
+        self.pipelined = pipelined
+        self.frontier_policy = frontier_policy
+        self.depth_cap = depth_cap
+        self.trace = trace
+        # chooses the timeout of each command instead of `step_timeout`
+        self.timeout_policy = timeout_policy
         if logger is None:
             logger = prepare_logger(self.__class__.__name__)
 
@@ -77,6 +135,10 @@ class BestFirstSearch:
             "step_timeout",
             "total_timeout",
             "step_timeout_limit",
+            "batch_size",
+            "pipelined",
+            "frontier_policy",
+            "depth_cap",
         ]:
             self.logger.info(f"{attribute}: {getattr(self, attribute)}")
 
@@ -103,74 +165,277 @@ class BestFirstSearch:
     def get_command(output: EvalAgentOutput, state: Optional[ITPState] = None):
         return output.command
 
-    def solve(
+    def _drop_node(
+        self, node: SNode, tracker: StateTracker, trace_id: Optional[str] = None
+    ) -> None:
+        self.logger.info(f"[DROPPING] {node.state_id}")
+        if trace_id is not None:
+            self.trace.drop(trace_id, node.state_id)
+        tracker.release(node.state_id)
+
+    def _select_nodes(
+        self,
+        frontier: Frontier,
+        all_input_strings: Optional[Set[str]],
+        limit: int,
+        summary: SearchSummary,
+        tracker: StateTracker,
+    ) -> List[Tuple[SNode, str, int]]:
+        selected = []
+        while len(frontier) > 0 and len(selected) < limit:
+            node: SNode = frontier.pop()
+            input_string = self.make_input(node.state)
+            if all_input_strings is not None:
+                if input_string in all_input_strings:
+                    tracker.release(node.state_id)
+                    continue
+                all_input_strings.add(input_string)
+            summary.query_count += 1
+            if self.logger.isEnabledFor(logging.INFO):
+                self.logger.info(f"[QUERY-{summary.query_count}] {input_string}")
+            selected.append((node, input_string, summary.query_count))
+        return selected
+
+    def _query_agent(
+        self, agent: EvalAgent, input_strings: List[str], summary: SearchSummary
+    ) -> List[List[EvalAgentOutput]]:
+        time_before_query = time.time()
+        saved_before_query = agent.query_time_saved
+        if self.batch_size > 1:
+            outputs_lst = agent.query_batch(input_strings, self.gen_length)
+        else:
+            outputs_lst = [agent.query(input_strings[0], self.gen_length)]
+        query_time = time.time() - time_before_query
+        summary.agent_query_time += query_time
+        METRICS.observe(
+            "isa_eval_agent_query_seconds",
+            query_time,
+            method="query_batch" if self.batch_size > 1 else "query",
+        )
+        summary.agent_query_time_saved += agent.query_time_saved - saved_before_query
+        return outputs_lst
+
+    def _order_outputs(
+        self,
+        selected: List[Tuple[SNode, str, int]],
+        outputs_lst: List[List[EvalAgentOutput]],
+    ) -> List[List[EvalAgentOutput]]:
+        ordered_outputs_lst = []
+        for (_, _, query_index), outputs in zip(selected, outputs_lst):
+            filtered_outputs = self.filter_agent_outputs(outputs)
+            ordered_outputs = sorted(
+                filtered_outputs, key=lambda x: x.logit, reverse=True
+            )
+            self.logger.info(
+                f"[OUTPUTS-{query_index}] {len(ordered_outputs)} / {len(outputs)} unique commands"
+            )
+            ordered_outputs_lst.append(ordered_outputs)
+        return ordered_outputs_lst
+
+    def _collect_outcomes(
         self,
-        state: ITPState,
-        agent: EvalAgent,
         client: EvalClient,
-        ignore_duplicate_inputs: bool = False,
-    ) -> Tuple[bool, List[str], SearchSummary]:
-        proved = False
-        query_count = 0
-        timeout_count = 0
-        all_input_strings = set()
-        pqueue = [SNode(0.0, [], state)]
-        itp_running_time = 0.0
-        agent_query_time = 0.0
-        final_proof_steps = []
-        total_time = 0.0
-        generated_num = 0
-        succeeded_num = 0
-        time_before_solving = time.time()
-        self.logger.info(f"Start solving in state {state.state_id}")
-        self.logger.info(f"State:\n{state.result}\n{state.state}")
-
-        while (
-            len(pqueue) > 0
-            and query_count < self.query_limit
-            and timeout_count < self.step_timeout_limit
+        node: SNode,
+        ordered_outputs: List[EvalAgentOutput],
+        token: CancellationToken,
+    ) -> List[Tuple[EvalAgentOutput, ITPState]]:
+        outcomes = []
+        for idx, itp_state in client.iter_execute_many(
+            node.state_id,
+            [output.command.strip() for output in ordered_outputs],
+            int(self.step_timeout),
+            token,
+        ):
+            outcomes.append((ordered_outputs[idx], itp_state))
+            if itp_state.result == "SUCCESS" and itp_state.proof_is_finished():
+                # the proof is found, abort the remaining commands of the batch
+                token.cancel()
+                break
+        return outcomes
+
+    def _collect_batch_outcomes(
+        self,
+        client: EvalClient,
+        nodes: List[SNode],
+        ordered_outputs_lst: List[List[EvalAgentOutput]],
+        token: CancellationToken,
+    ) -> List[List[Tuple[EvalAgentOutput, ITPState]]]:
+        requests = []
+        owners = []
+        for node_idx, (node, ordered_outputs) in enumerate(
+            zip(nodes, ordered_outputs_lst)
         ):
-            total_time = time.time() - time_before_solving
+            for output in ordered_outputs:
+                requests.append((node.state_id, output.command.strip()))
+                owners.append((node_idx, output))
 
-            if proved or total_time > self.total_timeout:
+        outcomes_lst = [[] for _ in nodes]
+        for idx, itp_state in client.iter_execute_batch(
+            requests, int(self.step_timeout), token
+        ):
+            node_idx, output = owners[idx]
+            outcomes_lst[node_idx].append((output, itp_state))
+            if itp_state.result == "SUCCESS" and itp_state.proof_is_finished():
+                token.cancel()
                 break
+        return outcomes_lst
 
-            current_node: SNode = heapq.heappop(pqueue)
+    def _collect_adaptive_outcomes(
+        self,
+        client: EvalClient,
+        nodes: List[SNode],
+        ordered_outputs_lst: List[List[EvalAgentOutput]],
+        token: CancellationToken,
+        early_timeouts: Set[str],
+    ) -> List[List[Tuple[EvalAgentOutput, ITPState]]]:
+        # like _collect_batch_outcomes, with the timeout of each command chosen
+        # by the timeout policy; the ids of timeouts under a reduced budget are
+        # added to `early_timeouts`
+        policy = self.timeout_policy
+        session = getattr(client.setup, "session", None)
+        max_timeout = int(self.step_timeout)
+        requests = []
+        owners = []
+        timeouts = []
+        for node_idx, (node, ordered_outputs) in enumerate(
+            zip(nodes, ordered_outputs_lst)
+        ):
+            for output in ordered_outputs:
+                command = output.command.strip()
+                requests.append((node.state_id, command))
+                owners.append((node_idx, output))
+                # sledgehammer has its own budget
+                timeouts.append(
+                    max_timeout
+                    if is_sledgehammer(command)
+                    else policy.timeout_for(command, session, max_timeout)
+                )
 
-            input_string = self.make_input(current_node.state)
-            if ignore_duplicate_inputs and input_string in all_input_strings:
+        outcomes_lst = [[] for _ in nodes]
+        retry_candidates: List[Tuple[int, ITPState]] = []
+        for idx, itp_state in client.iter_execute_batch(
+            requests, max_timeout, token, timeouts
+        ):
+            command = requests[idx][1]
+            # the time the server ran the command for, the time to the outcome
+            # also counts the commands queued before it; outcomes without it,
+            # e.g. cached ones, tell nothing about the latency
+            if not is_sledgehammer(command) and itp_state.elapsed is not None:
+                policy.observe(
+                    command,
+                    session,
+                    itp_state.result,
+                    itp_state.elapsed,
+                    timeouts[idx],
+                    max_timeout,
+                )
+            if itp_state.result == "TIMEOUT" and policy.should_retry(
+                command, session, timeouts[idx], max_timeout
+            ):
+                retry_candidates.append((idx, itp_state))
                 continue
+            node_idx, output = owners[idx]
+            outcomes_lst[node_idx].append((output, itp_state))
+            if itp_state.result == "TIMEOUT" and timeouts[idx] < max_timeout:
+                early_timeouts.add(itp_state.state_id)
+            if itp_state.result == "SUCCESS" and itp_state.proof_is_finished():
+                token.cancel()
+                break
 
-            all_input_strings.add(input_string)
-            query_count += 1
-            self.logger.info(f"[QUERY-{query_count}] {input_string}")
-
-            time_before_query = time.time()
-            outputs = agent.query(input_string, self.gen_length)
-            agent_query_time += time.time() - time_before_query
+        # promising commands that timed out early get the full step timeout,
+        # the most likely ones first
+        retry_candidates.sort(key=lambda c: owners[c[0]][1].logit, reverse=True)
+        retried = [] if token.cancelled else retry_candidates[: policy.max_retries]
+        for idx, itp_state in retry_candidates[len(retried) :]:
+            node_idx, output = owners[idx]
+            outcomes_lst[node_idx].append((output, itp_state))
+            early_timeouts.add(itp_state.state_id)
+        if len(retried) == 0:
+            return outcomes_lst
+
+        client.remove_states([itp_state.state_id for _, itp_state in retried])
+        retry_indices = [idx for idx, _ in retried]
+        for retry_idx, itp_state in client.iter_execute_batch(
+            [requests[idx] for idx in retry_indices], max_timeout, token
+        ):
+            idx = retry_indices[retry_idx]
+            command = requests[idx][1]
+            if itp_state.elapsed is not None:
+                policy.observe(
+                    command,
+                    session,
+                    itp_state.result,
+                    itp_state.elapsed,
+                    max_timeout,
+                    max_timeout,
+                )
+            policy.observe_retry(command, session, timeouts[idx], itp_state.result)
+            node_idx, output = owners[idx]
+            outcomes_lst[node_idx].append((output, itp_state))
+            if itp_state.result == "SUCCESS" and itp_state.proof_is_finished():
+                token.cancel()
+                break
+        return outcomes_lst
 
-            # execute the commands in ITP
-            time_before_running = time.time()
-            filtered_outputs = self.filter_agent_outputs(outputs)
-            ordered_outputs = sorted(
-                filtered_outputs, key=lambda x: x.logit, reverse=True
-            )
-            self.logger.info(
-                f"[OUTPUTS-{query_count}] {len(ordered_outputs)} / {len(outputs)} unique commands"
+    def _execute_nodes(
+        self,
+        client: EvalClient,
+        nodes: List[SNode],
+        ordered_outputs_lst: List[List[EvalAgentOutput]],
+        early_timeouts: Optional[Set[str]] = None,
+    ) -> Tuple[List[List[Tuple[EvalAgentOutput, ITPState]]], float, float]:
+        time_before_running = time.time()
+        token = CancellationToken()
+        if self.timeout_policy is not None:
+            outcomes_lst = self._collect_adaptive_outcomes(
+                client,
+                nodes,
+                ordered_outputs_lst,
+                token,
+                early_timeouts if early_timeouts is not None else set(),
             )
-
-            itp_states = client.execute_many(
-                current_node.state_id,
-                [output.command.strip() for output in ordered_outputs],
-                int(self.step_timeout),
+        elif len(nodes) == 1:
+            outcomes_lst = [
+                self._collect_outcomes(client, nodes[0], ordered_outputs_lst[0], token)
+            ]
+        else:
+            # the commands of all nodes are sent in one server-side parallel batch
+            outcomes_lst = self._collect_batch_outcomes(
+                client, nodes, ordered_outputs_lst, token
             )
-            itp_running_time += time.time() - time_before_running
+        time_after_running = time.time()
+        METRICS.observe(
+            "isa_eval_search_phase_seconds",
+            time_after_running - time_before_running,
+            phase="execute",
+        )
+        return outcomes_lst, time_before_running, time_after_running
 
-            # add new nodes to the queue
-            for itp_state, output in zip(itp_states, ordered_outputs):
-                command = self.get_command(output, itp_state)
-                proof_steps = current_node.proof_steps + [command]
-                generated_num += 1
+    def _expand_node(
+        self,
+        node: SNode,
+        ordered_outputs: List[EvalAgentOutput],
+        outcomes: List[Tuple[EvalAgentOutput, ITPState]],
+        frontier: Frontier,
+        summary: SearchSummary,
+        client: EvalClient,
+        tracker: StateTracker,
+        root_state: Optional[ITPState],
+        trace_id: Optional[str] = None,
+        early_timeouts: Optional[Set[str]] = None,
+    ) -> Optional[List[str]]:
+        # commands aborted after a proof was found have no outcome
+        summary.cancelled_num += len(ordered_outputs) - len(outcomes)
+        log_outcomes = self.logger.isEnabledFor(logging.INFO)
+        for idx, (output, itp_state) in enumerate(outcomes):
+            command = self.get_command(output, itp_state)
+            summary.generated_num += 1
+            if trace_id is not None:
+                self.trace.outcome(
+                    trace_id, node.state_id, command, output.logit, itp_state
+                )
+            # goal states can be large, only format them if they are logged
+            if log_outcomes:
                 self.logger.info(
                     f"[{itp_state.result}-CMD] {output.logit:.6f} {command}"
                 )
@@ -178,72 +443,297 @@ class BestFirstSearch:
                     f"[{itp_state.result}-INFO] {itp_state.logging_info()}"
                 )
 
-                if itp_state.result == "SUCCESS":
-                    succeeded_num += 1
-                    if itp_state.proof_is_finished():
-                        proved = True
-                        final_proof_steps = proof_steps
+            if itp_state.result == "SUCCESS":
+                summary.succeeded_num += 1
+                if itp_state.proof_is_finished():
+                    # without a root state, other searches may share the ITP
+                    if root_state is None:
+                        for _, other_state in outcomes[idx:]:
+                            tracker.release(other_state.state_id)
+                    else:
                         client.clear_and_rename_state(
-                            itp_state.state_id, state.state_id
+                            itp_state.state_id, root_state.state_id
                         )
-                        break
-                else:
-                    if itp_state.result == "TIMEOUT":
-                        timeout_count += 1
-                    client.remove_state(itp_state.state_id)
-                    continue
+                    return node.proof_steps + [command]
+            else:
+                if itp_state.result == "TIMEOUT":
+                    # timeouts under a budget reduced by the timeout policy do
+                    # not count toward the step timeout limit
+                    if (
+                        early_timeouts is not None
+                        and itp_state.state_id in early_timeouts
+                    ):
+                        early_timeouts.discard(itp_state.state_id)
+                        summary.early_timeout_count += 1
+                    else:
+                        summary.timeout_count += 1
+                tracker.release(itp_state.state_id)
+                continue
 
-                heapq.heappush(
-                    pqueue,
-                    SNode(
-                        current_node.score - output.logit,
-                        proof_steps,
-                        itp_state,
-                    ),
+            # siblings often end up with the same goals, which are only kept once
+            itp_state.state = sys.intern(itp_state.state)
+            # the frontier evicts the worst node once it exceeds its capacity
+            tracker.track(itp_state.state_id)
+            frontier.push(SNode(node.score - output.logit, itp_state, node, command))
+
+        # the children do not depend on the state of their parent
+        tracker.release(node.state_id)
+        node.state = None
+        return None
+
+    def _expand_nodes(
+        self,
+        nodes: List[SNode],
+        ordered_outputs_lst: List[List[EvalAgentOutput]],
+        outcomes_lst: List[List[Tuple[EvalAgentOutput, ITPState]]],
+        frontier: Frontier,
+        summary: SearchSummary,
+        client: EvalClient,
+        tracker: StateTracker,
+        root_state: Optional[ITPState],
+        trace_id: Optional[str] = None,
+        early_timeouts: Optional[Set[str]] = None,
+    ) -> Optional[List[str]]:
+        with METRICS.timer("isa_eval_search_phase_seconds", phase="expand"):
+            for idx, (node, ordered_outputs, outcomes) in enumerate(
+                zip(nodes, ordered_outputs_lst, outcomes_lst)
+            ):
+                proof_steps = self._expand_node(
+                    node,
+                    ordered_outputs,
+                    outcomes,
+                    frontier,
+                    summary,
+                    client,
+                    tracker,
+                    root_state,
+                    trace_id,
+                    early_timeouts,
+                )
+                if proof_steps is not None:
+                    if root_state is None:
+                        for other_outcomes in outcomes_lst[idx + 1 :]:
+                            for _, itp_state in other_outcomes:
+                                tracker.release(itp_state.state_id)
+                    return proof_steps
+            return None
+
+    def solve(
+        self,
+        state: ITPState,
+        agent: EvalAgent,
+        client: EvalClient,
+        ignore_duplicate_inputs: bool = False,
+        isolated: bool = False,
+        name: Optional[str] = None,
+    ) -> Tuple[bool, List[str], SearchSummary]:
+        # an isolated search only removes the states it created, instead of
+        # clearing every state but `state`, so that several searches can run
+        # concurrently on the same ITP; `state` itself is kept
+        summary = SearchSummary()
+        all_input_strings = set() if ignore_duplicate_inputs else None
+        # dead states are removed in batches off the critical path
+        tracker = StateTracker(client, protected={state.state_id})
+        trace_id = self.trace.begin(state, name) if self.trace is not None else None
+        try:
+            frontier = make_frontier(
+                self.frontier_policy,
+                self.queue_length,
+                self.depth_cap,
+                on_evict=lambda node: self._drop_node(node, tracker, trace_id),
+            )
+            frontier.push(SNode(0.0, state))
+            early_timeouts: Set[str] = set()
+            final_proof_steps: Optional[List[str]] = None
+            total_time = 0.0
+            time_before_solving = time.time()
+            self.logger.info(f"Start solving in state {state.state_id}")
+            self.logger.info(f"State:\n{state.result}\n{state.state}")
+
+            # in pipelined mode, the ITP executes the previous batch in the background
+            # while the agent is queried for the next one
+            pipeline_executor = ThreadPoolExecutor(1) if self.pipelined else None
+            in_flight: Optional[
+                Tuple[List[SNode], List[List[EvalAgentOutput]], Future]
+            ] = None
+
+            def finish_in_flight(
+                query_interval: Optional[Tuple[float, float]] = None
+            ) -> Optional[List[str]]:
+                nodes, ordered_outputs_lst, future = in_flight
+                outcomes_lst, time_before_running, time_after_running = future.result()
+                summary.itp_running_time += time_after_running - time_before_running
+                if query_interval is not None:
+                    summary.overlap_time += max(
+                        0.0,
+                        min(query_interval[1], time_after_running)
+                        - max(query_interval[0], time_before_running),
+                    )
+                return self._expand_nodes(
+                    nodes,
+                    ordered_outputs_lst,
+                    outcomes_lst,
+                    frontier,
+                    summary,
+                    client,
+                    tracker,
+                    None if isolated else state,
+                    trace_id,
+                    early_timeouts,
                 )
 
-                if len(pqueue) > self.queue_length:
-                    max_score_idx = max(
-                        range(len(pqueue)), key=lambda i: pqueue[i].score
+            try:
+                while (
+                    (len(frontier) > 0 or in_flight is not None)
+                    and summary.query_count < self.query_limit
+                    and summary.timeout_count < self.step_timeout_limit
+                ):
+                    total_time = time.time() - time_before_solving
+
+                    if final_proof_steps is not None or total_time > self.total_timeout:
+                        break
+
+                    # pop at most batch_size nodes without exceeding the query limit
+                    selected = self._select_nodes(
+                        frontier,
+                        all_input_strings,
+                        min(self.batch_size, self.query_limit - summary.query_count),
+                        summary,
+                        tracker,
                     )
-                    self.logger.info(
-                        f"[DROPPING] {pqueue[max_score_idx].state.state_id}"
+                    nodes = [node for node, _, _ in selected]
+                    if trace_id is not None:
+                        for node, _, query_index in selected:
+                            self.trace.query(trace_id, node.state_id, query_index)
+
+                    query_interval = None
+                    if len(selected) > 0:
+                        time_before_query = time.time()
+                        outputs_lst = self._query_agent(
+                            agent,
+                            [input_string for _, input_string, _ in selected],
+                            summary,
+                        )
+                        query_interval = (time_before_query, time.time())
+                        ordered_outputs_lst = self._order_outputs(selected, outputs_lst)
+
+                    # add new nodes of the previous batch to the queue
+                    if in_flight is not None:
+                        final_proof_steps = finish_in_flight(query_interval)
+                        in_flight = None
+                        if final_proof_steps is not None:
+                            break
+
+                    if len(selected) == 0:
+                        continue
+
+                    # execute the commands in ITP
+                    if pipeline_executor is not None:
+                        in_flight = (
+                            nodes,
+                            ordered_outputs_lst,
+                            pipeline_executor.submit(
+                                self._execute_nodes,
+                                client,
+                                nodes,
+                                ordered_outputs_lst,
+                                early_timeouts,
+                            ),
+                        )
+                        continue
+
+                    outcomes_lst, time_before_running, time_after_running = (
+                        self._execute_nodes(
+                            client, nodes, ordered_outputs_lst, early_timeouts
+                        )
+                    )
+                    summary.itp_running_time += time_after_running - time_before_running
+
+                    # add new nodes to the queue
+                    final_proof_steps = self._expand_nodes(
+                        nodes,
+                        ordered_outputs_lst,
+                        outcomes_lst,
+                        frontier,
+                        summary,
+                        client,
+                        tracker,
+                        None if isolated else state,
+                        trace_id,
+                        early_timeouts,
                     )
-                    del pqueue[max_score_idx]
-                    heapq.heapify(pqueue)
-                    assert len(pqueue) == self.queue_length
-
-        search_summary = SearchSummary(
-            succeeded_num=succeeded_num,
-            generated_num=generated_num,
-            query_count=query_count,
-            timeout_count=timeout_count,
-            itp_running_time=itp_running_time,
-            agent_query_time=agent_query_time,
-            total_time=time.time() - time_before_solving,
-        )
 
-        if proved:
-            separator = "\n\t"
-            self.logger.info(f"[PROVED] {search_summary}")
-            self.logger.info(f"[PROOF]{separator + separator.join(final_proof_steps)}")
-            return True, final_proof_steps, search_summary
-
-        if not pqueue:
-            search_summary.failure_reason = "empty queue"
-        elif query_count >= self.query_limit:
-            search_summary.failure_reason = "query limit reached"
-        elif timeout_count >= self.step_timeout_limit:
-            search_summary.failure_reason = "step timeout limit reached"
-        elif total_time > self.total_timeout:
-            search_summary.failure_reason = "timeout"
-        else:
-            search_summary.failure_reason = "unknown reason"
-        client.clear_and_rename_state(state.state_id, state.state_id)
+                # the last batch may still be running when a limit is reached
+                if in_flight is not None:
+                    if final_proof_steps is None:
+                        final_proof_steps = finish_in_flight()
+                    else:
+                        outcomes_lst, _, _ = in_flight[2].result()
+                        if isolated:
+                            for outcomes in outcomes_lst:
+                                for _, itp_state in outcomes:
+                                    tracker.release(itp_state.state_id)
+                    in_flight = None
+            finally:
+                if pipeline_executor is not None:
+                    pipeline_executor.shutdown()
+
+            summary.total_time = time.time() - time_before_solving
+            summary.agent_idle_time = max(
+                0.0, summary.total_time - summary.agent_query_time
+            )
+            summary.itp_idle_time = max(
+                0.0, summary.total_time - summary.itp_running_time
+            )
+            METRICS.observe(
+                "isa_eval_search_seconds",
+                summary.total_time,
+                result="proved" if final_proof_steps is not None else "failed",
+            )
 
-        self.logger.info(f"[FAILED] {search_summary}")
+            if isolated:
+                tracker.release_all()
+            tracker.close()
+            summary.peak_live_states = tracker.peak_live
 
-        return False, [], search_summary
+            if final_proof_steps is not None:
+                separator = "\n\t"
+                self.logger.info(f"[PROVED] {summary}")
+                self.logger.info(
+                    f"[PROOF]{separator + separator.join(final_proof_steps)}"
+                )
+                if trace_id is not None:
+                    self.trace.end(trace_id, True, final_proof_steps, summary)
+                return True, final_proof_steps, summary
+
+            if not frontier:
+                summary.failure_reason = "empty queue"
+            elif summary.query_count >= self.query_limit:
+                summary.failure_reason = "query limit reached"
+            elif summary.timeout_count >= self.step_timeout_limit:
+                summary.failure_reason = "step timeout limit reached"
+            elif total_time > self.total_timeout:
+                summary.failure_reason = "timeout"
+            else:
+                summary.failure_reason = "unknown reason"
+            if not isolated:
+                client.clear_and_rename_state(state.state_id, state.state_id)
+
+            self.logger.info(f"[FAILED] {summary}")
+            if trace_id is not None:
+                self.trace.end(trace_id, False, [], summary)
+
+            return False, [], summary
+        except BaseException:
+            # e.g. an RPC error, after which the evaluation may go on
+            if trace_id is not None:
+                summary.failure_reason = "error"
+                self.trace.end(trace_id, False, [], summary)
+            raise
+        finally:
+            # the tracker thread would keep running otherwise, closing it again
+            # after a normal return does nothing
+            tracker.close()
 
 
 class IsaBestFirstSearch(BestFirstSearch):
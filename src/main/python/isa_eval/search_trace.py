@@ -0,0 +1,315 @@
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field, is_dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Union
+
+# the offline tool does not need grpc
+if TYPE_CHECKING:
+    from client import ITPState
+
+
+class SearchTrace:
+    # records search events as JSON lines; the search only enqueues tuples of
+    # the objects at hand, and a background thread serializes and writes them
+    # in batches, so goal states are never formatted on the hot path
+    def __init__(
+        self,
+        path: Union[os.PathLike, str],
+        sample_rate: float = 1.0,
+        record_goals: bool = True,
+        flush_interval: float = 1.0,
+    ):
+        # `sample_rate` is the fraction of searches that are traced, and goal
+        # states and error messages are only written with `record_goals`
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.record_goals = record_goals
+        self.flush_interval = flush_interval
+        self._owner_pid = os.getpid()
+        self._init_writer()
+
+    def _init_writer(self) -> None:
+        self._pid = os.getpid()
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+
+    def __getstate__(self):
+        # the solver is pickled into evaluation workers, each of which writes
+        # its own trace file
+        state = self.__dict__.copy()
+        for name in ["_queue", "_lock", "_worker"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_writer()
+
+    @property
+    def output_path(self) -> Path:
+        if self._pid == self._owner_pid:
+            return self.path
+        return self.path.with_name(f"{self.path.stem}-{self._pid}{self.path.suffix}")
+
+    def _put(self, event: tuple) -> None:
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, daemon=True)
+                    self._worker.start()
+        self._queue.put(event)
+
+    def begin(self, state: "ITPState", name: Optional[str] = None) -> Optional[str]:
+        # returns the id of the traced search, or None if it is not sampled
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        search_id = uuid.uuid4().hex[:12]
+        self._put(("begin", search_id, time.time(), name, state))
+        return search_id
+
+    def query(self, search_id: str, node_id: str, query_index: int) -> None:
+        self._put(("query", search_id, time.time(), node_id, query_index))
+
+    def outcome(
+        self,
+        search_id: str,
+        parent_id: str,
+        command: str,
+        logit: float,
+        itp_state: "ITPState",
+    ) -> None:
+        self._put(
+            ("outcome", search_id, time.time(), parent_id, command, logit, itp_state)
+        )
+
+    def drop(self, search_id: str, node_id: str) -> None:
+        self._put(("drop", search_id, time.time(), node_id))
+
+    def end(
+        self, search_id: str, proved: bool, proof_steps: List[str], summary: Any
+    ) -> None:
+        self._put(("end", search_id, time.time(), proved, list(proof_steps), summary))
+
+    def _encode(self, event: tuple) -> dict:
+        kind, search_id, timestamp, *payload = event
+        entry = {"e": kind, "s": search_id, "t": round(timestamp, 4)}
+        if kind == "begin":
+            name, state = payload
+            entry.update(name=name, node=state.state_id)
+            if self.record_goals:
+                entry["goal"] = state.state
+        elif kind == "query":
+            entry.update(node=payload[0], q=payload[1])
+        elif kind == "outcome":
+            parent_id, command, logit, itp_state = payload
+            entry.update(
+                parent=parent_id,
+                node=itp_state.state_id,
+                cmd=command,
+                logit=logit,
+                result=itp_state.result,
+                level=itp_state.proof_level,
+            )
+            if self.record_goals:
+                if itp_state.result == "SUCCESS":
+                    entry["goal"] = itp_state.state
+                else:
+                    entry["msg"] = itp_state.message
+        elif kind == "drop":
+            entry["node"] = payload[0]
+        elif kind == "end":
+            proved, proof_steps, summary = payload
+            entry.update(
+                proved=proved,
+                proof=proof_steps,
+                summary=asdict(summary) if is_dataclass(summary) else summary,
+            )
+        return entry
+
+    def _run(self) -> None:
+        with open(self.output_path, "a", encoding="utf-8") as trace_file:
+            while True:
+                try:
+                    events = [self._queue.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    continue
+                # drain whatever else is queued to write it in one go
+                while True:
+                    try:
+                        events.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                closing = events[-1] is None
+                lines = [json.dumps(self._encode(e)) for e in events if e is not None]
+                if len(lines) > 0:
+                    trace_file.write("\n".join(lines) + "\n")
+                    trace_file.flush()
+                if closing:
+                    return
+
+    def close(self) -> None:
+        # waits until every recorded event is written
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
+
+
+@dataclass
+class TraceNode:
+    node_id: str
+    parent_id: Optional[str] = None
+    command: Optional[str] = None
+    logit: float = 0.0
+    result: str = "SUCCESS"
+    level: Optional[int] = None
+    text: Optional[str] = None
+    timestamp: float = 0.0
+    dropped: bool = False
+    children: List["TraceNode"] = field(default_factory=list)
+
+
+@dataclass
+class TracedSearch:
+    search_id: str
+    name: Optional[str]
+    root: TraceNode
+    start_time: float
+    events: List[dict] = field(default_factory=list)
+    proved: Optional[bool] = None
+    proof_steps: List[str] = field(default_factory=list)
+    summary: Optional[dict] = None
+
+
+def load_trace(paths: Iterable[Union[os.PathLike, str]]) -> Dict[str, TracedSearch]:
+    # rebuilds the search trees of the searches recorded in the trace files
+    searches: Dict[str, TracedSearch] = {}
+    nodes: Dict[str, Dict[str, TraceNode]] = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as trace_file:
+            for line in trace_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                search_id = entry["s"]
+                if entry["e"] == "begin":
+                    root = TraceNode(
+                        entry["node"], text=entry.get("goal"), timestamp=entry["t"]
+                    )
+                    searches[search_id] = TracedSearch(
+                        search_id, entry["name"], root, entry["t"]
+                    )
+                    nodes[search_id] = {root.node_id: root}
+                if search_id not in searches:
+                    continue
+                search = searches[search_id]
+                search.events.append(entry)
+                if entry["e"] == "outcome":
+                    node = TraceNode(
+                        entry["node"],
+                        entry["parent"],
+                        entry["cmd"],
+                        entry["logit"],
+                        entry["result"],
+                        entry["level"],
+                        entry.get("goal", entry.get("msg")),
+                        entry["t"],
+                    )
+                    parent = nodes[search_id].get(entry["parent"])
+                    if parent is not None:
+                        parent.children.append(node)
+                    nodes[search_id][node.node_id] = node
+                elif entry["e"] == "drop" and entry["node"] in nodes[search_id]:
+                    nodes[search_id][entry["node"]].dropped = True
+                elif entry["e"] == "end":
+                    search.proved = entry["proved"]
+                    search.proof_steps = entry["proof"]
+                    search.summary = entry["summary"]
+    return searches
+
+
+def format_search_log(search: TracedSearch) -> str:
+    # the log lines the search would have written at INFO level
+    lines = [f"Start solving in state {search.root.node_id} ({search.name})"]
+    if search.root.text is not None:
+        lines.append(f"State:\n{search.root.text}")
+    for entry in search.events:
+        elapsed = entry["t"] - search.start_time
+        if entry["e"] == "query":
+            lines.append(f"[{elapsed:8.3f}] [QUERY-{entry['q']}] {entry['node']}")
+        elif entry["e"] == "outcome":
+            lines.append(
+                f"[{elapsed:8.3f}] [{entry['result']}-CMD] "
+                f"{entry['logit']:.6f} {entry['cmd']}"
+            )
+            text = entry.get("goal", entry.get("msg"))
+            if text is not None:
+                lines.append(
+                    f"[{elapsed:8.3f}] [{entry['result']}-INFO] "
+                    + text.replace("\n", " ")
+                )
+        elif entry["e"] == "drop":
+            lines.append(f"[{elapsed:8.3f}] [DROPPING] {entry['node']}")
+    if search.proved:
+        lines.append("[PROOF]\n\t" + "\n\t".join(search.proof_steps))
+    elif search.proved is not None:
+        reason = (search.summary or {}).get("failure_reason")
+        lines.append(f"[FAILED] {reason}")
+    return "\n".join(lines)
+
+
+def format_search_tree(search: TracedSearch, show_failed: bool = False) -> str:
+    lines = []
+
+    def visit(node: TraceNode, depth: int) -> None:
+        for child in sorted(node.children, key=lambda n: n.logit, reverse=True):
+            if child.result != "SUCCESS" and not show_failed:
+                continue
+            marker = " (dropped)" if child.dropped else ""
+            if child.result == "SUCCESS" and child.level == 0:
+                marker = " (proved)"
+            lines.append(
+                f"{'  ' * depth}{child.command} [{child.result}, "
+                f"{child.logit:.4f}]{marker}"
+            )
+            visit(child, depth + 1)
+
+    lines.append(f"{search.name or search.search_id}")
+    visit(search.root, 1)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Rebuild search trees and logs from search traces"
+    )
+    parser.add_argument("paths", nargs="+", type=Path)
+    parser.add_argument("--search", help="only show the search with this id or name")
+    parser.add_argument("--tree", action="store_true", help="print the search trees")
+    parser.add_argument(
+        "--show-failed", action="store_true", help="include failed commands in trees"
+    )
+    args = parser.parse_args()
+
+    for traced in load_trace(args.paths).values():
+        if args.search is not None and args.search not in (
+            traced.search_id,
+            traced.name,
+        ):
+            continue
+        print(f"===== {traced.search_id} =====")
+        if args.tree:
+            print(format_search_tree(traced, args.show_failed))
+        else:
+            print(format_search_log(traced))
@@ -0,0 +1,99 @@
+import threading
+from typing import List, Optional, Set
+
+from grpc._channel import _InactiveRpcError as InactiveRpcError
+from grpc._channel import _MultiThreadedRendezvous as MultiThreadedRendezvous
+
+from client import EvalClient
+
+
+class StateTracker:
+    # tracks the live state ids of a search and removes dead ones in batches
+    # from a background thread, so that releasing a state never waits for
+    # the server
+    def __init__(
+        self,
+        client: EvalClient,
+        protected: Optional[Set[str]] = None,
+        batch_size: int = 64,
+        flush_interval: float = 0.5,
+    ):
+        # protected states, e.g. the root of a search, are never removed
+        self.client = client
+        self.protected = protected if protected is not None else set()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.live: Set[str] = set()
+        self.peak_live = 0
+        self.released_num = 0
+        self._pending: List[str] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker: Optional[threading.Thread] = None
+
+    @property
+    def live_num(self) -> int:
+        return len(self.live)
+
+    def track(self, state_id: str) -> None:
+        with self._condition:
+            self.live.add(state_id)
+            self.peak_live = max(self.peak_live, len(self.live))
+
+    def release(self, state_id: str) -> None:
+        if state_id in self.protected:
+            return
+        with self._condition:
+            self.live.discard(state_id)
+            self._pending.append(state_id)
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name="state-tracker", daemon=True
+                )
+                self._worker.start()
+            if len(self._pending) >= self.batch_size:
+                self._condition.notify()
+
+    def release_all(self) -> None:
+        with self._condition:
+            live = list(self.live)
+        for state_id in live:
+            self.release(state_id)
+
+    def _take_pending(self) -> List[str]:
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _remove(self, pending: List[str]) -> None:
+        try:
+            self.client.remove_states(pending)
+        except (InactiveRpcError, MultiThreadedRendezvous):
+            # the states went away with the server, e.g. after a crash that
+            # the evaluation recovers from
+            return
+        self.released_num += len(pending)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                pending = self._take_pending()
+                closed = self._closed
+            if len(pending) > 0:
+                self._remove(pending)
+            if closed:
+                return
+
+    def close(self) -> None:
+        # waits until every released state is removed
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+            worker = self._worker
+        if worker is not None:
+            worker.join()
+        with self._condition:
+            pending = self._take_pending()
+        if len(pending) > 0:
+            self._remove(pending)
@@ -0,0 +1,188 @@
+import math
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+from metrics import Histogram
+
+# the proof method of e.g. "apply simp", "by (auto simp: foo)" or "using assms by blast"
+METHOD_PATTERN = re.compile(r"\b(?:by|apply|proof)\s*\(?\s*([\w.']+)")
+
+
+def tactic_family(command: str) -> str:
+    match = METHOD_PATTERN.search(command)
+    if match is not None:
+        return match.group(1)
+    words = command.split()
+    return words[0] if len(words) > 0 else ""
+
+
+@dataclass
+class TacticStats:
+    # latencies of the successful commands of a tactic family
+    latencies: Histogram = field(default_factory=Histogram)
+    executed: int = 0
+    succeeded: int = 0
+    timeouts: int = 0
+    # timeouts under a budget cut by the policy, and the ITP seconds saved
+    early_timeouts: int = 0
+    seconds_saved: float = 0.0
+    retries: int = 0
+    retry_successes: int = 0
+
+    @property
+    def success_rate(self) -> float:
+        return self.succeeded / max(self.executed, 1)
+
+
+class AdaptiveTimeoutPolicy:
+    # chooses the timeout of each command from the latencies of earlier
+    # successful commands of the same tactic family: `margin` times their
+    # `quantile`, within [`min_timeout`, step timeout]. Statistics are kept
+    # per session, and across sessions for sessions without `min_samples`
+    # successes of the family yet. Timeouts under a reduced budget are
+    # retried with the full step timeout, at most `max_retries` per batch, as
+    # long as the retries of their family succeed often enough.
+    def __init__(
+        self,
+        quantile: float = 0.99,
+        margin: float = 2.0,
+        min_timeout: int = 1,
+        min_samples: int = 20,
+        retry_min_success_rate: float = 0.2,
+        max_retries: int = 4,
+    ):
+        self.quantile = quantile
+        self.margin = margin
+        self.min_timeout = min_timeout
+        self.min_samples = min_samples
+        self.retry_min_success_rate = retry_min_success_rate
+        self.max_retries = max_retries
+        self.tactic_stats: Dict[Tuple[Optional[str], str], TacticStats] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the search is pickled into evaluation workers with its policy
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _stats_of(self, key: Tuple[Optional[str], str]) -> TacticStats:
+        stats = self.tactic_stats.get(key)
+        if stats is None:
+            stats = self.tactic_stats[key] = TacticStats()
+        return stats
+
+    def _keys(self, command: str, session: Optional[str]):
+        family = tactic_family(command)
+        if session is None:
+            return [(None, family)]
+        return [(session, family), (None, family)]
+
+    def _learned(self, command: str, session: Optional[str]) -> Optional[TacticStats]:
+        # the most specific statistics with enough samples
+        for key in self._keys(command, session):
+            stats = self.tactic_stats.get(key)
+            if stats is not None and stats.succeeded >= self.min_samples:
+                return stats
+        return None
+
+    def timeout_for(
+        self, command: str, session: Optional[str], max_timeout: int
+    ) -> int:
+        with self._lock:
+            stats = self._learned(command, session)
+            if stats is None:
+                return max_timeout
+            latency = stats.latencies.quantile(self.quantile)
+        timeout = (
+            math.ceil(self.margin * latency) if latency < math.inf else max_timeout
+        )
+        return max(min(timeout, max_timeout), min(self.min_timeout, max_timeout))
+
+    def observe(
+        self,
+        command: str,
+        session: Optional[str],
+        result: str,
+        latency: float,
+        timeout: int,
+        max_timeout: int,
+    ) -> None:
+        with self._lock:
+            for key in self._keys(command, session):
+                stats = self._stats_of(key)
+                stats.executed += 1
+                if result == "SUCCESS":
+                    stats.succeeded += 1
+                    stats.latencies.observe(latency)
+                elif result == "TIMEOUT":
+                    stats.timeouts += 1
+                    if timeout < max_timeout:
+                        stats.early_timeouts += 1
+                        stats.seconds_saved += max_timeout - timeout
+
+    def should_retry(
+        self, command: str, session: Optional[str], timeout: int, max_timeout: int
+    ) -> bool:
+        if timeout >= max_timeout:
+            return False
+        with self._lock:
+            stats = self._learned(command, session)
+            if stats is None:
+                return False
+            # with a prior of one success in two retries
+            retry_success_rate = (stats.retry_successes + 1) / (stats.retries + 2)
+            return retry_success_rate >= self.retry_min_success_rate
+
+    def observe_retry(
+        self, command: str, session: Optional[str], timeout: int, result: str
+    ) -> None:
+        with self._lock:
+            for key in self._keys(command, session):
+                stats = self._stats_of(key)
+                stats.retries += 1
+                # the first attempt was not saved after all
+                stats.seconds_saved -= timeout
+                if result == "SUCCESS":
+                    stats.retry_successes += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            items = sorted(
+                self.tactic_stats.items(),
+                key=lambda item: (item[0][0] or "", item[0][1]),
+            )
+            return {
+                f"{session or '*'}/{family}": {
+                    "executed": stats.executed,
+                    "success_rate": stats.success_rate,
+                    "p50": stats.latencies.quantile(0.5),
+                    "p90": stats.latencies.quantile(0.9),
+                    "p99": stats.latencies.quantile(0.99),
+                    "timeouts": stats.timeouts,
+                    "early_timeouts": stats.early_timeouts,
+                    "retries": stats.retries,
+                    "retry_successes": stats.retry_successes,
+                    "seconds_saved": stats.seconds_saved,
+                }
+                for (session, family), stats in items
+            }
+
+    def summary(self) -> str:
+        lines = []
+        for name, stats in self.stats().items():
+            lines.append(
+                f"{name}: {stats['executed']} commands, "
+                f"success rate {stats['success_rate']:.2f}, "
+                f"p50 <= {stats['p50']:g}s, p99 <= {stats['p99']:g}s, "
+                f"{stats['early_timeouts']} / {stats['timeouts']} timeouts early, "
+                f"{stats['retry_successes']} / {stats['retries']} retries succeeded, "
+                f"{stats['seconds_saved']:.1f}s saved"
+            )
+        return "\n".join(lines)
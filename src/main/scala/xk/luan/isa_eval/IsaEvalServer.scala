@@ -5,13 +5,25 @@ import io.grpc.StatusException
 import scalapb.zio_grpc.ServerMain
 import scalapb.zio_grpc.ServiceList
 import zio.ZIO
+import zio.stream.ZStream
 
-import xk.luan.isa_eval.server.{IsabelleOutcome, IsabelleServer}
+import java.util.concurrent.ConcurrentHashMap
+import scala.concurrent.Future
+
+import xk.luan.isa_eval.server.{
+  IsabelleOutcome,
+  IsabelleServer,
+  IsabelleServerPool,
+  IsabelleSetupKey
+}
 
 class IsabelleServerException(status: io.grpc.Status)
     extends StatusException(status)
 
-class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
+class IsaEvalServer(
+    val debug: Boolean = false,
+    val pool: IsabelleServerPool = new IsabelleServerPool()
+) extends ZioIsaEval.IsaEval {
   var isaServer: Option[IsabelleServer] = None
 
   private def tryWrapper[T](f: => T): T =
@@ -24,8 +36,10 @@ class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
         )
     }
 
+  // Isabelle calls block, run them on the blocking pool so that concurrent
+  // requests (e.g. batched expansions) do not starve each other
   private def zioWrapper[T](f: => T): ZIO[Any, IsabelleServerException, T] =
-    ZIO.attempt(tryWrapper(f)).refineToOrDie[IsabelleServerException]
+    ZIO.attemptBlocking(tryWrapper(f)).refineToOrDie[IsabelleServerException]
 
   private def makeOutcomeState(outcome: IsabelleOutcome): OutcomeState =
     OutcomeState(
@@ -33,7 +47,8 @@ class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
       outcome.result,
       outcome.getMessage,
       outcome.proofLevel,
-      isaServer.get.stateDescription(outcome.stateId)
+      isaServer.get.stateDescription(outcome.stateId),
+      elapsed = outcome.elapsed
     )
 
   def setupIsabelle(
@@ -41,16 +56,17 @@ class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
   ): ZIO[Any, IsabelleServerException, Setup] = {
     for {
       _ <- zioWrapper {
-        if (isaServer.nonEmpty) isaServer.get.close()
-        isaServer = Some(
-          new IsabelleServer(
-            os.Path(request.isaPath),
-            request.session,
-            os.Path(request.workingDirectory),
-            if (request.sessionRoots.isEmpty) None
-            else Some(os.Path(request.sessionRoots))
-          )
+        val key = IsabelleSetupKey(
+          os.Path(request.isaPath),
+          request.session,
+          os.Path(request.workingDirectory),
+          if (request.sessionRoots.isEmpty) None
+          else Some(os.Path(request.sessionRoots))
         )
+        // a warm instance of the same setup is reused instead of restarted,
+        // unless the client asks for a new one after the old one broke
+        if (request.forceNew) pool.release(key)
+        isaServer = Some(pool.acquire(key))
       }
     } yield Setup(
       isaServer.get.isaPath.toString(),
@@ -64,7 +80,27 @@ class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
   ): ZIO[Any, IsabelleServerException, Empty] = {
     for {
       _ <- zioWrapper {
-        if (isaServer.nonEmpty) isaServer.get.close()
+        isaServer.foreach(server =>
+          pool.release(
+            IsabelleSetupKey(
+              server.isaPath,
+              server.sessionName,
+              server.workingDirectory,
+              server.sessionRoots
+            )
+          )
+        )
+        isaServer = None
+      }
+    } yield Empty()
+  }
+
+  def releaseIsabelle(
+      request: Empty
+  ): ZIO[Any, IsabelleServerException, Empty] = {
+    for {
+      _ <- zioWrapper {
+        // the instance stays warm in the pool until it is evicted
         isaServer = None
       }
     } yield Empty()
@@ -103,27 +139,101 @@ class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
       request: zio.stream.Stream[StatusException, ProofCommands]
   ): ZIO[Any, IsabelleServerException, OutcomeStateStream] = {
     request.runCollect
-      .map(prfCommands => {
-        val outcomes = isaServer.get
-          .executeMultipleCommands(
-            prfCommands.map(_.commands).toList,
-            prfCommands.head.id,
-            prfCommands.head.timeout
-          )
-        val outcomeString = outcomes
-          .map { outcome =>
-            s"<STATE>${outcome.stateId}" +
-              s"<RESULT>${outcome.result}" +
-              s"<MSG>${outcome.getMessage}" +
-              s"<LEVEL>${outcome.proofLevel}" +
-              s"<DESCR>${isaServer.get.stateDescription(outcome.stateId)}"
-          }
-          .mkString("<OUTCOME_SEP>")
-        OutcomeStateStream(outcomeString)
-      })
+      .flatMap(prfCommands =>
+        zioWrapper {
+          val outcomes = isaServer.get
+            .executeMultipleCommands(
+              prfCommands.map(_.commands).toList,
+              prfCommands.head.id,
+              prfCommands.head.timeout
+            )
+          val outcomeString = outcomes
+            .map { outcome =>
+              s"<STATE>${outcome.stateId}" +
+                s"<RESULT>${outcome.result}" +
+                s"<MSG>${outcome.getMessage}" +
+                s"<LEVEL>${outcome.proofLevel}" +
+                s"<DESCR>${isaServer.get.stateDescription(outcome.stateId)}"
+            }
+            .mkString("<OUTCOME_SEP>")
+          OutcomeStateStream(outcomeString)
+        }
+      )
       .refineToOrDie[IsabelleServerException]
   }
 
+  // emit each outcome as soon as its command finishes, tagged with the index
+  // of its request and its parent state, and abort the remaining commands if
+  // the client cancels the call; the states of outcomes that were not sent
+  // by then are removed
+  private def streamOutcomes(
+      start: ZIO[Any, Throwable, List[(String, (String, Future[IsabelleOutcome]))]]
+  ): zio.stream.Stream[IsabelleServerException, OutcomeState] = {
+    ZStream
+      .fromZIO(start)
+      .flatMap { pending =>
+        val sent = ConcurrentHashMap.newKeySet[String]()
+        ZStream
+          .fromIterable(pending.zipWithIndex)
+          .mapZIOParUnordered(pending.length max 1) {
+            case ((parentId, (_, future)), index) =>
+              ZIO
+                .fromFuture(_ => future)
+                .mapError(e =>
+                  new IsabelleServerException(
+                    io.grpc.Status.INTERNAL.withDescription(e.getMessage)
+                  )
+                )
+                .flatMap(outcome =>
+                  zioWrapper(
+                    makeOutcomeState(outcome)
+                      .copy(index = index, parentId = parentId)
+                  )
+                )
+          }
+          .tap(outcome => ZIO.succeed(sent.add(outcome.id)))
+          .ensuring(
+            zioWrapper {
+              isaServer.get.cancelExecution(pending.map(_._2._1))
+              isaServer.get.discardOutcomes(
+                pending.map(_._2).filterNot(p => sent.contains(p._1)).map(_._2)
+              )
+            }.ignore
+          )
+      }
+      .refineOrDie { case e: IsabelleServerException => e }
+  }
+
+  def executeManyStreamed(
+      request: zio.stream.Stream[StatusException, ProofCommands]
+  ): zio.stream.Stream[IsabelleServerException, OutcomeState] =
+    streamOutcomes(
+      request.runCollect.flatMap(prfCommands =>
+        zioWrapper(
+          isaServer.get
+            .executeMultipleCommandsAsync(
+              prfCommands.map(_.commands).toList,
+              prfCommands.head.id,
+              prfCommands.head.timeout
+            )
+            .map(prfCommands.head.id -> _)
+        )
+      )
+    )
+
+  def executeBatch(
+      request: zio.stream.Stream[StatusException, ProofCommands]
+  ): zio.stream.Stream[IsabelleServerException, OutcomeState] =
+    streamOutcomes(
+      request.runCollect.flatMap(prfCommands =>
+        zioWrapper {
+          val requests =
+            prfCommands.map(cmd => (cmd.id, cmd.commands, cmd.timeout)).toList
+          requests.map(_._1) zip isaServer.get.executeBatchAsync(requests)
+        }
+      )
+    )
+
   def callSledgehammer(
       request: SledgehammerRequest
   ): ZIO[Any, IsabelleServerException, OutcomeState] = {
@@ -141,18 +251,22 @@ class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
   def getTheoryCommands(
       request: ParseRequest
   ): ZIO[Any, IsabelleServerException, IsabelleCommandStream] = {
-    val commands = isaServer.get
-      .getTheoryCommands(
-        os.Path(request.theory),
-        request.onlyStatements,
-        request.removeIgnored
+    for {
+      commands <- zioWrapper(
+        isaServer.get
+          .getTheoryCommands(
+            os.Path(request.theory),
+            request.onlyStatements,
+            request.removeIgnored
+          )
       )
-    val commandsString = commands
-      .map { case (cmd, name, line) =>
-        s"<CMD>$cmd<NAME>$name<LINE>$line"
-      }
-      .mkString("<CMD_SEP>")
-    ZIO.succeed(IsabelleCommandStream(commandsString))
+    } yield IsabelleCommandStream(
+      commands
+        .map { case (cmd, name, line) =>
+          s"<CMD>$cmd<NAME>$name<LINE>$line"
+        }
+        .mkString("<CMD_SEP>")
+    )
   }
 
   def cloneState(
@@ -179,6 +293,16 @@ class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
     } yield Empty()
   }
 
+  def removeStates(
+      request: StateList
+  ): ZIO[Any, IsabelleServerException, Empty] = {
+    for {
+      _ <- zioWrapper {
+        isaServer.get.removeStates(request.ids)
+      }
+    } yield Empty()
+  }
+
   def clearAndRename(
       request: ClearAndRenameRequest
   ): ZIO[Any, IsabelleServerException, OutcomeState] = {
@@ -198,8 +322,14 @@ class IsaEvalServer(val debug: Boolean = false) extends ZioIsaEval.IsaEval {
 }
 
 object IsaEvalServer extends ServerMain {
-  override def port: Int = 8980
+  // the port can be overridden so that several servers can run side by side
+  override def port: Int =
+    sys.env.get("ISA_EVAL_PORT").map(_.toInt).getOrElse(8980)
+
+  // ISA_EVAL_POOL_SIZE and ISA_EVAL_POOL_MIN_FREE_MB configure the pool
+  private val pool = IsabelleServerPool.fromEnv()
+  sys.addShutdownHook(pool.closeAll())
 
   override def services: ServiceList[Any] =
-    ServiceList.add(new IsaEvalServer)
+    ServiceList.add(new IsaEvalServer(pool = pool))
 }
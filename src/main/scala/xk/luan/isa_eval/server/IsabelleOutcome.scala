@@ -5,7 +5,9 @@ case class IsabelleOutcome(
     stateId: String,
     result: String,
     proofLevel: Int,
-    message: Option[String] = None
+    message: Option[String] = None,
+    // seconds the command ran, without the time it waited for a thread
+    elapsed: Double = 0.0
 ) {
   def isSuccess: Boolean = result == "SUCCESS"
   def isFailure: Boolean = result == "ERROR"
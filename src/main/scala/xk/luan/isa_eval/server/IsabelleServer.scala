@@ -75,8 +75,15 @@ class IsabelleServer(
     }
   }
 
-  private val stateMap: collection.mutable.Map[String, ToplevelState] =
-    collection.mutable.Map()
+  // concurrent requests may clone and remove states at the same time
+  private val stateMap: collection.concurrent.Map[String, ToplevelState] =
+    collection.concurrent.TrieMap()
+
+  // states whose commands are still executing, and those that were cancelled
+  private val runningStates: collection.concurrent.Map[String, Unit] =
+    collection.concurrent.TrieMap()
+  private val cancelledStates: collection.concurrent.Map[String, Unit] =
+    collection.concurrent.TrieMap()
 
   private def cloneState(state: ToplevelState, newId: String): Unit = {
     val clone = state.mlValue.force.retrieveNow
@@ -103,6 +110,9 @@ class IsabelleServer(
   def removeState(stateId: String): Unit =
     stateMap.remove(stateId)
 
+  def removeStates(stateIds: Seq[String]): Unit =
+    stateIds.foreach(stateMap.remove)
+
   def clearAndRenameState(stateId: String, newStateId: String): Unit = {
     if (stateId == newStateId) {
       stateMap.keys.foreach(k => if (k != stateId) stateMap.remove(k))
@@ -111,6 +121,7 @@ class IsabelleServer(
       stateMap.clear()
       stateMap(newStateId) = state
     }
+    cancelledStates.clear()
   }
 
   def getProofLevel(stateId: String): Int = stateMap(stateId).proofLevel
@@ -182,39 +193,96 @@ class IsabelleServer(
     )
   }
 
-  def executeMultipleCommands(
+  /** Starts executing each command on its own clone of the given state.
+    *
+    * Returns the new state ids together with the futures of their outcomes. Commands can be aborted with
+    * `cancelExecution`, in which case the outcome is "CANCELLED" and the new state is removed.
+    */
+  def executeMultipleCommandsAsync(
       commands: List[String],
       stateId: String = "default",
       timeout: Int = 30
-  ): List[IsabelleOutcome] = {
-    val state = stateMap(stateId)
-    val originProofLevel = state.proofLevel
-    val newStateIds = cloneState(stateId, commands.length)
-    val statesFuture = Future.traverse(
-      newStateIds zip commands.map(Transition.parseOuterSyntax(state.theory, _))
-    ) { case (id, trs) =>
-      Future(
-        try {
-          Success(asyncExecute(trs.map(_._1), stateMap(id), timeout))
-        } catch {
-          case e: IsabelleMLException => Failure(e)
-        }
-      )
-    }
-    val outcomeFuture = statesFuture.map { states =>
-      states.zip(newStateIds).map { case (st, id) =>
-        if (st.isSuccess) {
-          stateMap.update(id, st.get)
-          IsabelleOutcome(id, "SUCCESS", st.get.proofLevel)
-        } else {
-          val message = Some(st.failed.get.getMessage)
-          IsabelleOutcome(id, getResult(message), originProofLevel, message)
-        }
+  ): List[(String, Future[IsabelleOutcome])] =
+    executeBatchAsync(commands.map(command => (stateId, command, timeout)))
+
+  /** Executes (state id, command, timeout) requests that may start from different states. Each command runs on a
+    * fresh clone of its state, and all of them run in parallel.
+    */
+  def executeBatchAsync(
+      requests: List[(String, String, Int)]
+  ): List[(String, Future[IsabelleOutcome])] = {
+    val originProofLevels =
+      requests.map(_._1).distinct.map(id => id -> stateMap(id).proofLevel).toMap
+    requests.map { case (stateId, command, timeout) =>
+      val state = stateMap(stateId)
+      val originProofLevel = originProofLevels(stateId)
+      val id = cloneState(stateId)
+      runningStates.put(id, ())
+      val trs = Transition.parseOuterSyntax(state.theory, command)
+      id -> Future {
+        val started = System.nanoTime()
+        val result =
+          if (cancelledStates.contains(id)) None
+          else
+            try {
+              Some(
+                Success(asyncExecute(trs.map(_._1), stateMap(id), timeout, id))
+              )
+            } catch {
+              case e: IsabelleMLException => Some(Failure(e))
+            }
+        (result, (System.nanoTime() - started) / 1e9)
+      }.map { case (result, elapsed) =>
+        runningStates.remove(id)
+        if (cancelledStates.remove(id).nonEmpty) {
+          stateMap.remove(id)
+          IsabelleOutcome(id, "CANCELLED", originProofLevel)
+        } else
+          result.get match {
+            case Success(st) =>
+              stateMap.update(id, st)
+              IsabelleOutcome(id, "SUCCESS", st.proofLevel, elapsed = elapsed)
+            case Failure(e) =>
+              val message = Some(e.getMessage)
+              IsabelleOutcome(
+                id,
+                getResult(message),
+                originProofLevel,
+                message,
+                elapsed
+              )
+          }
       }
     }
-    Await.result(outcomeFuture, Duration.Inf)
   }
 
+  def executeMultipleCommands(
+      commands: List[String],
+      stateId: String = "default",
+      timeout: Int = 30
+  ): List[IsabelleOutcome] =
+    Await.result(
+      Future.sequence(
+        executeMultipleCommandsAsync(commands, stateId, timeout).map(_._2)
+      ),
+      Duration.Inf
+    )
+
+  /** Aborts the commands running on the given states, finished states are not affected. Commands that have not
+    * started yet are skipped, and running ones are interrupted in the Isabelle process.
+    */
+  def cancelExecution(stateIds: Iterable[String]): Unit =
+    stateIds.filter(runningStates.contains).foreach { id =>
+      cancelledStates.put(id, ())
+      Ops.cancelCommand(id).retrieveNow
+    }
+
+  /** Removes the states of the given commands once they finished, e.g. those of a cancelled stream that were never
+    * sent to the client.
+    */
+  def discardOutcomes(outcomes: Iterable[Future[IsabelleOutcome]]): Unit =
+    outcomes.foreach(_.foreach(outcome => stateMap.remove(outcome.stateId)))
+
   def tryCommands(
       commands: List[String],
       stateId: String = "default",
@@ -282,6 +350,7 @@ class IsabelleServer(
       timeout: Int
   ): IsabelleOutcome = {
     stateMap.clear()
+    cancelledStates.clear()
     val (_, state, transitions) = initialize(thyPath)
     stateMap("default") = state
     var message: Option[String] = None
@@ -318,10 +387,12 @@ class IsabelleServer(
   private def asyncExecute(
       transitions: List[Transition],
       state: ToplevelState,
-      timeout: Int = 30
+      timeout: Int,
+      key: String
   ): ToplevelState = {
     Ops
-      .commandExceptionWithTimeout(
+      .cancellableCommandWithTimeout(
+        key,
         timeout * 1000 * transitions.length,
         true,
         transitions,
@@ -369,6 +440,46 @@ object IsabelleServer extends OperationCollection {
       ], ToplevelState, ToplevelState]("""fn (timeout, int, trs, st) =>
           |  Timeout.apply (Time.fromMilliseconds timeout) (fold (Toplevel.command_exception int) trs) st
         """.stripMargin)
+
+    // running commands register their thread so that they can be interrupted
+    lazy val cancellation: Unit = isabelle.executeMLCodeNow(
+      """structure IsaEval_Cancellation =
+        |struct
+        |  val running =
+        |    Synchronized.var "IsaEval_Cancellation.running"
+        |      (Symtab.empty : Isabelle_Thread.T Symtab.table);
+        |  fun register key =
+        |    Synchronized.change running (Symtab.update (key, Isabelle_Thread.self ()));
+        |  fun unregister key =
+        |    Synchronized.change running (Symtab.delete_safe key);
+        |  fun cancel key =
+        |    Synchronized.change running (fn tab =>
+        |      (case Symtab.lookup tab key of
+        |        SOME thread => Isabelle_Thread.interrupt_unsynchronized thread
+        |      | NONE => ();
+        |      tab));
+        |end""".stripMargin
+    )
+
+    lazy val cancellableCommandWithTimeout = {
+      cancellation
+      compileFunction[String, Long, Boolean, List[
+        Transition
+      ], ToplevelState, ToplevelState]("""fn (key, timeout, int, trs, st) =>
+          |  let
+          |    val _ = IsaEval_Cancellation.register key
+          |    val result =
+          |      Exn.capture (Timeout.apply (Time.fromMilliseconds timeout)
+          |        (fold (Toplevel.command_exception int) trs)) st
+          |    val _ = IsaEval_Cancellation.unregister key
+          |  in Exn.release result end
+        """.stripMargin)
+    }
+
+    lazy val cancelCommand = {
+      cancellation
+      compileFunction[String, Unit]("IsaEval_Cancellation.cancel")
+    }
   }
 
   override protected def newOps(implicit isabelle: Isabelle) =
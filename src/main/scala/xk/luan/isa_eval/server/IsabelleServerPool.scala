@@ -0,0 +1,81 @@
+package xk.luan.isa_eval
+package server
+
+import scala.collection.mutable
+
+case class IsabelleSetupKey(
+    isaPath: os.Path,
+    sessionName: String,
+    workingDirectory: os.Path,
+    sessionRoots: Option[os.Path]
+)
+
+// Keeps up to `maxSize` warm Isabelle instances, one per setup, so that
+// switching back to a session does not reload its heap. The least recently
+// used instance is closed when the pool is full, or when the available memory
+// drops below `minAvailableMemoryMB` before starting a new instance.
+class IsabelleServerPool(
+    val maxSize: Int = 1,
+    val minAvailableMemoryMB: Long = 0
+) {
+  private val servers =
+    mutable.LinkedHashMap[IsabelleSetupKey, IsabelleServer]()
+
+  def size: Int = synchronized(servers.size)
+
+  def acquire(key: IsabelleSetupKey): IsabelleServer = synchronized {
+    servers.remove(key) match {
+      case Some(server) =>
+        // re-insert to mark it as the most recently used
+        servers(key) = server
+        server
+      case None =>
+        while (
+          servers.nonEmpty && (servers.size >= maxSize ||
+            IsabelleServerPool.availableMemoryMB < minAvailableMemoryMB)
+        ) evictLeastRecentlyUsed()
+        val server = new IsabelleServer(
+          key.isaPath,
+          key.sessionName,
+          key.workingDirectory,
+          key.sessionRoots
+        )
+        servers(key) = server
+        server
+    }
+  }
+
+  def release(key: IsabelleSetupKey): Unit = synchronized {
+    servers.remove(key).foreach(_.close())
+  }
+
+  private def evictLeastRecentlyUsed(): Unit = {
+    val (key, server) = servers.head
+    servers.remove(key)
+    server.close()
+  }
+
+  def closeAll(): Unit = synchronized {
+    servers.values.foreach(_.close())
+    servers.clear()
+  }
+}
+
+object IsabelleServerPool {
+  def availableMemoryMB: Long = {
+    val meminfo = os.Path("/proc/meminfo")
+    if (!os.exists(meminfo)) Long.MaxValue
+    else
+      os.read
+        .lines(meminfo)
+        .find(_.startsWith("MemAvailable:"))
+        .map(_.split("\\s+")(1).toLong / 1024)
+        .getOrElse(Long.MaxValue)
+  }
+
+  def fromEnv(): IsabelleServerPool =
+    new IsabelleServerPool(
+      sys.env.get("ISA_EVAL_POOL_SIZE").map(_.toInt).getOrElse(1) max 1,
+      sys.env.get("ISA_EVAL_POOL_MIN_FREE_MB").map(_.toLong).getOrElse(0L)
+    )
+}
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# the client modules import each other by name, as when run from their directory
+sys.path.insert(
+    0, str(Path(__file__).resolve().parents[3] / "main" / "python" / "isa_eval")
+)
@@ -0,0 +1,191 @@
+import time
+from pathlib import Path
+from typing import List
+
+from agent import EvalAgent, EvalAgentOutput
+from cache import (
+    AgentQueryCache,
+    CachedEvalAgent,
+    CachingEvalClient,
+    TacticCache,
+    TheoryCommandsCache,
+)
+from client import IsaEvalClient, IsaSetup
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+from search import IsaBestFirstSearch
+
+
+class TacticAgent(EvalAgent):
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        return [EvalAgentOutput(f"tactic_{i}", -i) for i in range(gen_length)]
+
+
+def search_theory(directory: Path, seed: int, isolated: bool):
+    # returns the number of proofs found and of those that do not check
+    config = MockConfig(time_scale=0, seed=seed, timeout_prob=0)
+    with MockIsaEvalServer(config=config) as server:
+        client = CachingEvalClient(
+            IsaEvalClient(server.port), TacticCache(directory / "cache.db")
+        )
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", directory, None))
+        (thy_path,) = sorted(directory.glob("*.thy"))
+        lemmas = [
+            line
+            for line in thy_path.read_text().splitlines()
+            if line.startswith("lemma")
+        ]
+        solved, broken = 0, 0
+        for lemma in lemmas:
+            state = client.proceed_until(thy_path, lemma, 60)
+            found, proof_steps, _ = IsaBestFirstSearch(
+                gen_length=6, batch_size=2
+            ).solve(state, TacticAgent(), client, isolated=isolated)
+            if not found:
+                continue
+            solved += 1
+            state = client.client.proceed_until(thy_path, lemma, 60)
+            for step in proof_steps:
+                (state,) = client.client.execute_many(state.state_id, [step], 10)
+                if state.result != "SUCCESS":
+                    break
+            if state.result != "SUCCESS" or not state.proof_is_finished():
+                broken += 1
+        client.close_itp()
+        hits = client.cache.hits
+        client.cache.close()
+        return solved, broken, hits
+
+
+def test_stale_cached_successes_do_not_yield_proofs(tmp_path):
+    for isolated in [True, False]:
+        directory = tmp_path / ("isolated" if isolated else "shared")
+        write_mock_theories(directory, 1, 8)
+        # the cache is filled by a server whose tactics behave differently
+        search_theory(directory, 0, isolated)
+        for seed in [1, 2]:
+            solved, broken, hits = search_theory(directory, seed, isolated)
+            assert hits > 0
+            assert solved > 0
+            assert broken == 0
+
+
+class CountingAgent(TacticAgent):
+    def __init__(self, name: str = "counting", delay: float = 0.0):
+        self.name = name
+        self.delay = delay
+        self.queried: List[str] = []
+
+    def identity(self) -> str:
+        return self.name
+
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        time.sleep(self.delay)
+        self.queried.append(state)
+        return super().query(state, gen_length)
+
+
+def test_agent_queries_are_answered_once():
+    agent = CountingAgent(delay=0.01)
+    cached = CachedEvalAgent(agent)
+    first = cached.query_batch(["a", "b"], 4)
+    assert cached.query_batch(["b", "c", "a"], 4) == [
+        first[1],
+        cached.query("c", 4),
+        first[0],
+    ]
+    assert agent.queried == ["a", "b", "c"]
+    assert cached.query_time_saved >= 0.02
+    # another gen_length, or another agent, is a different query
+    cached.query("a", 8)
+    CachedEvalAgent(CountingAgent("other"), cached.cache).query("a", 4)
+    assert cached.cache.stats()["misses"] == 5
+
+
+def test_agent_query_cache_evicts_the_least_recently_used_entry():
+    cache = AgentQueryCache(max_entries=2)
+    for key in ("a", "b"):
+        cache.put(key, [EvalAgentOutput(key)], 0.1)
+    cache.get("a")
+    cache.put("c", [EvalAgentOutput("c")], 0.1)
+    assert list(cache.memory) == ["a", "c"]
+    assert cache.get("b") is None
+
+
+def test_agent_query_cache_persists_across_runs(tmp_path):
+    first = AgentQueryCache(path=tmp_path / "agent.db")
+    first.put("key", [EvalAgentOutput("by simp", -0.5)], 1.5)
+    first.close()
+    second = AgentQueryCache(path=tmp_path / "agent.db")
+    assert second.get("key") == ([EvalAgentOutput("by simp", -0.5)], 1.5)
+    assert second.stats()["disk_hits"] == 1
+    second.close()
+
+
+def test_repeated_search_reports_the_saved_query_time(tmp_path):
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    agent = CountingAgent(delay=0.01)
+    cached = CachedEvalAgent(agent)
+    summaries = []
+    with MockIsaEvalServer(config=MockConfig(time_scale=0, seed=1)) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        for _ in range(2):
+            state = client.proceed_until(thy_path, lemma, 60)
+            summaries.append(
+                IsaBestFirstSearch(gen_length=4, query_limit=4).solve(
+                    state, cached, client
+                )[2]
+            )
+        client.close_itp()
+    assert summaries[0].agent_query_time_saved == 0.0
+    assert len(agent.queried) == summaries[0].query_count
+    assert summaries[1].agent_query_time_saved >= 0.01 * summaries[1].query_count
+
+
+class ParsingClient(IsaEvalClient):
+    def __init__(self, port: int):
+        super().__init__(port)
+        self.parsed = 0
+
+    def get_theory_commands(self, *args, **kwargs):
+        self.parsed += 1
+        return super().get_theory_commands(*args, **kwargs)
+
+
+def test_theory_commands_are_parsed_once_per_content_and_setup(tmp_path):
+    (thy_path,) = write_mock_theories(tmp_path / "theories", 1, 2)
+    cache_path = tmp_path / "commands.db"
+    with MockIsaEvalServer(config=MockConfig(time_scale=0)) as server:
+        client = ParsingClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        cache = TheoryCommandsCache(cache_path)
+        commands = cache.get_theory_commands(client, thy_path, False, True)
+        assert cache.get_theory_commands(client, thy_path, False, True) == commands
+        assert client.parsed == 1
+        cache.get_theory_commands(client, thy_path, True, True)
+        assert client.parsed == 2
+        cache.close()
+
+        # the cache persists, and a changed file is parsed again
+        cache = TheoryCommandsCache(cache_path)
+        cache.get_theory_commands(client, thy_path, False, True)
+        assert client.parsed == 2
+        write_mock_theories(tmp_path / "theories", 1, 3)
+        assert len(cache.get_theory_commands(client, thy_path, False, True)) > len(
+            commands
+        )
+        assert client.parsed == 3
+        # the entry of the older content was replaced
+        source, _ = cache.make_key(client.setup, thy_path, False, True)
+        assert cache.connection.execute(
+            "SELECT COUNT(*) FROM theory_commands WHERE source = ?", (source,)
+        ).fetchone() == (1,)
+
+        client.close_itp()
+        client.setup_itp(IsaSetup(Path("/mock"), "Main", tmp_path, None))
+        cache.get_theory_commands(client, thy_path, False, True)
+        assert client.parsed == 4
+        assert cache.stats()["hits"] == 1
+        cache.close()
+        client.close_itp()
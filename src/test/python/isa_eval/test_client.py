@@ -0,0 +1,93 @@
+from pathlib import Path
+
+from client import CancellationToken, IsaEvalClient, IsaSetup
+from metrics import METRICS, enable_metrics
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+
+
+def test_close_itp_keeps_the_instance_warm_only_when_asked(tmp_path):
+    setup = IsaSetup(Path("/mock"), "HOL", tmp_path, None)
+    with MockIsaEvalServer(config=MockConfig(time_scale=0)) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(setup)
+        client.close_itp(keep_warm=True)
+        client.setup_itp(setup)
+        assert server.servicer.setup_num == 1
+
+        client.close_itp()
+        client.setup_itp(setup)
+        assert server.servicer.setup_num == 2
+        client.close_itp()
+
+
+def outcome_key(outcome):
+    return outcome.result, outcome.proof_level, outcome.state
+
+
+def test_streamed_outcomes_match_execute_many(tmp_path):
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    commands = [f"tactic_{i}" for i in range(8)]
+    with MockIsaEvalServer(config=MockConfig(time_scale=0)) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        state = client.proceed_until(thy_path, lemma, 60)
+        expected = [
+            outcome_key(o) for o in client.execute_many("default", commands, 10)
+        ]
+
+        streamed = dict(client.iter_execute_many("default", commands, 10))
+        assert sorted(streamed) == list(range(len(commands)))
+        assert [outcome_key(streamed[i]) for i in range(len(commands))] == expected
+
+        # a batch may start from several states
+        other = client.clone_state(state.state_id)
+        requests = [(s, c) for c in commands[:2] for s in ("default", other.state_id)]
+        batch = dict(client.iter_execute_batch(requests, 10))
+        assert [outcome_key(batch[i]) for i in range(4)] == [
+            expected[0],
+            expected[0],
+            expected[1],
+            expected[1],
+        ]
+        client.close_itp()
+
+
+def test_cancelled_stream_stops_the_remaining_commands(tmp_path):
+    config = MockConfig(time_scale=1.0, latency_median=0.05, timeout_prob=0.0)
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    commands = [f"tactic_{i}" for i in range(16)]
+    with MockIsaEvalServer(config=config) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        client.proceed_until(thy_path, lemma, 60)
+        token = CancellationToken()
+        outcomes = []
+        for _, outcome in client.iter_execute_many("default", commands, 10, token):
+            outcomes.append(outcome)
+            token.cancel()
+        assert 1 <= len(outcomes) < len(commands)
+        assert server.servicer.executed_num < len(commands)
+        client.close_itp()
+
+
+def test_streamed_outcomes_are_timed(tmp_path):
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    enable_metrics()
+    try:
+        with MockIsaEvalServer(config=MockConfig(time_scale=0)) as server:
+            client = IsaEvalClient(server.port)
+            client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+            client.proceed_until(thy_path, lemma, 60)
+            METRICS.reset()
+            list(client.iter_execute_many("default", ["tactic_0", "tactic_1"], 10))
+            client.close_itp()
+        commands = METRICS.histograms["isa_eval_command_seconds"]
+        assert sum(h.count for h in commands.values()) == 2
+        rpcs = METRICS.histograms["isa_eval_rpc_seconds"]
+        assert rpcs[(("method", "ExecuteManyStreamed"),)].count == 1
+    finally:
+        enable_metrics(False)
+        METRICS.reset()
@@ -0,0 +1,61 @@
+import logging
+
+from distributed import EvalCoordinator
+from mock_server import write_mock_theories
+
+
+def make_coordinator(theories_path) -> EvalCoordinator:
+    return EvalCoordinator(
+        theories_path,
+        lease_seconds=60.0,
+        heartbeat_interval=1.0,
+        max_attempts=3,
+        logger=logging.getLogger("test-coordinator"),
+    )
+
+
+def request(coordinator: EvalCoordinator, worker: str) -> dict:
+    return coordinator.handle({"type": "request", "worker": worker, "session": None})
+
+
+def fail_until_idle(coordinator: EvalCoordinator, worker: str) -> int:
+    fails = 0
+    while True:
+        reply = request(coordinator, worker)
+        if reply["type"] != "unit":
+            return fails
+        coordinator.handle(
+            {"type": "fail", "lease": reply["lease"], "reason": "setup failed"}
+        )
+        fails += 1
+
+
+def test_failing_worker_does_not_abandon_units(tmp_path):
+    write_mock_theories(tmp_path, 3, 2)
+    coordinator = make_coordinator(tmp_path)
+    busy = request(coordinator, "good")
+    assert busy["type"] == "unit"
+
+    # the units come back to the pending ones, but not to the failing worker
+    assert fail_until_idle(coordinator, "bad") == 2
+    assert request(coordinator, "bad")["type"] == "wait"
+    assert coordinator.abandoned == set()
+
+    coordinator.handle({"type": "complete", "lease": busy["lease"], "time": 1.0})
+    while True:
+        reply = request(coordinator, "good")
+        if reply["type"] == "done":
+            break
+        assert reply["type"] == "unit"
+        coordinator.handle({"type": "complete", "lease": reply["lease"], "time": 1.0})
+    assert coordinator.abandoned == set()
+    assert len(coordinator.times) == 3
+
+
+def test_units_every_worker_failed_are_abandoned(tmp_path):
+    write_mock_theories(tmp_path, 3, 2)
+    coordinator = make_coordinator(tmp_path)
+    # nothing is left to wait for once the only worker failed on every unit
+    assert fail_until_idle(coordinator, "bad") == 3
+    assert coordinator.finished.is_set()
+    assert len(coordinator.abandoned) == 3
@@ -0,0 +1,95 @@
+import random
+from dataclasses import dataclass
+
+import pytest
+
+from frontier import (
+    BeamFrontier,
+    BestFirstFrontier,
+    DepthCappedFrontier,
+    MinMaxHeap,
+    make_frontier,
+)
+
+
+@dataclass
+class Node:
+    score: float
+    depth: int = 0
+
+
+def test_min_max_heap_pops_both_ends_in_order():
+    rng = random.Random(0)
+    values = [rng.randrange(100) for _ in range(500)]
+    heap = MinMaxHeap()
+    for value in values:
+        heap.push(value)
+    expected = sorted(values)
+    popped_min, popped_max = [], []
+    while len(heap) > 0:
+        assert heap.peek_min() == expected[0]
+        assert heap.peek_max() == expected[-1]
+        if rng.random() < 0.5:
+            popped_min.append(heap.pop_min())
+            expected.pop(0)
+        else:
+            popped_max.append(heap.pop_max())
+            expected.pop()
+    assert popped_min == sorted(popped_min)
+    assert popped_max == sorted(popped_max, reverse=True)
+
+
+def test_best_first_frontier_evicts_the_worst_node():
+    evicted = []
+    frontier = BestFirstFrontier(3, on_evict=evicted.append)
+    nodes = [Node(score) for score in (0.5, 0.1, 0.9, 0.3, 0.7)]
+    for node in nodes:
+        frontier.push(node)
+    assert [n.score for n in evicted] == [0.9, 0.7]
+    assert frontier.evicted_num == 2
+    assert [frontier.pop().score for _ in range(len(frontier))] == [0.1, 0.3, 0.5]
+
+
+def test_ties_pop_in_insertion_order():
+    frontier = BestFirstFrontier(10)
+    nodes = [Node(1.0) for _ in range(4)]
+    for node in nodes:
+        frontier.push(node)
+    assert [frontier.pop() for _ in nodes] == nodes
+
+
+def test_depth_capped_frontier_keeps_the_best_nodes_of_each_depth():
+    evicted = []
+    frontier = DepthCappedFrontier(4, 2, on_evict=evicted.append)
+    for node in [Node(0.2, 1), Node(0.4, 1), Node(0.3, 1), Node(0.9, 2)]:
+        frontier.push(node)
+    assert evicted == [Node(0.4, 1)]
+    # over the total capacity, the worst node across depths is evicted
+    frontier.push(Node(0.1, 3))
+    frontier.push(Node(0.5, 3))
+    assert evicted == [Node(0.4, 1), Node(0.9, 2)]
+    assert len(frontier) == 4
+    assert sorted(n.score for n in frontier.nodes()) == [0.1, 0.2, 0.3, 0.5]
+    assert [frontier.pop().score for _ in range(4)] == [0.1, 0.2, 0.3, 0.5]
+
+
+def test_beam_frontier_exhausts_the_shallowest_depth_first():
+    frontier = BeamFrontier(10, 2)
+    for node in [Node(0.1, 2), Node(0.8, 1), Node(0.5, 1), Node(0.9, 1)]:
+        frontier.push(node)
+    assert [(n.depth, n.score) for n in (frontier.pop() for _ in range(3))] == [
+        (1, 0.5),
+        (1, 0.8),
+        (2, 0.1),
+    ]
+    assert not frontier
+
+
+def test_make_frontier():
+    assert isinstance(make_frontier("best_first", 8), BestFirstFrontier)
+    beam = make_frontier("beam", 8)
+    assert isinstance(beam, BeamFrontier) and beam.depth_cap == 8
+    capped = make_frontier("depth_capped", 8, 2)
+    assert type(capped) is DepthCappedFrontier and capped.depth_cap == 2
+    with pytest.raises(ValueError):
+        make_frontier("depth_first", 8)
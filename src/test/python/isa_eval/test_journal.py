@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+from typing import List
+
+from agent import EvalAgent, EvalAgentOutput
+from evaluate import evaluate_isabelle_agent
+from journal import EvalJournal, EvalRecord
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+from search import IsaBestFirstSearch, SearchSummary
+
+
+class TacticAgent(EvalAgent):
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        return [EvalAgentOutput(f"tactic_{i}", -i) for i in range(gen_length)]
+
+
+class CountingSearch(IsaBestFirstSearch):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.searched: List[str] = []
+
+    def solve(self, state, agent, client, *args, name=None, **kwargs):
+        self.searched.append(name)
+        return super().solve(state, agent, client, *args, name=name, **kwargs)
+
+
+def test_journal_resumes_from_a_truncated_file(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    journal = EvalJournal(path, resume=False)
+    record = EvalRecord(True, ["by simp"], SearchSummary(query_count=2))
+    journal.record_lemma("HOL", Path("A.thy"), "lemma a", record)
+    journal.record_theory("HOL", Path("A.thy"), 1.5)
+    journal.record_lemma("HOL", Path("B.thy"), "lemma b", record)
+    journal.close()
+    # a run killed in the middle of a line
+    with open(path, "a") as journal_file:
+        journal_file.write('{"type": "lemma", "sess')
+
+    journal = EvalJournal(path)
+    assert journal.records[("lemma a", "HOL", Path("A.thy"))] == record
+    assert journal.theory_done("HOL", Path("A.thy"))
+    assert not journal.theory_done("HOL", Path("B.thy"))
+    assert journal.recorded_lemmas("HOL", Path("B.thy")) == {"lemma b"}
+    journal.record_theory("HOL", Path("B.thy"), 2.0)
+    journal.close()
+    assert json.loads(path.read_text().splitlines()[-1])["time"] == 2.0
+
+    assert EvalJournal(path, resume=False).records == {}
+
+
+def test_interrupted_evaluation_resumes_where_it_stopped(tmp_path):
+    theories = tmp_path / "theories"
+    write_mock_theories(theories, 2, 3)
+    path = tmp_path / "journal.jsonl"
+    config = MockConfig(time_scale=0, success_prob=0.5)
+    with MockIsaEvalServer(config=config) as server:
+        first = CountingSearch(gen_length=4, query_limit=4)
+        records, _ = evaluate_isabelle_agent(
+            "/mock",
+            theories,
+            TacticAgent(),
+            first,
+            port=server.port,
+            journal_path=path,
+        )
+        assert len(first.searched) == 6
+        # as if the run was killed before the last lemma of the second theory
+        lines = path.read_text().splitlines()
+        assert [json.loads(l)["type"] for l in lines[-2:]] == ["lemma", "theory"]
+        path.write_text("\n".join(lines[:-2]) + "\n")
+
+        second = CountingSearch(gen_length=4, query_limit=4)
+        resumed, times = evaluate_isabelle_agent(
+            "/mock",
+            theories,
+            TacticAgent(),
+            second,
+            port=server.port,
+            journal_path=path,
+            resume=True,
+        )
+    assert second.searched == first.searched[-1:]
+    assert resumed.keys() == records.keys()
+    assert len(times) == 2
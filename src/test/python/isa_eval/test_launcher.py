@@ -0,0 +1,21 @@
+import sys
+
+import pytest
+
+from launcher import SERVER_MAIN_CLASS, build_server
+
+
+def test_servers_run_from_the_built_classpath(tmp_path):
+    build_command = [sys.executable, "-c", "print('[warn] noise'); print('/a.jar:/b')"]
+    assert build_server(tmp_path, build_command) == [
+        "java",
+        "-cp",
+        "/a.jar:/b",
+        SERVER_MAIN_CLASS,
+    ]
+
+
+def test_failed_build_is_reported(tmp_path):
+    build_command = [sys.executable, "-c", "print('[error] compile failed'); exit(1)"]
+    with pytest.raises(RuntimeError, match="compile failed"):
+        build_server(tmp_path, build_command)
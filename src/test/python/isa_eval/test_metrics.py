@@ -0,0 +1,76 @@
+import math
+from pathlib import Path
+
+import pytest
+
+from client import IsaEvalClient, IsaSetup
+from metrics import METRICS, Histogram, MetricsRegistry, enable_metrics
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+
+
+@pytest.fixture
+def metrics():
+    METRICS.reset()
+    yield enable_metrics()
+    enable_metrics(False)
+    METRICS.reset()
+
+
+def rpc_counts(registry: MetricsRegistry) -> dict:
+    return {
+        dict(labels)["method"]: histogram.count
+        for labels, histogram in registry.histograms.get(
+            "isa_eval_rpc_seconds", {}
+        ).items()
+    }
+
+
+def test_histogram_quantiles_are_bucket_bounds():
+    histogram = Histogram((0.1, 1.0, 10.0))
+    assert math.isnan(histogram.quantile(0.5))
+    for value in (0.05, 0.5, 0.7, 5.0, 50.0):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.8) == 10.0
+    assert histogram.quantile(1.0) == math.inf
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry()
+    registry.observe("isa_eval_rpc_seconds", 1.0, method="Execute")
+    with registry.timer("isa_eval_phase_seconds", phase="query"):
+        pass
+    assert registry.histograms == {}
+
+
+def test_merged_json_adds_up():
+    first, second = MetricsRegistry(True), MetricsRegistry(True)
+    first.observe("isa_eval_rpc_seconds", 0.01, method="Execute")
+    second.observe("isa_eval_rpc_seconds", 2.0, method="Execute")
+    second.observe("isa_eval_rpc_seconds", 0.2, method="CloneState")
+    first.merge_json(second.to_json())
+    assert rpc_counts(first) == {"Execute": 2, "CloneState": 1}
+    assert 'isa_eval_rpc_seconds_count{method="Execute"} 2' in first.to_prometheus()
+
+
+def test_sledgehammer_is_recorded_once_per_call(tmp_path, metrics):
+    config = MockConfig(time_scale=0, sledgehammer_success_prob=1.0)
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    with MockIsaEvalServer(config=config) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        state = client.proceed_until(thy_path, lemma, 60)
+        METRICS.reset()
+
+        first = client.execute(state.state_id, "sledgehammer", 10)
+        # the second call replays the proof found by the first one
+        second = client.execute(state.state_id, "sledgehammer", 10)
+        assert first.result == second.result == "SUCCESS"
+        assert client.sledgehammer_stats()["hits"] == 1
+        assert rpc_counts(METRICS) == {"CallSledgehammer": 1}
+
+        client.execute_many(state.state_id, ["tactic_0", "sledgehammer"], 10)
+        assert rpc_counts(METRICS) == {"CallSledgehammer": 1, "ExecuteMany": 1}
+        client.close_itp()
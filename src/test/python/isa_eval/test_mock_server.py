@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import isa_eval_pb2
+from client import IsaEvalClient, IsaSetup
+from mock_server import (
+    MockConfig,
+    MockIsaEvalServer,
+    MockIsaEvalServicer,
+    MockState,
+    write_mock_theories,
+)
+
+
+class StreamContext:
+    def __init__(self):
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def abort(self, code, details):
+        raise RuntimeError(details)
+
+
+def run_stream(servicer: MockIsaEvalServicer, commands, read: int):
+    # reads `read` outcomes of a stream and then closes it, as a cancelled
+    # call does
+    servicer._put("parent", MockState(1, 1, 3, "goal"))
+    context = StreamContext()
+    stream = servicer._run_stream(
+        [
+            isa_eval_pb2.ProofCommands(id="parent", commands=c, timeout=10)
+            for c in commands
+        ],
+        context,
+    )
+    outcomes = [next(stream) for _ in range(read)]
+    stream.close()
+    for callback in context.callbacks:
+        callback()
+    servicer.executor.shutdown(wait=True)
+    return outcomes
+
+
+def test_outcomes_of_the_same_seed_are_the_same(tmp_path):
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    results = []
+    for _ in range(2):
+        with MockIsaEvalServer(config=MockConfig(time_scale=0, seed=3)) as server:
+            client = IsaEvalClient(server.port)
+            client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+            state = client.proceed_until(thy_path, lemma, 60)
+            outcomes = client.execute_many(
+                state.state_id, [f"tactic_{i}" for i in range(8)], 10
+            )
+            results.append([(o.result, o.proof_level, o.state) for o in outcomes])
+            client.close_itp()
+    assert results[0] == results[1]
+
+
+def test_closed_stream_keeps_the_outcomes_it_sent():
+    servicer = MockIsaEvalServicer(MockConfig(time_scale=0, success_prob=1.0))
+    (outcome,) = run_stream(servicer, ["tactic_0"], 1)
+    assert outcome.result == "SUCCESS"
+    assert set(servicer.states) == {"parent", outcome.id}
+
+
+def test_closed_stream_removes_the_outcomes_it_did_not_send():
+    servicer = MockIsaEvalServicer(MockConfig(time_scale=0))
+    (outcome,) = run_stream(servicer, [f"tactic_{i}" for i in range(6)], 1)
+    assert set(servicer.states) == {"parent", outcome.id}
@@ -0,0 +1,55 @@
+import logging
+import socket
+import sys
+from pathlib import Path
+
+import mock_server
+from client import IsaEvalClient, IsaSetup
+from launcher import IsaEvalServerProcess
+from mock_server import MockConfig, MockIsaEvalServer
+from recovery import ITPRecovery
+
+logger = logging.getLogger("test-recovery")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def test_recovery_replaces_the_pooled_instance(tmp_path):
+    setup = IsaSetup(Path("/mock"), "HOL", tmp_path, None)
+    with MockIsaEvalServer(config=MockConfig(time_scale=0)) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(setup)
+        # the same setup again reuses the running instance
+        client.setup_itp(setup)
+        assert server.servicer.setup_num == 1
+
+        recovery = ITPRecovery()
+        assert recovery.recover(client, setup, logger)
+        assert server.servicer.setup_num == 2
+        assert recovery.stats() == {"recoveries": 1, "restarts": 0, "failures": 0}
+        client.close_itp()
+
+
+def test_recovery_restarts_an_exited_server(tmp_path):
+    port = free_port()
+    command = [sys.executable, mock_server.__file__, "--port", str(port)]
+    server = IsaEvalServerProcess(port, command, cwd=tmp_path)
+    setup = IsaSetup(Path("/mock"), "HOL", tmp_path, None)
+    server.start(timeout=60)
+    try:
+        client = IsaEvalClient(port)
+        client.setup_itp(setup)
+        server.process.kill()
+        server.process.wait()
+
+        recovery = ITPRecovery(server, ready_timeout=60)
+        assert recovery.recover(client, setup, logger)
+        assert server.is_running()
+        assert recovery.stats() == {"recoveries": 1, "restarts": 1, "failures": 0}
+        client.close_itp()
+    finally:
+        server.stop()
@@ -0,0 +1,80 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from agent import EvalAgent, EvalAgentOutput
+from client import IsaEvalClient, IsaSetup
+from evaluate import evaluate_single_theory
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+from replay import RecordingEvalClient, ReplayEvalClient, ReplayMissError, ReplayStore
+from search import IsaBestFirstSearch
+
+
+class TacticAgent(EvalAgent):
+    def __init__(self, prefix: str = "tactic"):
+        self.prefix = prefix
+
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        return [EvalAgentOutput(f"{self.prefix}_{i}", -i) for i in range(gen_length)]
+
+
+def evaluate(client, thy_path: Path, agent: EvalAgent):
+    records = evaluate_single_theory(
+        thy_path,
+        agent,
+        client,
+        IsaBestFirstSearch(gen_length=4, batch_size=1, query_limit=6),
+    )
+    return {lemma: (r.solved, r.proof_steps) for lemma, r in records.items()}
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    # a theory evaluated on the mock server with every outcome recorded
+    theories = tmp_path / "theories"
+    (thy_path,) = write_mock_theories(theories, 1, 3)
+    setup = IsaSetup(Path("/mock"), "HOL", theories, None)
+    config = MockConfig(time_scale=0, success_prob=0.5, timeout_prob=0)
+    with MockIsaEvalServer(config=config) as server:
+        client = RecordingEvalClient(
+            IsaEvalClient(server.port), ReplayStore(tmp_path / "record.db")
+        )
+        client.setup_itp(setup)
+        results = evaluate(client, thy_path, TacticAgent())
+        client.close_itp()
+        client.store.close()
+        yield server, setup, thy_path, results
+
+
+def test_offline_replay_reproduces_the_recorded_run(tmp_path, recorded):
+    _, setup, thy_path, results = recorded
+    assert any(solved for solved, _ in results.values())
+    client = ReplayEvalClient(ReplayStore(tmp_path / "record.db"))
+    client.setup_itp(setup)
+    assert evaluate(client, thy_path, TacticAgent()) == results
+    assert client.unknown_num == 0
+
+    # commands that were never recorded have an unknown outcome
+    new_results = evaluate(client, thy_path, TacticAgent("other"))
+    assert not any(solved for solved, _ in new_results.values())
+    assert client.unknown_num > 0
+
+    (other_path,) = write_mock_theories(tmp_path / "other", 1, 1)
+    with pytest.raises(ReplayMissError):
+        client.get_theory_commands(other_path, False, True)
+
+
+def test_misses_fall_back_to_the_server_and_are_recorded(tmp_path, recorded):
+    server, setup, thy_path, _ = recorded
+    store = ReplayStore(tmp_path / "record.db")
+    client = ReplayEvalClient(store, fallback=IsaEvalClient(server.port))
+    client.setup_itp(setup)
+    results = evaluate(client, thy_path, TacticAgent("other"))
+    client.close_itp()
+    store.close()
+
+    offline = ReplayEvalClient(ReplayStore(tmp_path / "record.db"))
+    offline.setup_itp(setup)
+    assert evaluate(offline, thy_path, TacticAgent("other")) == results
+    assert offline.unknown_num == 0
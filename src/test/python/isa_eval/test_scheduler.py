@@ -0,0 +1,100 @@
+from pathlib import Path
+from typing import List
+
+import grpc
+from grpc._channel import _InactiveRpcError as InactiveRpcError
+from grpc._channel import _RPCState as RPCState
+
+import scheduler
+from agent import EvalAgent, EvalAgentOutput
+from client import IsaEvalClient, IsaSetup
+from evaluate import evaluate_single_theory
+from journal import EvalRecord
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+from scheduler import BudgetScheduler, evaluate_with_budget
+from search import IsaBestFirstSearch, SearchSummary
+
+
+class TacticAgent(EvalAgent):
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        return [EvalAgentOutput(f"tactic_{i}", -i) for i in range(gen_length)]
+
+
+class CrashingClient(IsaEvalClient):
+    # fails the first batch of commands, as a crashed ITP would
+    def __init__(self, port: int, *args, **kwargs):
+        super().__init__(port)
+        self.crashed = False
+
+    def iter_execute_many(self, *args, **kwargs):
+        if not self.crashed:
+            self.crashed = True
+            state = RPCState((), None, None, grpc.StatusCode.UNAVAILABLE, "crashed")
+            raise InactiveRpcError(state)
+        return super().iter_execute_many(*args, **kwargs)
+
+
+def failed_record(generated: int, succeeded: int) -> EvalRecord:
+    return EvalRecord(
+        False,
+        [],
+        SearchSummary(
+            generated_num=generated,
+            succeeded_num=succeeded,
+            failure_reason="query limit",
+        ),
+    )
+
+
+def test_later_passes_order_the_unsolved_lemmas_by_priority():
+    budget = BudgetScheduler(IsaBestFirstSearch(), 60, priority="most_progress")
+    budget.register("HOL", Path("A.thy"), ["a0", "a1"])
+    budget.register("HOL", Path("B.thy"), ["b0"])
+    assert [p.lemma for p in budget.candidates(0)] == ["a0", "a1", "b0"]
+
+    budget.observe("HOL", Path("A.thy"), "a0", failed_record(10, 1))
+    budget.observe("HOL", Path("A.thy"), "a1", failed_record(10, 5))
+    budget.observe("HOL", Path("B.thy"), "b0", failed_record(10, 3))
+    assert [p.lemma for p in budget.candidates(1)] == ["a1", "b0", "a0"]
+
+
+def test_lemma_order_sets_the_search_order(tmp_path):
+    config = MockConfig(time_scale=0, success_prob=0.5)
+    (thy_path,) = write_mock_theories(tmp_path, 1, 4)
+    lemmas = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")]
+    searched = []
+    with MockIsaEvalServer(config=config) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        records = evaluate_single_theory(
+            thy_path,
+            TacticAgent(),
+            client,
+            IsaBestFirstSearch(gen_length=4, query_limit=4),
+            skip_lemmas={lemmas[1]},
+            on_record=lambda lemma, record: searched.append(lemma),
+            lemma_order=[lemmas[3], lemmas[0], lemmas[1]],
+        )
+        client.close_itp()
+    # lemmas missing from the order come last
+    assert searched == [lemmas[3], lemmas[0], lemmas[2]]
+    assert set(records) == set(searched)
+
+
+def test_budget_evaluation_recovers_from_a_crashed_itp(tmp_path, monkeypatch):
+    config = MockConfig(time_scale=0, success_prob=0.5)
+    (thy_path,) = write_mock_theories(tmp_path, 1, 3)
+    with MockIsaEvalServer(config=config) as server:
+        monkeypatch.setattr(scheduler, "make_eval_client", CrashingClient)
+        records, _ = evaluate_with_budget(
+            "/mock",
+            tmp_path,
+            TacticAgent(),
+            IsaBestFirstSearch(gen_length=4, query_limit=8),
+            budget_seconds=60,
+            first_pass_scale=1.0,
+            port=server.port,
+        )
+        assert server.servicer.setup_num == 2
+    assert len(records) == 3
+    assert all(r.search_summary.failure_reason != "ITP error" for r in records.values())
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from agent import EvalAgent, EvalAgentOutput
+from client import IsaEvalClient, IsaSetup
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+from search import IsaBestFirstSearch, SNode
+from search_trace import SearchTrace
+
+
+class TacticAgent(EvalAgent):
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        return [EvalAgentOutput(f"tactic_{i}", -i) for i in range(gen_length)]
+
+
+class FailingClient(IsaEvalClient):
+    # fails the second batch, as a crashed server would
+    def __init__(self, port: int):
+        super().__init__(port)
+        self.batches = 0
+
+    def iter_execute_many(self, *args, **kwargs):
+        self.batches += 1
+        if self.batches > 1:
+            raise RuntimeError("the server crashed")
+        return super().iter_execute_many(*args, **kwargs)
+
+
+def test_failed_search_stops_its_tracker(tmp_path):
+    config = MockConfig(time_scale=0, success_prob=0.5, progress_prob=0)
+    trace = SearchTrace(tmp_path / "trace.jsonl")
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    with MockIsaEvalServer(config=config) as server:
+        client = FailingClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        thread_nums = []
+        for _ in range(3):
+            client.batches = 0
+            state = client.proceed_until(thy_path, lemma, 60)
+            with pytest.raises(RuntimeError):
+                IsaBestFirstSearch(gen_length=4, trace=trace).solve(
+                    state, TacticAgent(), client, isolated=True
+                )
+            thread_nums.append(
+                sum(t.name == "state-tracker" for t in threading.enumerate())
+            )
+        client.close_itp()
+    trace.close()
+    assert thread_nums == [0, 0, 0]
+    events = [json.loads(line) for line in open(tmp_path / "trace.jsonl")]
+    ends = [event for event in events if event["e"] == "end"]
+    assert len(ends) == 3
+    assert all(event["summary"]["failure_reason"] == "error" for event in ends)
+
+
+def test_nodes_share_the_proof_path_of_their_parent():
+    root = SNode(0.0, None)
+    first = SNode(0.5, None, root, "apply auto")
+    second = SNode(1.0, None, first, "apply simp")
+    sibling = SNode(0.7, None, first, "by blast")
+    assert root.proof_steps == []
+    assert second.proof_steps == ["apply auto", "apply simp"]
+    assert sibling.proof_steps == ["apply auto", "by blast"]
+    assert (root.depth, second.depth) == (0, 2)
+
+
+def test_found_proofs_check(tmp_path):
+    config = MockConfig(time_scale=0, success_prob=0.5, timeout_prob=0)
+    (thy_path,) = write_mock_theories(tmp_path, 1, 4)
+    lemmas = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")]
+    proofs = []
+    with MockIsaEvalServer(config=config) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        for lemma in lemmas:
+            state = client.proceed_until(thy_path, lemma, 60)
+            found, proof_steps, _ = IsaBestFirstSearch(
+                gen_length=4, batch_size=2
+            ).solve(state, TacticAgent(), client)
+            if not found:
+                continue
+            proofs.append(proof_steps)
+            state = client.proceed_until(thy_path, lemma, 60)
+            for step in proof_steps:
+                state = client.execute("default", step, 10)
+                assert state.result == "SUCCESS"
+            assert state.proof_is_finished()
+        client.close_itp()
+    assert any(len(proof_steps) > 1 for proof_steps in proofs)
+
+
+class SlowAgent(TacticAgent):
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        time.sleep(0.02)
+        return super().query(state, gen_length)
+
+
+def test_pipelined_search_overlaps_queries_with_the_itp(tmp_path):
+    config = MockConfig(
+        latency_median=0.02, latency_sigma=0.0, success_prob=0.5, timeout_prob=0
+    )
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    with MockIsaEvalServer(config=config) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        state = client.proceed_until(thy_path, lemma, 60)
+        found, proof_steps, summary = IsaBestFirstSearch(
+            gen_length=4, pipelined=True
+        ).solve(state, SlowAgent(), client)
+        assert found
+        assert summary.overlap_time > 0
+        state = client.proceed_until(thy_path, lemma, 60)
+        for step in proof_steps:
+            state = client.execute("default", step, 10)
+        assert state.proof_is_finished()
+        client.close_itp()
+
+
+def test_pipelined_search_removes_the_states_of_the_last_batch(tmp_path):
+    # tactics never close a subgoal, so the search runs into its query limit
+    # with a batch still in flight
+    config = MockConfig(time_scale=0, success_prob=0.8, progress_prob=0)
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    with MockIsaEvalServer(config=config) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        client.proceed_until(thy_path, lemma, 60)
+        snapshot = client.clone_state("default")
+        found, _, summary = IsaBestFirstSearch(
+            gen_length=4, query_limit=5, pipelined=True
+        ).solve(snapshot, TacticAgent(), client, isolated=True)
+        assert not found and summary.failure_reason == "query limit reached"
+        assert set(server.servicer.states) == {"default", snapshot.state_id}
+        client.close_itp()
@@ -0,0 +1,81 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from agent import EvalAgent, EvalAgentOutput
+from client import IsaEvalClient, IsaSetup
+from mock_server import MockConfig, MockIsaEvalServer, write_mock_theories
+from search import IsaBestFirstSearch
+from timeouts import AdaptiveTimeoutPolicy, tactic_family
+
+
+class TacticAgent(EvalAgent):
+    def query(self, state: str, gen_length: int) -> List[EvalAgentOutput]:
+        return [EvalAgentOutput(f"apply tactic_{i}", -i) for i in range(gen_length)]
+
+
+class RecordingPolicy(AdaptiveTimeoutPolicy):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.latencies = []
+
+    def observe(self, command, session, result, latency, timeout, max_timeout):
+        self.latencies.append(latency)
+        super().observe(command, session, result, latency, timeout, max_timeout)
+
+
+def test_tactic_family():
+    assert tactic_family("apply simp") == "simp"
+    assert tactic_family("by (auto simp: foo)") == "auto"
+    assert tactic_family("using assms by blast") == "blast"
+    assert tactic_family("sledgehammer") == "sledgehammer"
+
+
+def test_timeout_follows_learned_latencies():
+    policy = AdaptiveTimeoutPolicy(min_samples=5)
+    assert policy.timeout_for("by simp", "HOL", 30) == 30
+    for _ in range(5):
+        policy.observe("by simp", "HOL", "SUCCESS", 0.3, 30, 30)
+        policy.observe("by auto", "HOL", "SUCCESS", 3.0, 30, 30)
+    # twice the upper bound of the bucket of the 0.99 quantile
+    assert policy.timeout_for("apply simp", "HOL", 30) == 1
+    assert policy.timeout_for("apply auto", "HOL", 30) == 10
+    # other sessions fall back to the statistics across sessions
+    assert policy.timeout_for("apply auto", "Main", 30) == 10
+    assert policy.timeout_for("apply auto", "Main", 5) == 5
+
+
+def test_timeouts_under_a_reduced_budget_are_retried_while_retries_succeed():
+    policy = AdaptiveTimeoutPolicy(min_samples=1, retry_min_success_rate=0.3)
+    policy.observe("by simp", None, "SUCCESS", 0.3, 30, 30)
+    assert not policy.should_retry("by simp", None, 30, 30)
+    assert policy.should_retry("by simp", None, 1, 30)
+    for _ in range(3):
+        policy.observe_retry("by simp", None, 1, "TIMEOUT")
+    assert not policy.should_retry("by simp", None, 1, 30)
+
+
+def test_search_observes_the_latency_of_each_command(tmp_path):
+    # every command takes 0.05 simulated seconds, so anything longer would
+    # be time spent waiting for the other commands of the batch
+    config = MockConfig(
+        time_scale=1.0,
+        latency_median=0.05,
+        latency_sigma=0.0,
+        timeout_prob=0.0,
+        success_prob=0.5,
+    )
+    (thy_path,) = write_mock_theories(tmp_path, 1, 1)
+    lemma = [l for l in thy_path.read_text().splitlines() if l.startswith("lemma")][0]
+    policy = RecordingPolicy()
+    with MockIsaEvalServer(config=config) as server:
+        client = IsaEvalClient(server.port)
+        client.setup_itp(IsaSetup(Path("/mock"), "HOL", tmp_path, None))
+        state = client.proceed_until(thy_path, lemma, 60)
+        IsaBestFirstSearch(
+            gen_length=8, batch_size=2, query_limit=6, timeout_policy=policy
+        ).solve(state, TacticAgent(), client)
+        client.close_itp()
+    assert len(policy.latencies) > 8
+    assert policy.latencies == pytest.approx([0.05] * len(policy.latencies))
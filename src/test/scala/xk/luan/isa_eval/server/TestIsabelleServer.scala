@@ -56,6 +56,21 @@ class TestIsabelleServer extends AnyFunSuite {
     println(is.stateSummary)
   }
 
+  test("Test removeStates") {
+    val is = new IsabelleServer(
+      isaPath = isaPath,
+      sessionName = "Main",
+      workingDirectory = isaPath / "src" / "HOL",
+      sessionRoots = sessionRoots
+    )
+    val init = is.proceedUntil(os.pwd / "src" / "main" / "resources" / "Test.thy", 5, after = true, timeout = 300)
+    val clones = is.cloneState(init.stateId, 3)
+    is.removeStates(clones :+ "unknown")
+    clones.foreach(id => assert(!is.stateSummary.contains(id)))
+    assert(is.stateSummary.contains(init.stateId))
+    is.close()
+  }
+
   test("Test executeMultipleCommands") {
     val is = new IsabelleServer(
       isaPath = isaPath,
@@ -72,6 +87,53 @@ class TestIsabelleServer extends AnyFunSuite {
     outcomes.filter(_.isFailure).foreach(o => is.removeState(o.stateId))
   }
 
+  test("Test executeMultipleCommandsAsync") {
+    val is = new IsabelleServer(
+      isaPath = isaPath,
+      sessionName = "Main",
+      workingDirectory = isaPath / "src" / "HOL",
+      sessionRoots = sessionRoots
+    )
+    val outcome = is.proceedUntil(os.pwd / "src" / "main" / "resources" / "Test.thy", 5, after = true, timeout = 300)
+    val pending = is.executeMultipleCommandsAsync(List("by simp", "by auto", "qed", ".", "qe"), outcome.stateId)
+    val outcomes = pending.map(p => scala.concurrent.Await.result(p._2, scala.concurrent.duration.Duration.Inf))
+    println(outcomes)
+    assert(outcomes.length == 5)
+    println(is.stateSummary)
+  }
+
+  test("Test executeBatchAsync") {
+    val is = new IsabelleServer(
+      isaPath = isaPath,
+      sessionName = "Main",
+      workingDirectory = isaPath / "src" / "HOL",
+      sessionRoots = sessionRoots
+    )
+    val init = is.proceedUntil(os.pwd / "src" / "main" / "resources" / "Test.thy", 5, after = true, timeout = 300)
+    val other = is.cloneState(init.stateId)
+    val pending = is.executeBatchAsync(
+      List((init.stateId, "by simp", 10), (other, "by auto", 10), (other, "qed", 1))
+    )
+    val outcomes = pending.map(p => scala.concurrent.Await.result(p._2, scala.concurrent.duration.Duration.Inf))
+    println(outcomes)
+    assert(outcomes.map(_.stateId) == pending.map(_._1))
+  }
+
+  test("Test cancelExecution") {
+    val is = new IsabelleServer(
+      isaPath = isaPath,
+      sessionName = "Main",
+      workingDirectory = isaPath / "src" / "HOL",
+      sessionRoots = sessionRoots
+    )
+    val outcome = is.proceedUntil(os.pwd / "src" / "main" / "resources" / "Test.thy", 5, after = true, timeout = 300)
+    val pending = is.executeMultipleCommandsAsync(List("by simp", "by (rule ccontr, auto)", "by blast"), outcome.stateId, 30)
+    is.cancelExecution(pending.map(_._1))
+    val outcomes = pending.map(p => scala.concurrent.Await.result(p._2, scala.concurrent.duration.Duration.Inf))
+    println(outcomes)
+    outcomes.filter(_.result == "CANCELLED").foreach(o => assert(!is.stateSummary.contains(o.stateId)))
+  }
+
   test("Test tryCommands") {
     val is = new IsabelleServer(
       isaPath = isaPath,
@@ -97,4 +159,21 @@ class TestIsabelleServer extends AnyFunSuite {
     println(result)
     println(is.stateSummary)
   }
+
+  test("Test IsabelleServerPool") {
+    val pool = new IsabelleServerPool(maxSize = 2)
+    val mainKey = IsabelleSetupKey(isaPath, "Main", isaPath / "src" / "HOL", sessionRoots)
+    val holKey = IsabelleSetupKey(isaPath, "HOL", isaPath / "src" / "HOL", sessionRoots)
+    val main = pool.acquire(mainKey)
+    assert(pool.acquire(mainKey) eq main)
+    pool.acquire(holKey)
+    assert(pool.size == 2)
+    // Main is the most recently used, so HOL is evicted
+    pool.acquire(mainKey)
+    pool.acquire(IsabelleSetupKey(isaPath, "Pure", isaPath / "src" / "Pure", sessionRoots))
+    assert(pool.size == 2)
+    assert(pool.acquire(mainKey) eq main)
+    println(IsabelleServerPool.availableMemoryMB)
+    pool.closeAll()
+  }
 }